@@ -0,0 +1,125 @@
+"""Cached group admin rosters for the admin-only commands (/draw, the Draw button, /cancel).
+
+Checking admin rights used to cost a get_chat_member round trip on every attempt, and a
+network blip meant "Could not verify admin status". Instead, one get_chat_administrators
+call fills the group's admin set, which is trusted for TTL_SECONDS. ChatMemberUpdated
+updates that touch an admin (someone promoted or demoted, an admin leaving) or the bot's
+own rights mark the group's entry expired, so the next check refetches; ordinary members
+joining and leaving don't.
+
+If the Bot API can't be reached when an entry has expired, the old set is still used for
+up to MAX_STALE_SECONDS more; after that the check fails rather than trusting data that old.
+Concurrent checks for the same group share one API call.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from telegram import ChatMember
+from telegram.error import NetworkError, RetryAfter
+
+TTL_SECONDS = 10 * 60
+MAX_STALE_SECONDS = 60 * 60
+MAX_GROUPS = 10000
+ADMIN_STATUSES = {ChatMember.ADMINISTRATOR, ChatMember.OWNER}
+
+
+class _Entry(NamedTuple):
+    admin_ids: frozenset
+    fetched_at: float
+    expired: bool = False
+
+
+def changes_admins(update):
+    """Whether a ChatMemberUpdated update can change who the group's admins are."""
+    if update.my_chat_member is not None:
+        return True
+    change = update.chat_member
+    return change is not None and (change.old_chat_member.status in ADMIN_STATUSES
+                                   or change.new_chat_member.status in ADMIN_STATUSES)
+
+
+class AdminCache:
+    """Per-group admin sets, LRU-evicted beyond max_groups."""
+
+    def __init__(self, ttl=TTL_SECONDS, max_stale=MAX_STALE_SECONDS, max_groups=MAX_GROUPS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_groups = max_groups
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._fetches = {}
+        # Groups whose fetch in flight started before an invalidate(), so it mustn't store what it
+        # read; only ever holds groups in _fetches
+        self._outdated = set()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+
+    async def admin_ids(self, bot, group_id):
+        """Returns the user ids of the group's administrators (creator included).
+
+        Raises the Bot API error if there's no usable entry and the fetch fails.
+        """
+        entry = self._entries.get(group_id)
+        age = self._clock() - entry.fetched_at if entry else None
+        if entry and not entry.expired and age < self.ttl:
+            self._hits += 1
+            self._entries.move_to_end(group_id)
+            return entry.admin_ids
+
+        self._misses += 1
+        try:
+            return await self._fetch(bot, group_id)
+        except (NetworkError, RetryAfter) as e:
+            if entry and age < self.ttl + self.max_stale:
+                self._stale += 1
+                logging.info(f"Using admin list for {group_id} from {age:.0f}s ago; Bot API unavailable: {e}")
+                return entry.admin_ids
+            raise
+
+    async def is_admin(self, bot, group_id, user_id):
+        return user_id in await self.admin_ids(bot, group_id)
+
+    def _fetch(self, bot, group_id):
+        fetch = self._fetches.get(group_id)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._load(bot, group_id))
+            self._fetches[group_id] = fetch
+            fetch.add_done_callback(lambda f: self._fetch_done(group_id, f))
+        return asyncio.shield(fetch)
+
+    def _fetch_done(self, group_id, fetch):
+        self._fetches.pop(group_id, None)
+        self._outdated.discard(group_id)
+        if not fetch.cancelled():
+            fetch.exception()   # Mark it retrieved; the callers that were waiting handle it
+
+    async def _load(self, bot, group_id):
+        members = await bot.get_chat_administrators(group_id)
+        admin_ids = frozenset(member.user.id for member in members)
+        if group_id not in self._outdated:
+            self._entries[group_id] = _Entry(admin_ids, self._clock())
+            self._entries.move_to_end(group_id)
+            while len(self._entries) > self.max_groups:
+                self._entries.popitem(last=False)
+        return admin_ids
+
+    def invalidate(self, group_id):
+        """Makes the next check refetch the group's admins, e.g. after a ChatMemberUpdated.
+
+        The old set is kept, marked expired, as the fallback for when the Bot API is down.
+        """
+        entry = self._entries.get(group_id)
+        if entry is not None:
+            self._entries[group_id] = entry._replace(expired=True)
+        if group_id in self._fetches:
+            self._outdated.add(group_id)
+
+    def stats(self):
+        return {'hits': self._hits, 'misses': self._misses, 'stale': self._stale, 'size': len(self._entries)}
+
+
+cache = AdminCache()
@@ -0,0 +1,140 @@
+"""Admission control: which updates get to run a handler at all.
+
+PerChatUpdateProcessor asks check() about every update before it waits for anything. Only
+commands and button presses are limited; everything else (members joining or leaving, the
+bot being added to a group, the date typed in reply to /setdate) always gets in, since
+dropping it would lose state the user can't simply ask for again.
+
+- Each user and each chat has a token bucket (USER_RATE / CHAT_RATE per second, bursts of
+  USER_BURST / CHAT_BURST). An update that finds its bucket empty is dropped, so one person
+  hammering the Join button, or one group flooding the bot, can't crowd out everyone else.
+- A chat with CHAT_BACKLOG updates already waiting only gets high-priority ones (draws and
+  joins) through; the rest are dropped instead of queueing behind the backlog.
+- When the bot as a whole has SHED_BACKLOG updates waiting, low-priority commands
+  (/participants, /daysleft, /showdate) are dropped first. Their answers only save the user
+  a look at the roster message, and they can simply ask again.
+
+A Join click that is dropped is still answered, so the button doesn't spin; dropped
+commands get no reply, since replying is the work being shed.
+"""
+import logging
+import os
+import time
+
+from cachetools import TTLCache
+from telegram import Update
+
+import metrics
+
+USER_RATE = float(os.getenv('ADMISSION_USER_RATE') or 1)
+USER_BURST = int(os.getenv('ADMISSION_USER_BURST') or 5)
+CHAT_RATE = float(os.getenv('ADMISSION_CHAT_RATE') or 20)
+CHAT_BURST = int(os.getenv('ADMISSION_CHAT_BURST') or 100)
+CHAT_BACKLOG = int(os.getenv('ADMISSION_CHAT_BACKLOG') or 50)
+SHED_BACKLOG = int(os.getenv('ADMISSION_SHED_BACKLOG') or 200)
+MAX_TRACKED = 100000
+
+LOW, NORMAL, HIGH = 0, 1, 2
+LOW_PRIORITY_COMMANDS = {'participants', 'daysleft', 'reminddays', 'showdate'}
+HIGH_PRIORITY_COMMANDS = {'draw', 'redraw', 'join'}
+HIGH_PRIORITY_CALLBACKS = {'join_game', 'go_draw'}
+
+SLOW_DOWN_TEXT = "Slow down! Try again in a few seconds."
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate, burst, now):
+        """Refills for the time passed and takes a token. Returns False if there was none."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """A token bucket per key. Buckets idle long enough to have refilled are forgotten."""
+
+    def __init__(self, rate, burst, max_keys=MAX_TRACKED):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = TTLCache(maxsize=max_keys, ttl=burst / rate)
+
+    def allow(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        else:
+            # Re-inserting restarts the idle timer
+            self._buckets[key] = bucket
+        return bucket.take(self.rate, self.burst, now)
+
+
+def command_name(update):
+    """The bot command an update carries ('participants' for "/participants@santa_bot 5"), or None."""
+    text = update.message.text if update.message is not None else None
+    words = text[1:].split(maxsplit=1) if text and text.startswith('/') else None
+    return words[0].split('@', 1)[0].lower() if words else None
+
+
+def is_request(update):
+    """Whether the update is a command or a button press, the only updates admission limits."""
+    return update.callback_query is not None or command_name(update) is not None
+
+
+def priority(update):
+    if update.callback_query is not None:
+        return HIGH if update.callback_query.data in HIGH_PRIORITY_CALLBACKS else NORMAL
+    command = command_name(update)
+    if command in LOW_PRIORITY_COMMANDS:
+        return LOW
+    if command in HIGH_PRIORITY_COMMANDS:
+        return HIGH
+    return NORMAL
+
+
+class AdmissionControl:
+    def __init__(self, shed_backlog=SHED_BACKLOG, chat_backlog=CHAT_BACKLOG):
+        self.users = RateLimiter(USER_RATE, USER_BURST)
+        self.chats = RateLimiter(CHAT_RATE, CHAT_BURST)
+        self.shed_backlog = shed_backlog
+        self.chat_backlog = chat_backlog
+
+    def check(self, update, backlog, chat_backlog):
+        """Returns why the update should be dropped, or None to let it in.
+
+        backlog: updates waiting across the bot; chat_backlog: those outstanding for this chat.
+        """
+        if not isinstance(update, Update) or not is_request(update):
+            return None
+        level = priority(update)
+        if level == LOW and backlog >= self.shed_backlog:
+            return 'overload'
+        if level < HIGH and chat_backlog >= self.chat_backlog:
+            return 'chat_backlog'
+        now = time.monotonic()
+        user = update.effective_user
+        if user is not None and not self.users.allow(user.id, now):
+            return 'user_rate'
+        chat = update.effective_chat
+        if chat is not None and not self.chats.allow(chat.id, now):
+            return 'chat_rate'
+        return None
+
+    async def reject(self, update, reason):
+        """Counts a dropped update and, for a button press, answers it."""
+        metrics.inc('santa_updates_shed_total', reason, help_text='Updates dropped by admission control',
+                    label='reason')
+        if update.callback_query is not None:
+            try:
+                await update.callback_query.answer(SLOW_DOWN_TEXT)
+            except Exception as e:
+                logging.info(f"Admission: could not answer a dropped button press: {e}")
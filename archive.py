@@ -0,0 +1,409 @@
+"""Cold storage for old seasons, so the live database only holds games still in play.
+
+Seasons that ended (were cancelled after their draw, see /cancel) more than
+ARCHIVE_AFTER_DAYS ago, and active seasons whose draw is done and whose exchange date (or
+start date, if none was set) is that old, are moved out of the SQLite database into an
+archive directory (ARCHIVE_DIR, by default santa.archive/ next to santa.db):
+
+    segment-000001.jsonl.zst   append-only segments; each game is one JSON line (the games
+                               row, its participants in join order and its assignments)
+                               compressed as its own zstd frame
+    index.db                   where each game's frame is, by (group_id, season), and which
+                               seasons each santa drew in, for /history
+
+Frames are independent, so a lookup reads and decompresses only its own bytes, while a
+whole segment still decompresses as one stream (zstd -dc segment-000001.jsonl.zst).
+Segments are never rewritten: a run appends to the newest one until it passes SEGMENT_BYTES.
+
+A run appends the frames and fsyncs them, records them in the index, then deletes the games
+from the database and hands the freed pages back with an incremental vacuum, a few at a
+time so the bot's writes get in between. If a run is cut short after the index was written,
+the next one finishes deleting those games; frames written but never indexed are dead bytes.
+Active seasons are compressed and written without holding the database's write lock, so the
+bot can still /cancel or /redraw them meanwhile; a season that changed is left live and its
+frame is never indexed.
+A group whose active season was archived gets a new one the next time it plays.
+
+Databases created before incremental vacuum need one full VACUUM to switch over, which holds
+the write lock for as long as it takes to rewrite the whole file. The bot's daily run never
+does it (archived pages are reused, just not handed back); run `python archive.py` once with
+the bot stopped to convert. After that every run only does the short incremental steps.
+
+The bot runs it daily when ARCHIVE_AFTER_DAYS is set; from the command line:
+
+    python archive.py --days 365
+    python archive.py --days 365 --db /srv/santa/santa.db
+
+Archived seasons still show up in /history and in `santactl.py archived`.
+"""
+import asyncio
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+
+import click
+import zstandard
+
+import database
+import state_cache
+from connection_pool import ConnectionPool
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS') or 0)
+ARCHIVE_INTERVAL_SECONDS = 24 * 60 * 60
+SEGMENT_BYTES = 64 * 1024 * 1024
+COMPRESSION_LEVEL = 10
+BATCH_GAMES = 200
+VACUUM_PAGES = 1000
+
+INDEX_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS games (
+        group_id INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        ended_at TEXT,
+        participants INTEGER NOT NULL,
+        segment INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (group_id, season)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS santas (
+        santa_id INTEGER NOT NULL,
+        group_id INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        PRIMARY KEY (santa_id, group_id, season)
+    ) WITHOUT ROWID
+    """,
+)
+
+# Active seasons that are over: (exchange date cutoff, start cutoff) parameters
+_ACTIVE_DONE = ("active = 1 AND status = 'COMPLETED' "
+                "AND (exchange_on < ? OR (exchange_on IS NULL AND date_started < ?))")
+_SEGMENT_NAME = re.compile(r'segment-(\d+)\.jsonl\.zst$')
+_GAME_COLUMNS = ('game_id', 'group_id', 'season', 'status', 'date_started', 'exchange_date', 'exchange_on',
+                 'roster_message_id', 'ended_at')
+
+
+def default_dir(db_path):
+    """The archive directory for a database file: santa.db (or one of its shards) -> santa.archive."""
+    return re.sub(r'\.\d+-of-\d+$', '', os.path.splitext(db_path)[0]) + '.archive'
+
+
+def archive_dir():
+    return os.getenv('ARCHIVE_DIR') or default_dir(database.DATABASE_NAME)
+
+
+def index_path(directory):
+    return os.path.join(directory, 'index.db')
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"segment-{segment:06d}.jsonl.zst")
+
+
+def read_record(directory, segment, position, length):
+    """Reads one archived game: {'game': {...}, 'participants': [...], 'assignments': [...]}."""
+    with open(segment_path(directory, segment), 'rb') as f:
+        f.seek(position)
+        frame = f.read(length)
+    return json.loads(zstandard.ZstdDecompressor().decompress(frame))
+
+
+def season_year(game):
+    """Same as get_draw_history's year: the exchange date's year, else the year the season started."""
+    day = game.get('exchange_on') or game.get('date_started')
+    return int(day[:4]) if day else None
+
+
+class Archive:
+    """The segments and index in one archive directory."""
+
+    def __init__(self, directory, readers=2):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.pool = ConnectionPool(index_path(directory), readers=readers)
+        with self.pool.writer() as conn:
+            for statement in INDEX_SCHEMA:
+                conn.execute(statement)
+
+    def close(self):
+        self.pool.close()
+
+    def _segments(self):
+        paths = glob.glob(os.path.join(glob.escape(self.directory), 'segment-*.jsonl.zst'))
+        return sorted(int(m.group(1)) for m in map(_SEGMENT_NAME.search, paths) if m)
+
+    def _append(self, frames):
+        """Appends the frames to the newest segment (or a new one). Returns (segment, position) of each."""
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        path = segment_path(self.directory, segment)
+        if os.path.exists(path) and os.path.getsize(path) >= SEGMENT_BYTES:
+            segment += 1
+            path = segment_path(self.directory, segment)
+        locations = []
+        with open(path, 'ab') as f:
+            position = f.seek(0, os.SEEK_END)
+            for frame in frames:
+                locations.append((segment, position))
+                f.write(frame)
+                position += len(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        return locations
+
+    def write(self, records):
+        """Appends the records to a segment without indexing them.
+        Returns (record, segment, position, length) for each, to pass to index()."""
+        compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+        frames = [compressor.compress(json.dumps(record, separators=(',', ':')).encode() + b"\n") for record in records]
+        # The index's write lock also keeps two archivers from appending at once
+        with self.pool.writer():
+            locations = self._append(frames)
+        return [(record, segment, position, len(frame))
+                for record, frame, (segment, position) in zip(records, frames, locations)]
+
+    def index(self, written, drop=()):
+        """Indexes records from write(), and forgets the (group_id, season) keys in `drop`."""
+        with self.pool.writer() as conn:
+            for group_id, season in drop:
+                conn.execute("DELETE FROM games WHERE group_id = ? AND season = ?", (group_id, season))
+                conn.execute("DELETE FROM santas WHERE group_id = ? AND season = ?", (group_id, season))
+            for record, segment, position, length in written:
+                game = record['game']
+                conn.execute("DELETE FROM santas WHERE group_id = ? AND season = ?", (game['group_id'], game['season']))
+                conn.execute("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (game['group_id'], game['season'], game['ended_at'], len(record['participants']),
+                              segment, position, length))
+                conn.executemany("INSERT OR IGNORE INTO santas VALUES (?, ?, ?)",
+                                 [(a['santa_id'], game['group_id'], game['season']) for a in record['assignments']])
+
+    def store(self, records):
+        """Writes the records to a segment and indexes them."""
+        self.index(self.write(records))
+
+    def indexed(self, keys):
+        """Which of the (group_id, season) keys are archived already."""
+        with self.pool.reader() as conn:
+            return {key for key in keys
+                    if conn.execute("SELECT 1 FROM games WHERE group_id = ? AND season = ?", key).fetchone()}
+
+    def last_pairs(self, group_id):
+        """The (santa_id, target_id) pairs of the group's newest archived season, or []."""
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT segment, position, length FROM games WHERE group_id = ? "
+                               "ORDER BY season DESC LIMIT 1", (group_id,)).fetchone()
+        if row is None:
+            return []
+        return [(a['santa_id'], a['target_id']) for a in read_record(self.directory, *row)['assignments']]
+
+    def draw_history(self, user_id, seasons, live):
+        """Adds archived seasons to get_draw_history's rows from the live database, up to `seasons`
+        per group. Archived seasons are always older than the group's live ones."""
+        taken = {}
+        for group_id, season, _, _ in live:
+            taken.setdefault(group_id, set()).add(season)
+        wanted = []
+        with self.pool.reader() as conn:
+            for group_id, season, segment, position, length in conn.execute(
+                    "SELECT s.group_id, s.season, g.segment, g.position, g.length FROM santas s "
+                    "JOIN games g ON g.group_id = s.group_id AND g.season = s.season "
+                    "WHERE s.santa_id = ? ORDER BY s.group_id, s.season DESC", (user_id,)):
+                group_seasons = taken.setdefault(group_id, set())
+                if season not in group_seasons and len(group_seasons) < seasons:
+                    group_seasons.add(season)
+                    wanted.append((group_id, season, segment, position, length))
+        if not wanted:
+            return live
+
+        history = list(live)
+        for group_id, season, segment, position, length in wanted:
+            record = read_record(self.directory, segment, position, length)
+            names = {p['user_id']: p['username'] for p in record['participants']}
+            target_id = next(a['target_id'] for a in record['assignments'] if a['santa_id'] == user_id)
+            history.append((group_id, season, season_year(record['game']), names.get(target_id)))
+        return sorted(history, key=lambda row: (row[0], -row[1]))
+
+
+def _records(conn, game_ids):
+    """The archive records of the games, read from the live database."""
+    placeholders = ','.join('?' * len(game_ids))
+    records = {}
+    for row in conn.execute(f"SELECT {','.join(_GAME_COLUMNS)} FROM games WHERE game_id IN ({placeholders})", game_ids):
+        records[row[0]] = {'game': dict(zip(_GAME_COLUMNS, row)), 'participants': [], 'assignments': []}
+    for game_id, user_id, username, first_name in conn.execute(
+            f"SELECT game_id, user_id, username, first_name FROM participants WHERE game_id IN ({placeholders}) "
+            f"ORDER BY game_id, seq", game_ids):
+        records[game_id]['participants'].append({'user_id': user_id, 'username': username, 'first_name': first_name})
+    for game_id, santa_id, target_id in conn.execute(
+            f"SELECT game_id, santa_id, target_id FROM assignments WHERE game_id IN ({placeholders}) "
+            f"ORDER BY game_id, santa_id", game_ids):
+        records[game_id]['assignments'].append({'santa_id': santa_id, 'target_id': target_id})
+    return [records[game_id] for game_id in game_ids]
+
+
+def _delete_games(conn, games):
+    """Deletes the archived games. A group whose every season is gone keeps a stub row for the
+    newest one, status ARCHIVED, so its next season isn't numbered 1 again."""
+    conn.executemany("DELETE FROM games WHERE group_id = ? AND season < ? AND status = 'ARCHIVED'",
+                     [(group_id, season) for _, group_id, season in games])
+    game_ids = [(game_id,) for game_id, _, _ in games]
+    for table in ('participants', 'assignments', 'draw_jobs', 'games'):
+        conn.executemany(f"DELETE FROM {table} WHERE game_id = ?", game_ids)
+    newest = {}
+    for _, group_id, season in games:
+        newest[group_id] = max(season, newest.get(group_id, 0))
+    ended = datetime.datetime.now().isoformat()
+    conn.executemany("INSERT INTO games (group_id, season, status, active, ended_at) SELECT ?, ?, 'ARCHIVED', 0, ? "
+                     "WHERE NOT EXISTS (SELECT 1 FROM games WHERE group_id = ?)",
+                     [(group_id, season, ended, group_id) for group_id, season in newest.items()])
+
+
+def _store_new(conn, archive, games):
+    done = archive.indexed([(group_id, season) for _, group_id, season in games])
+    new = [game_id for game_id, group_id, season in games if (group_id, season) not in done]
+    if new:
+        archive.store(_records(conn, new))
+
+
+def archive_games(pool, archive, cutoff):
+    """Moves the seasons in `pool`'s database that are over into the archive: past seasons that
+    ended before `cutoff`, and active ones whose draw is done and whose exchange date (or start,
+    without one) is before it. Returns how many were moved."""
+    moved = 0
+    while True:
+        # Past seasons are never written again, so reading them outside the write lock is safe
+        with pool.reader() as conn:
+            games = conn.execute("SELECT game_id, group_id, season FROM games "
+                                 "WHERE active = 0 AND ended_at < ? AND status != 'ARCHIVED' "
+                                 "ORDER BY game_id LIMIT ?", (cutoff.isoformat(), BATCH_GAMES)).fetchall()
+            if not games:
+                break
+            _store_new(conn, archive, games)
+        with pool.writer() as conn:
+            _delete_games(conn, games)
+        moved += len(games)
+
+    done = (cutoff.date().isoformat(), cutoff.isoformat())
+    while True:
+        # The bot can still touch an active season (/cancel, /redraw, /setdate), so the segments
+        # are written outside the write lock; then, in one short write transaction, only the games
+        # still exactly as written are indexed and deleted. Frames of the others are dead bytes.
+        with pool.reader() as conn:
+            games = conn.execute(f"SELECT game_id, group_id, season FROM games WHERE {_ACTIVE_DONE} "
+                                 f"ORDER BY game_id LIMIT ?", done + (BATCH_GAMES,)).fetchall()
+            if not games:
+                return moved
+            records = _records(conn, [game_id for game_id, _, _ in games])
+        written = archive.write(records)
+        with pool.writer() as conn:
+            placeholders = ','.join('?' * len(games))
+            games = conn.execute(f"SELECT game_id, group_id, season FROM games WHERE {_ACTIVE_DONE} "
+                                 f"AND game_id IN ({placeholders}) ORDER BY game_id",
+                                 done + tuple(game_id for game_id, _, _ in games)).fetchall()
+            current = dict(zip((game_id for game_id, _, _ in games),
+                               _records(conn, [game_id for game_id, _, _ in games])))
+            unchanged = [entry for entry in written if current.get(entry[0]['game']['game_id']) == entry[0]]
+            kept = {entry[0]['game']['game_id'] for entry in unchanged}
+            # An earlier run cut short may have indexed a game that has changed since
+            archive.index(unchanged, drop=[(record['game']['group_id'], record['game']['season'])
+                                           for record in records if record['game']['game_id'] not in kept])
+            games = [game for game in games if game[0] in kept]
+            _delete_games(conn, games)
+        for _, group_id, _ in games:
+            state_cache.invalidate(group_id)
+        moved += len(games)
+
+
+def vacuum(pool, convert=True):
+    """Returns free pages to the filesystem, VACUUM_PAGES at a time. Returns how many were freed.
+
+    A database without incremental vacuum gets the one-off full VACUUM if `convert` is set,
+    and is left alone otherwise.
+    """
+    with pool.maintenance() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not convert:
+                logging.warning(f"Archive: {pool.path} needs a one-off full VACUUM before freed pages can be "
+                                f"returned; run `python archive.py` with the bot stopped")
+                return 0
+            logging.info(f"Archive: converting {pool.path} to incremental vacuum (one-off full VACUUM)")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return 0
+    freed = 0
+    while True:
+        # The write lock is released between steps so the bot's writes get in
+        with pool.maintenance() as conn:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                return freed
+            # executescript steps the pragma to the end; execute() would free a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            freed += free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def run(days, convert=True):
+    """Archives the seasons that ended more than `days` ago and vacuums. Returns how many moved.
+
+    `convert`: whether a database without incremental vacuum may get the blocking full VACUUM.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    archive = database.get_archive(create=True)
+    moved = 0
+    for pool in database.sqlite_pools():
+        count = archive_games(pool, archive, cutoff)
+        freed = vacuum(pool, convert)
+        if count or freed:
+            logging.info(f"Archive: moved {count} seasons out of {pool.path}, freed {freed} pages")
+        moved += count
+    return moved
+
+
+async def run_job(context):
+    """Job callback: a daily archive run."""
+    try:
+        # Batches take the write lock themselves; keep the rest off the database threads.
+        # No full VACUUM here: it would hold up every write while it runs
+        await asyncio.to_thread(run, ARCHIVE_AFTER_DAYS, False)
+    except Exception as e:
+        logging.warning(f"Archive: run failed: {e}")
+
+
+def schedule(application):
+    """Starts the daily archive job on the application's JobQueue, if ARCHIVE_AFTER_DAYS is set."""
+    if ARCHIVE_AFTER_DAYS and database.STORAGE_BACKEND == 'sqlite':
+        application.job_queue.run_repeating(run_job, interval=ARCHIVE_INTERVAL_SECONDS, first=300, name='archive')
+
+
+@click.command()
+@click.option('--days', type=click.IntRange(min=0), default=ARCHIVE_AFTER_DAYS or 365, show_default=True,
+              help="Archive seasons that ended more than this many days ago.")
+@click.option('--db', 'db_path', help=f"SQLite database file (default: {database.DATABASE_NAME}).")
+def main(days, db_path):
+    """Moves old past seasons into the compressed archive and vacuums the database."""
+    if database.STORAGE_BACKEND != 'sqlite':
+        raise click.ClickException("Archiving is for the SQLite backend only.")
+    if db_path:
+        database.DATABASE_NAME = db_path
+    database.init_db()
+    try:
+        moved = run(days)
+    finally:
+        database.close_db()
+    click.echo(f"{moved} seasons archived to {archive_dir()}.")
+
+
+if __name__ == '__main__':
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,222 @@
+"""Async access to database.py for the bot's handlers.
+
+SQLite calls block, so running them directly inside a handler stalls every other chat
+the bot is serving. These wrappers run the same functions off the event loop: writes go
+to a dedicated writer thread (there is only one writer connection anyway) and reads go
+to a small thread pool sized to the reader pool.
+
+With a sharded database each shard has its own writer thread, and a group's writes go
+to its shard's thread (run_group_write), so groups in different shards write in parallel.
+Writes that span groups use the first thread; each shard's own write lock keeps them safe.
+
+The synchronous functions in database.py remain the API for CLI scripts.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import state_cache
+
+_write_executors = None
+_read_executor = None
+
+
+def _executors():
+    global _write_executors, _read_executor
+    if _write_executors is None:
+        _write_executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-write-{lane}')
+                            for lane in range(database.write_lanes())]
+        _read_executor = ThreadPoolExecutor(max_workers=database.READ_POOL_SIZE, thread_name_prefix='db-read')
+    return _write_executors, _read_executor
+
+
+async def run_write(func, *args, **kwargs):
+    """Runs a blocking database write on the (first) writer thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors()[0][0], functools.partial(func, *args, **kwargs))
+
+
+async def run_group_write(group_id, func, *args, **kwargs):
+    """Runs a blocking database write for one group on the writer thread of its shard."""
+    loop = asyncio.get_running_loop()
+    executor = _executors()[0][database.write_lane(group_id)]
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_read(func, *args, **kwargs):
+    """Runs a blocking database read on the reader thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors()[1], functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Waits for queued database work to finish and stops the executor threads."""
+    global _write_executors, _read_executor
+    for executor in (_write_executors or []) + [_read_executor]:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    _write_executors = _read_executor = None
+
+
+# --- Reads ---
+
+async def get_group_state(group_id):
+    """Serves the group's state from the in-process cache, only hopping threads on a miss."""
+    state = state_cache.get(group_id)
+    if state is not None:
+        return state
+    return await run_read(database.load_group_state, group_id)
+
+
+async def load_group_state(group_id):
+    """Reads the group's state from the database, bypassing (and refreshing) the cache."""
+    return await run_read(database.load_group_state, group_id)
+
+
+async def get_game_status(group_id):
+    return (await get_group_state(group_id)).status
+
+
+async def get_participants_data(group_id):
+    return list((await get_group_state(group_id)).roster)
+
+
+async def get_exchange_date(group_id):
+    return (await get_group_state(group_id)).exchange_date
+
+
+def is_known_participant(group_id, user_id):
+    # In-memory only, so no thread hop
+    return database.is_known_participant(group_id, user_id)
+
+
+async def get_all_assignments_for_user(user_id):
+    return await run_read(database.get_all_assignments_for_user, user_id)
+
+
+async def get_draw_history(user_id, seasons=3):
+    return await run_read(database.get_draw_history, user_id, seasons)
+
+
+async def get_assignments(group_id):
+    return await run_read(database.get_assignments, group_id)
+
+
+async def get_draw_rules(group_id):
+    return await run_read(database.get_draw_rules, group_id)
+
+
+# --- Writes ---
+
+async def ensure_game_exists(group_id):
+    cached = state_cache.get(group_id)
+    if cached is not None and cached.status:
+        return
+    return await run_group_write(group_id, database.ensure_game_exists, group_id)
+
+
+async def update_game_status(group_id, status):
+    return await run_group_write(group_id, database.update_game_status, group_id, status)
+
+
+async def add_participant(user_id, group_id, username):
+    return await run_group_write(group_id, database.add_participant, user_id, group_id, username)
+
+
+async def add_participants_bulk(group_id, members):
+    return await run_group_write(group_id, database.add_participants_bulk, group_id, members)
+
+
+async def update_assignments_and_status(group_id, pairs):
+    return await run_group_write(group_id, database.update_assignments_and_status, group_id, pairs)
+
+
+async def try_set_status_to_drawing(group_id):
+    return await run_group_write(group_id, database.try_set_status_to_drawing, group_id)
+
+
+async def transition_game(group_id, event):
+    return await run_group_write(group_id, database.transition_game, group_id, event)
+
+
+async def start_draw_job(group_id, owner, lease_until):
+    return await run_group_write(group_id, database.start_draw_job, group_id, owner, lease_until)
+
+
+async def save_draw_job(group_id, owner, pairs, lease_until):
+    return await run_group_write(group_id, database.save_draw_job, group_id, owner, pairs, lease_until)
+
+
+async def queue_draw_dms(group_id, owner, entries):
+    return await run_group_write(group_id, database.queue_draw_dms, group_id, owner, entries)
+
+
+async def claim_draw_jobs(now, owner, lease_until, limit):
+    return await run_write(database.claim_draw_jobs, now, owner, lease_until, limit)
+
+
+async def abort_draw_job(group_id, owner):
+    return await run_group_write(group_id, database.abort_draw_job, group_id, owner)
+
+
+async def update_exchange_date(group_id, date_text, exchange_on=None):
+    return await run_group_write(group_id, database.update_exchange_date, group_id, date_text, exchange_on)
+
+
+async def cancel_game(group_id):
+    return await run_group_write(group_id, database.cancel_game, group_id)
+
+
+async def cancel_game_full(group_id):
+    return await run_group_write(group_id, database.cancel_game_full, group_id)
+
+
+# --- Roster message ---
+
+async def get_roster_message_id(group_id):
+    return await run_read(database.get_roster_message_id, group_id)
+
+
+async def set_roster_message_id(group_id, message_id):
+    return await run_group_write(group_id, database.set_roster_message_id, group_id, message_id)
+
+
+# --- Countdown reminders ---
+
+async def record_reminders(reminders):
+    return await run_write(database.record_reminders, reminders)
+
+
+async def prune_reminders(before):
+    return await run_write(database.prune_reminders, before)
+
+
+# --- Outbox ---
+
+async def enqueue_outbox(entries):
+    return await run_write(database.enqueue_outbox, entries)
+
+
+async def claim_outbox(now, lease_until, limit):
+    return await run_write(database.claim_outbox, now, lease_until, limit)
+
+
+async def claim_outbox_for_chat(chat_id, now, lease_until):
+    return await run_write(database.claim_outbox_for_chat, chat_id, now, lease_until)
+
+
+async def retry_outbox(retries):
+    return await run_write(database.retry_outbox, retries)
+
+
+async def finish_outbox(message_ids, status):
+    return await run_write(database.finish_outbox, message_ids, status)
+
+
+async def supersede_outbox(group_id, kind):
+    return await run_group_write(group_id, database.supersede_outbox, group_id, kind)
+
+
+async def prune_outbox(before):
+    return await run_write(database.prune_outbox, before)
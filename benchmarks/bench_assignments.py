@@ -0,0 +1,98 @@
+"""Benchmark: get_all_assignments_for_user as the assignments table grows.
+
+Builds a throwaway database with N groups of GROUP_SIZE participants (so N * GROUP_SIZE
+assignment rows), then times random per-user lookups. With idx_assignments_santa the
+lookup is an index seek, so the time per call should stay roughly flat as the table
+grows by orders of magnitude; pass --no-index to see the full-scan behaviour instead.
+
+Usage: python benchmarks/bench_assignments.py [--sizes 10000,100000,1000000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database  # noqa: E402
+
+GROUP_SIZE = 20
+# Users take part in a few groups each, like real people do
+USERS_PER_GROUP_POOL = 5
+
+
+def populate(total_rows):
+    """Fills the current database with roughly `total_rows` assignments."""
+    groups = max(1, total_rows // GROUP_SIZE)
+    user_pool = max(GROUP_SIZE, groups * GROUP_SIZE // USERS_PER_GROUP_POOL)
+    with database.get_pool().writer() as conn:
+        for group_id in range(1, groups + 1):
+            members = random.sample(range(1, user_pool + 1), GROUP_SIZE)
+            game_id = conn.execute(
+                "INSERT INTO games (group_id, season, status) VALUES (?, 1, 'COMPLETED')", (group_id,)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO participants (game_id, user_id, username, first_name, seq) VALUES (?, ?, ?, ?, ?)",
+                [(game_id, u, f"user{u}", f"user{u}", seq) for seq, u in enumerate(members, 1)]
+            )
+            conn.executemany(
+                "INSERT INTO assignments (game_id, santa_id, target_id) VALUES (?, ?, ?)",
+                [(game_id, members[i], members[(i + 1) % GROUP_SIZE]) for i in range(GROUP_SIZE)]
+            )
+    return user_pool
+
+
+def run(size, lookups, use_index):
+    workdir = tempfile.mkdtemp(prefix='santa-bench-')
+    database.DATABASE_NAME = os.path.join(workdir, 'bench.db')
+    database.init_db()
+    if not use_index:
+        with database.get_pool().writer() as conn:
+            conn.execute("DROP INDEX IF EXISTS idx_assignments_santa")
+
+    start = time.perf_counter()
+    user_pool = populate(size)
+    build_seconds = time.perf_counter() - start
+
+    with database.get_pool().reader() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM assignments").fetchone()[0]
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM assignments WHERE santa_id = ?", (1,)
+        ).fetchall()
+
+    users = [random.randint(1, user_pool) for _ in range(lookups)]
+    found = 0
+    start = time.perf_counter()
+    for user_id in users:
+        found += len(database.get_all_assignments_for_user(user_id))
+    elapsed = time.perf_counter() - start
+
+    database.close_db()
+    return {
+        'rows': rows,
+        'build_s': build_seconds,
+        'per_lookup_us': elapsed / lookups * 1e6,
+        'avg_results': found / lookups,
+        'plan': plan[0][-1] if plan else '',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated assignment table sizes')
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--no-index', action='store_true', help='drop idx_assignments_santa first')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'build s':>9} {'us/lookup':>10} {'avg hits':>9}  plan")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        result = run(size, args.lookups, not args.no_index)
+        print(f"{result['rows']:>10} {result['build_s']:>9.2f} {result['per_lookup_us']:>10.1f} "
+              f"{result['avg_results']:>9.2f}  {result['plan']}")
+
+
+if __name__ == '__main__':
+    main()
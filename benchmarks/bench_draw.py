@@ -0,0 +1,71 @@
+"""Benchmark: draw_engine.draw over participant counts and constraint densities.
+
+Scenarios per participant count:
+  none        no constraints (rejection-sampled derangement)
+  couples     everyone is in a couple that may not draw each other
+  last_year   nobody may draw last year's person
+  teams_k     teams of k people may not draw within their team
+  random_d    every santa has d random exclusions
+
+Every draw must finish within --max-ms (the engine's target: 10,000+ participants well
+under a second); the run exits non-zero listing the ones that didn't.
+
+Usage: python benchmarks/bench_draw.py [--sizes 100,1000,10000,20000] [--repeat 3] [--max-ms 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import draw_engine  # noqa: E402
+
+
+def scenarios(n, rng):
+    people = list(range(n))
+    yield 'none', {}
+    yield 'couples', {'exclusions': draw_engine.symmetric((i, i + 1) for i in range(0, n - 1, 2))}
+    yield 'last_year', {'exclusions': set(draw_engine.draw(people, rng=rng))}
+    for k in (10, 100):
+        if k * 2 <= n:
+            yield f'teams_{k}', {'groups': {p: p // k for p in people}}
+    yield 'teams_half', {'groups': {p: p % 2 for p in people}}
+    for d in (5, 50):
+        yield f'random_{d}', {'exclusions': {(p, rng.randrange(n)) for p in people for _ in range(d)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000,20000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-ms', type=float, default=500)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    slow = []
+    print(f"{'n':>7} {'scenario':<12} {'best ms':>9} {'worst ms':>9}  method")
+    for n in [int(s) for s in args.sizes.split(',')]:
+        for name, constraints in scenarios(n, rng):
+            times = []
+            info = {}
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                draw_engine.draw(range(n), rng=rng, info=info, **constraints)
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"{n:>7} {name:<12} {min(times):>9.1f} {max(times):>9.1f}  {info['method']}")
+            if max(times) > args.max_ms:
+                slow.append(f"n={n} {name}: {max(times):.0f} ms")
+
+    if slow:
+        print(f"FAILED: {len(slow)} draws took longer than {args.max_ms:.0f} ms")
+        for line in slow:
+            print("  " + line)
+        sys.exit(1)
+    print(f"OK: every draw within {args.max_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark: write throughput with the SQLite data split across 1, 2, 4, ... shards.
+
+Runs the bot's write path (async_db) against a throwaway database: GROUPS groups each get
+MEMBERS joins and then a draw, all groups at once. With one file every write queues behind
+one writer; with K shards each shard has its own writer thread, so throughput should grow
+with K until the disk or the CPU is the limit. The gain is largest where commits wait on the
+disk; on fast local storage the Python side of each write soon dominates instead.
+
+Usage: python benchmarks/bench_shards.py [--shards 1,2,4,8] [--groups 64] [--members 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import async_db  # noqa: E402
+import database  # noqa: E402
+from sharded_backend import ShardedSQLiteBackend  # noqa: E402
+from sqlite_backend import SQLiteBackend  # noqa: E402
+
+
+async def fill_group(group_id, members):
+    await async_db.ensure_game_exists(group_id)
+    for user_id in range(1, members + 1):
+        await async_db.add_participant(user_id, group_id, f"user{user_id}")
+    await async_db.transition_game(group_id, 'start_draw')
+    pairs = [(user_id, user_id % members + 1) for user_id in range(1, members + 1)]
+    await async_db.update_assignments_and_status(group_id, pairs)
+
+
+async def run(groups, members):
+    start = time.perf_counter()
+    await asyncio.gather(*(fill_group(-1000 - g, members) for g in range(groups)))
+    return time.perf_counter() - start
+
+
+def bench(shards, groups, members):
+    path = os.path.join(tempfile.mkdtemp(prefix='santa-shards-'), 'bench.db')
+    database.set_backend(SQLiteBackend(path) if shards == 1 else ShardedSQLiteBackend(path, shards))
+    database.init_db()
+    try:
+        elapsed = asyncio.run(run(groups, members))
+    finally:
+        async_db.shutdown()
+        database.close_db()
+    # Joins, the transition and the draw; ensure_game_exists is served from the cache after the first
+    writes = groups * (members + 3)
+    return elapsed, writes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shards', default='1,2,4,8', help='comma-separated shard counts')
+    parser.add_argument('--groups', type=int, default=64)
+    parser.add_argument('--members', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'seconds':>8} {'writes/s':>9}")
+    for shards in [int(s) for s in args.shards.split(',')]:
+        elapsed, rate = bench(shards, args.groups, args.members)
+        print(f"{shards:>6} {elapsed:>8.2f} {rate:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""Synthetic load test: drives the real handlers from main.py against a fake Bot API.
+
+The bot runs with a stand-in for python-telegram-bot's HTTP layer (FakeBotAPI), so every
+Bot API call is serialised and parsed exactly as in production but never leaves the
+process. The fake records calls and can inject latency, 429 flood-control responses and
+403 Forbidden errors for DMs (users who never started a chat with the bot).
+
+Each scenario runs N groups x M participants: every group is started, its members join
+(via the Join button, /join and some duplicate clicks) at the given overall join rate,
+then the read commands, the admin's /draw and /summary follow. Updates go through the
+application's update processor, as they would when polling.
+
+Results are printed as JSON: throughput, p50/p95/p99 latency per handler (arrival to
+completion), time spent in database.py and Bot API call counts.
+
+Usage:
+    python benchmarks/loadtest.py --groups 20 --members 30 --join-rate 200
+    python benchmarks/loadtest.py --scenario small --scenario peak --out results.json
+"""
+import argparse
+import asyncio
+import collections
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:LOADTEST')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import admission  # noqa: E402
+import async_db  # noqa: E402
+import database  # noqa: E402
+import main as bot  # noqa: E402
+import memory_backend  # noqa: E402
+import roster  # noqa: E402
+import update_processor  # noqa: E402
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Santa', 'username': 'santa_load_bot'}
+
+SCENARIOS = {
+    'small': dict(groups=5, members=10, join_rate=50),
+    'medium': dict(groups=20, members=40, join_rate=200),
+    'peak': dict(groups=50, members=100, join_rate=500, forbidden_rate=0.1, flood_rate=0.01),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        'max_ms': round(max(values) * 1000, 3) if values else None,
+    }
+
+
+class FakeBotAPI(BaseRequest):
+    """In-process stand-in for the Telegram Bot API at the HTTP request layer."""
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, forbidden_rate=0.0, retry_after=1,
+                 admins=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.forbidden_rate = forbidden_rate
+        self.retry_after = retry_after
+        self.admins = dict(admins or {})    # chat_id -> admin user_id
+        self.rng = random.Random(seed)
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self._counters = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    def _next_message_id(self, chat_id):
+        counter = self._counters.setdefault(chat_id, itertools.count(1000))
+        return next(counter)
+
+    def _blocks_bot(self, user_id):
+        # Stable per user, so retries see the same answer
+        return (user_id * 2654435761 % 1000) / 1000 < self.forbidden_rate
+
+    @staticmethod
+    def _reply(result):
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    @staticmethod
+    def _error(code, description, **parameters):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return code, json.dumps(body).encode()
+
+    @staticmethod
+    def _member(user_id, status):
+        member = {'status': status, 'user': {'id': user_id, 'is_bot': False, 'first_name': f'U{user_id}'}}
+        if status == 'administrator':
+            member.update({
+                'can_be_edited': False, 'is_anonymous': False, 'can_manage_chat': True,
+                'can_delete_messages': True, 'can_manage_video_chats': True, 'can_restrict_members': True,
+                'can_promote_members': False, 'can_change_info': True, 'can_invite_users': True,
+                'can_post_stories': False, 'can_edit_stories': False, 'can_delete_stories': False,
+            })
+        return member
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        if api_method != 'getMe' and self.flood_rate and self.rng.random() < self.flood_rate:
+            self.errors['429'] += 1
+            return self._error(429, f"Too Many Requests: retry after {self.retry_after}",
+                               retry_after=self.retry_after)
+
+        now = int(time.time())
+        if api_method == 'getMe':
+            return self._reply(BOT_USER)
+        if api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            if chat_id > 0 and self._blocks_bot(chat_id):
+                self.errors['403'] += 1
+                return self._error(403, "Forbidden: bot can't initiate conversation with a user")
+            message_id = params.get('message_id') or self._next_message_id(chat_id)
+            chat = {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+            return self._reply({'message_id': int(message_id), 'date': now, 'chat': chat,
+                                'from': BOT_USER, 'text': params.get('text', '')})
+        if api_method == 'getChatMember':
+            user_id = int(params['user_id'])
+            is_admin = self.admins.get(int(params['chat_id'])) == user_id
+            return self._reply(self._member(user_id, 'administrator' if is_admin else 'member'))
+        if api_method == 'getChatAdministrators':
+            admin = self.admins.get(int(params['chat_id']))
+            return self._reply([self._member(admin, 'administrator')] if admin else [])
+        # answerCallbackQuery, pinChatMessage, ... just succeed
+        return self._reply(True)
+
+
+class DatabaseTimer:
+    """Wraps database.py's query functions to measure time spent in SQLite (outermost calls only)."""
+
+    def __init__(self):
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self._local = threading.local()
+        self._originals = {}
+        self._lock = threading.Lock()
+
+    def install(self):
+        for name in database.QUERIES:
+            func = getattr(database, name)
+            self._originals[name] = func
+            setattr(database, name, self._wrap(name, func))
+
+    def uninstall(self):
+        for name, func in self._originals.items():
+            setattr(database, name, func)
+        self._originals.clear()
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+                if depth == 0:
+                    with self._lock:
+                        self.seconds[name] += time.perf_counter() - start
+                        self.calls[name] += 1
+        return timed
+
+
+class UpdateFactory:
+    """Builds Update objects the way Telegram would deliver them."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'U{user_id}', 'username': f'user{user_id}'}
+
+    @staticmethod
+    def group(group_id):
+        return {'id': group_id, 'type': 'supergroup', 'title': f'Load group {group_id}'}
+
+    def command(self, group_id, user_id, text):
+        command = text.split()[0]
+        message = {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': self.group(group_id), 'from': self.user(user_id), 'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        }
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message}, self.bot)
+
+    def button(self, group_id, user_id, data, message_id):
+        query = {
+            'id': str(next(self._update_ids)), 'from': self.user(user_id), 'chat_instance': str(group_id),
+            'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()), 'chat': self.group(group_id),
+                        'from': BOT_USER, 'text': 'Secret Santa'},
+        }
+        return Update.de_json({'update_id': next(self._update_ids), 'callback_query': query}, self.bot)
+
+
+def handler_name(update):
+    if update.callback_query:
+        return {'join_game': 'join_game_callback', 'go_draw': 'go_draw_callback'}.get(
+            update.callback_query.data, update.callback_query.data)
+    command = update.message.text.split()[0].lstrip('/')
+    return {'join': 'join_command', 'draw': 'draw_command', 'summary': 'summary_command',
+            'daysleft': 'days_left', 'start': 'start_secret_santa'}.get(command, command)
+
+
+async def run_scenario(name, groups, members, join_rate, latency=0.0, jitter=0.0, flood_rate=0.0,
+                       forbidden_rate=0.0, duplicate_rate=0.1, roster_window=0.5, concurrency=None, backend='sqlite', seed=0):
+    rng = random.Random(seed)
+    if backend == 'memory':
+        database.set_backend(memory_backend.MemoryBackend())
+    else:
+        database.DATABASE_NAME = os.path.join(tempfile.mkdtemp(prefix='santa-load-'), 'load.db')
+    database.init_db()
+
+    group_ids = [-1000000000000 - g for g in range(1, groups + 1)]
+    admins = {g: 10_000_000 + i * 1000 for i, g in enumerate(group_ids)}
+    api = FakeBotAPI(latency=latency, jitter=jitter, flood_rate=flood_rate, forbidden_rate=forbidden_rate,
+                     admins=admins, seed=seed)
+    builder = Application.builder().token(os.environ['TELEGRAM_TOKEN']).request(api) \
+        .get_updates_request(FakeBotAPI())
+    # Same per-chat ordered processing and admission control as production; concurrency=1
+    # measures sequential processing
+    concurrency = bot.MAX_CONCURRENT_UPDATES if concurrency is None else concurrency
+    if concurrency > 1:
+        builder = builder.concurrent_updates(
+            update_processor.PerChatUpdateProcessor(concurrency, admission=admission.AdmissionControl()))
+    application = builder.build()
+    bot.register_handlers(application)
+    # main.py looks the publisher up through the roster module, so this replaces it for the run
+    roster.publisher = roster.RosterPublisher(window=roster_window)
+    timer = DatabaseTimer()
+    timer.install()
+
+    latencies = collections.defaultdict(list)
+    failures = collections.Counter()
+    tasks = []
+    factory = UpdateFactory(application.bot)
+
+    async def deliver(update):
+        name = handler_name(update)
+        start = time.perf_counter()
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception:
+            failures[name] += 1
+        latencies[name].append(time.perf_counter() - start)
+
+    def submit(update):
+        tasks.append(asyncio.create_task(deliver(update)))
+
+    async with application:
+        started = time.perf_counter()
+
+        # 1. Every group starts a game; its admin joins first
+        for group_id in group_ids:
+            submit(factory.command(group_id, admins[group_id], '/start'))
+            submit(factory.command(group_id, admins[group_id], '/join'))
+        await asyncio.gather(*tasks)
+
+        # 2. Join storm, interleaved across groups at the overall join rate
+        joins = [(g, admins[g] + m) for g in group_ids for m in range(1, members)]
+        rng.shuffle(joins)
+        interval = 1.0 / join_rate if join_rate else 0
+        next_at = time.perf_counter()
+        for group_id, user_id in joins:
+            if rng.random() < 0.5:
+                update = factory.button(group_id, user_id, 'join_game', message_id=1)
+            else:
+                update = factory.command(group_id, user_id, '/join')
+            submit(update)
+            if rng.random() < duplicate_rate:
+                submit(factory.button(group_id, user_id, 'join_game', message_id=1))
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await asyncio.gather(*tasks)
+
+        # 3. Read commands, the draw, and the post-draw reads
+        for group_id in group_ids:
+            for text in ('/participants', '/daysleft', '/summary'):
+                submit(factory.command(group_id, admins[group_id] + rng.randrange(members), text))
+        await asyncio.gather(*tasks)
+        for group_id in group_ids:
+            submit(factory.command(group_id, admins[group_id], '/draw'))
+        await asyncio.gather(*tasks)
+        for group_id in group_ids:
+            submit(factory.command(group_id, admins[group_id] + rng.randrange(members), '/summary'))
+        await asyncio.gather(*tasks)
+        await roster.publisher.flush_all(application.bot)
+        elapsed = time.perf_counter() - started
+
+    timer.uninstall()
+    async_db.shutdown()
+    database.close_db()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    return {
+        'scenario': name,
+        'params': {'groups': groups, 'members': members, 'join_rate': join_rate, 'latency': latency,
+                   'jitter': jitter, 'flood_rate': flood_rate, 'forbidden_rate': forbidden_rate,
+                   'duplicate_rate': duplicate_rate, 'roster_window': roster_window, 'concurrency': concurrency, 'backend': backend},
+        'wall_s': round(elapsed, 3),
+        'updates': len(all_latencies),
+        'throughput_updates_per_s': round(len(all_latencies) / elapsed, 1) if elapsed else None,
+        'latency': {'all': summarize(all_latencies),
+                    **{name: summarize(values) for name, values in sorted(latencies.items())}},
+        'handler_errors': dict(failures),
+        'dropped': getattr(application.update_processor, 'dropped', 0),
+        'db': {'total_s': round(sum(timer.seconds.values()), 4),
+               'functions': {name: {'calls': timer.calls[name], 'total_s': round(timer.seconds[name], 4)}
+                             for name in sorted(timer.calls)}},
+        'api_calls': dict(sorted(api.calls.items())),
+        'api_calls_total': sum(api.calls.values()),
+        'api_errors_injected': dict(api.errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='predefined scenario (repeatable); overrides the individual parameters')
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--join-rate', type=float, default=100, help='joins per second across all groups')
+    parser.add_argument('--latency', type=float, default=0.0, help='added Bot API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, up to this many seconds')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='fraction of API calls answered with 429')
+    parser.add_argument('--forbidden-rate', type=float, default=0.0, help='fraction of users who block DMs')
+    parser.add_argument('--roster-window', type=float, default=0.5, help='roster debounce window in seconds')
+    parser.add_argument('--concurrency', type=int, help='updates handled at once (default: as in main.py; 1 = sequential)')
+    parser.add_argument('--backend', choices=('sqlite', 'memory'), default='sqlite', help='storage backend')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    if args.scenario:
+        runs = [(name, SCENARIOS[name]) for name in args.scenario]
+    else:
+        runs = [('custom', dict(groups=args.groups, members=args.members, join_rate=args.join_rate,
+                                latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                                forbidden_rate=args.forbidden_rate))]
+
+    results = []
+    for name, params in runs:
+        params = dict(params)
+        params.setdefault('roster_window', args.roster_window)
+        params.setdefault('seed', args.seed)
+        params.setdefault('concurrency', args.concurrency)
+        params.setdefault('backend', args.backend)
+        results.append(asyncio.run(run_scenario(name, **params)))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Stress test for the game state machine: many simultaneous draw attempts.
+
+Several worker processes, each with several threads (so both separate connection pools
+and a shared writer are exercised), race to apply 'start_draw' to the same groups at the
+same moment. Every round, exactly one attempt per group must win; a second race on
+'complete_draw' checks the same for the next transition. Exits non-zero on any
+violation.
+
+Usage: python benchmarks/stress_game_state.py [--processes 4] [--threads 8] [--groups 20] [--rounds 10]
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database  # noqa: E402
+
+
+def worker(index, db_path, threads, groups, rounds, barrier, results):
+    database.DATABASE_NAME = db_path
+
+    for round_number in range(rounds):
+        for event in ('start_draw', 'complete_draw'):
+            wins = collections.Counter()
+            lock = threading.Lock()
+
+            def attempt():
+                for group_id in range(1, groups + 1):
+                    if database.transition_game(group_id, event).won:
+                        with lock:
+                            wins[group_id] += 1
+
+            barrier.wait()
+            pool = [threading.Thread(target=attempt) for _ in range(threads)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            results.put((round_number, event, dict(wins)))
+            barrier.wait()
+            # Reset for the next round from the first process only; the barriers on either
+            # side keep the others from racing the next round against a half-done reset
+            if event == 'complete_draw' and index == 0:
+                for group_id in range(1, groups + 1):
+                    database.cancel_game(group_id)
+            barrier.wait()
+    database.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='santa-stress-'), 'stress.db')
+    database.DATABASE_NAME = db_path
+    database.init_db()
+    for group_id in range(1, args.groups + 1):
+        database.ensure_game_exists(group_id)
+    database.close_db()
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.processes)
+    results = ctx.Queue()
+    start = time.perf_counter()
+    procs = [ctx.Process(target=worker, args=(index, db_path, args.threads, args.groups, args.rounds, barrier, results))
+             for index in range(args.processes)]
+    for p in procs:
+        p.start()
+
+    totals = collections.defaultdict(collections.Counter)
+    for _ in range(args.processes * args.rounds * 2):
+        round_number, event, wins = results.get()
+        totals[(round_number, event)].update(wins)
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    attempts = args.processes * args.threads * args.groups * args.rounds * 2
+    violations = []
+    for (round_number, event), wins in sorted(totals.items()):
+        for group_id in range(1, args.groups + 1):
+            if wins[group_id] != 1:
+                violations.append(f"round {round_number} {event} group {group_id}: {wins[group_id]} winners")
+
+    print(f"{attempts} transition attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s)")
+    if violations:
+        print(f"FAILED: {len(violations)} violations")
+        for line in violations[:20]:
+            print("  " + line)
+        sys.exit(1)
+    print("OK: exactly one winner per group per transition")
+
+
+if __name__ == '__main__':
+    main()
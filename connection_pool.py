@@ -0,0 +1,135 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Pragmas applied to every connection we hand out. journal_mode is persistent in the
+# database file, so it is only set once on the writer.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",       # ~16MB page cache per connection
+    "PRAGMA mmap_size = 134217728",     # 128MB memory-mapped I/O
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections for one database file.
+
+    There is a single writer connection (SQLite only allows one writer at a time, so
+    sharing one avoids lock ping-pong between our own threads) and a small pool of
+    reader connections. With WAL enabled the readers never block the writer.
+    """
+
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.max_readers = readers
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _get_writer(self):
+        if self._writer is None:
+            conn = self._connect()
+            # Only takes effect in a new, empty file; archive.py converts older ones once
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            self._writer = conn
+        return self._writer
+
+    def _acquire_reader(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._reader_lock:
+                    self._reader_count -= 1
+                raise
+        return self._readers.get()
+
+    def _release_reader(self, conn):
+        if self._closed:
+            conn.close()
+        else:
+            self._readers.put(conn)
+
+    @contextlib.contextmanager
+    def reader(self):
+        """Yields a read-only connection from the pool for the length of one operation."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    @contextlib.contextmanager
+    def writer(self):
+        """Yields the writer connection inside a BEGIN IMMEDIATE transaction.
+
+        The transaction is committed when the block exits normally and rolled back on
+        error. Nested use from the same thread joins the outer transaction.
+        """
+        start = time.perf_counter()
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            conn = self._get_writer()
+            if conn.in_transaction:
+                yield conn
+                return
+            # Waiting for our own writer thread plus other processes (busy_timeout) both count
+            conn.execute("BEGIN IMMEDIATE")
+            metrics.record_lock_wait(time.perf_counter() - start)
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    @contextlib.contextmanager
+    def maintenance(self):
+        """Yields the writer connection outside any transaction, for VACUUM and the like."""
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            yield self._get_writer()
+
+    def close(self):
+        """Closes every connection. Readers still checked out are closed on release."""
+        self._closed = True
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
@@ -1,242 +1,298 @@
+"""The bot's data access functions.
+
+The data lives in a storage backend (see storage.py), chosen with STORAGE_BACKEND:
+'sqlite' (DATABASE_NAME, the default), 'redis' (REDIS_URL) or 'memory'. With SQLITE_SHARDS
+set above 1, SQLite data is split by group across that many files (see sharded_backend.py).
+This module adds the per-process group state cache on top, where the backend allows it.
+"""
 import sqlite3
-import datetime
 import logging
+import os
+import threading
+
+import state_cache
+from storage import GAME_TRANSITIONS, GameStateError, TransitionResult  # noqa: F401 (re-exported)
 
 DATABASE_NAME = 'santa.db'
+READ_POOL_SIZE = 4
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+SQLITE_SHARDS = int(os.getenv('SQLITE_SHARDS') or 1)
+
+# The functions below that read or write game data, timed as queries by metrics.py. The
+# backend/pool helpers and the in-memory lookups are left out.
+QUERIES = (
+    'get_group_state', 'load_group_state', 'ensure_game_exists', 'get_game_status', 'update_game_status',
+    'add_participant', 'add_participants_bulk', 'get_participants_data', 'update_assignments_and_status',
+    'transition_game', 'try_set_status_to_drawing', 'start_draw_job', 'save_draw_job', 'queue_draw_dms',
+    'claim_draw_jobs', 'abort_draw_job', 'update_exchange_date', 'get_exchange_date',
+    'get_all_assignments_for_user', 'get_draw_history', 'cancel_game', 'cancel_game_full',
+    'get_roster_message_id', 'set_roster_message_id', 'games_on_dates', 'get_assignments',
+    'get_assignments_for_groups', 'get_draw_rules',
+    'sent_reminders', 'record_reminders', 'prune_reminders', 'enqueue_outbox', 'claim_outbox',
+    'claim_outbox_for_chat', 'retry_outbox', 'finish_outbox', 'supersede_outbox', 'prune_outbox',
+)
+
+_backend = None
+_backend_lock = threading.Lock()
+_archive = None
 
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
+    """Establishes a standalone connection to the SQLite database (for one-off scripts)."""
     return sqlite3.connect(DATABASE_NAME)
 
+def _create_backend():
+    if STORAGE_BACKEND == 'sqlite' and SQLITE_SHARDS > 1:
+        from sharded_backend import ShardedSQLiteBackend
+        return ShardedSQLiteBackend(DATABASE_NAME, SQLITE_SHARDS, readers=READ_POOL_SIZE)
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(DATABASE_NAME, readers=READ_POOL_SIZE)
+    if STORAGE_BACKEND == 'redis':
+        from redis_backend import RedisBackend
+        return RedisBackend(REDIS_URL)
+    if STORAGE_BACKEND == 'memory':
+        from memory_backend import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND!r}")
+
+def get_backend():
+    """Returns the storage backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+def set_backend(backend):
+    """Replaces the storage backend (e.g. with a MemoryBackend in benchmarks)."""
+    global _backend
+    close_db()
+    with _backend_lock:
+        _backend = backend
+
+def get_pool():
+    """Returns the SQLite connection pool (unsharded SQLite backend only)."""
+    return get_backend().pool
+
+def write_lanes():
+    """How many independent writers the backend has: one per shard, else one."""
+    return getattr(get_backend(), 'shard_count', 1)
+
+def write_lane(group_id):
+    """Which of the write_lanes() holds the group's data."""
+    backend = get_backend()
+    return backend.shard_for(group_id) if write_lanes() > 1 else 0
+
+def sqlite_pools():
+    """The SQLite connection pools, one per shard."""
+    backend = get_backend()
+    return [shard.pool for shard in backend.shards] if write_lanes() > 1 else [backend.pool]
+
+def get_archive(create=False):
+    """The archive of old seasons (see archive.py), or None if nothing was archived yet."""
+    global _archive
+    if _archive is None:
+        import archive
+        directory = archive.archive_dir()
+        with _backend_lock:
+            if _archive is None and (create or os.path.exists(archive.index_path(directory))):
+                _archive = archive.Archive(directory, readers=READ_POOL_SIZE)
+    return _archive
+
+def close_db():
+    """Closes the storage backend. Called when the bot shuts down."""
+    global _backend, _archive
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+        if _archive is not None:
+            _archive.close()
+            _archive = None
+    state_cache.clear()
+
 def init_db():
-    """Initializes the database tables (games and assignments)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 1. Games Table (Stores overall group settings and status)
-    # Create a clean schema (avoid inline SQL comments which can create malformed column names)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS games (
-            group_id INTEGER PRIMARY KEY,
-            status TEXT NOT NULL,
-            date_started TEXT,
-            exchange_date TEXT
-        )
-    """)
-
-    # 2. Participants Table (Stores who is in which game)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS participants (
-            user_id INTEGER NOT NULL,
-            group_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            first_name TEXT,
-            PRIMARY KEY (user_id, group_id)
-        )
-    """)
-    
-    # 3. Assignments Table (Stores the draw results: who got who)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS assignments (
-            group_id INTEGER NOT NULL,
-            santa_id INTEGER NOT NULL,
-            target_id INTEGER NOT NULL,
-            PRIMARY KEY (group_id, santa_id),
-            FOREIGN KEY (group_id) REFERENCES games(group_id),
-            FOREIGN KEY (santa_id) REFERENCES participants(user_id),
-            FOREIGN KEY (target_id) REFERENCES participants(user_id)
-        )
-    """)
-
-    conn.commit()
-
-    # Repair step: If the existing `games` table has unexpected column names (corruption
-    # caused by inline SQL comments), attempt a safe migration by renaming the old table
-    # and creating a fresh `games` table, then copying any matching columns.
-    cursor.execute("PRAGMA table_info(games)")
-    pragma_rows = cursor.fetchall()
-    cols = [row[1] for row in pragma_rows]
-    expected = {'group_id', 'status', 'date_started', 'exchange_date'}
-    if set(cols) != expected:
-        # Rename the old (possibly malformed) table
-        try:
-            cursor.execute("ALTER TABLE games RENAME TO games_old")
-        except Exception:
-            # If rename fails, continue; we'll still create the correct table if missing
-            pass
-
-        # Create the clean table (again, idempotent)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS games (
-                group_id INTEGER PRIMARY KEY,
-                status TEXT NOT NULL,
-                date_started TEXT,
-                exchange_date TEXT
-            )
-        """)
-
-        # Try to copy any columns that exist in the old table into the new one
-        existing = set(cols)
-        common = [c for c in ['group_id', 'status', 'date_started', 'exchange_date'] if c in existing]
-        if 'group_id' in common:
-            try:
-                cols_sql = ",".join(common)
-                cursor.execute(f"INSERT OR IGNORE INTO games ({cols_sql}) SELECT {cols_sql} FROM games_old")
-            except Exception:
-                # If copying fails, just continue with an empty fresh table
-                pass
-
-        # Drop the old table if it exists to avoid future confusion
-        try:
-            cursor.execute("DROP TABLE IF EXISTS games_old")
-        except Exception:
-            pass
-
-    # Ensure expected columns exist on older DBs
-    cursor.execute("PRAGMA table_info(games)")
-    cols_after = {row[1] for row in cursor.fetchall()}
-    if 'date_started' not in cols_after:
-        cursor.execute("ALTER TABLE games ADD COLUMN date_started TEXT")
-    if 'exchange_date' not in cols_after:
-        cursor.execute("ALTER TABLE games ADD COLUMN exchange_date TEXT")
-    if 'status' not in cols_after:
-        cursor.execute("ALTER TABLE games ADD COLUMN status TEXT")
-    conn.commit()
-    conn.close()
+    """Prepares the storage backend (for SQLite, brings the schema up to date; see migrations.py)."""
+    backend = get_backend()
+    from sqlite_backend import SQLiteBackend
+    if isinstance(backend, SQLiteBackend) and not os.path.exists(backend.path):
+        # Refuse to start on a new, empty file while the data sits in shards
+        from sharded_backend import shard_counts, shard_paths
+        counts = shard_counts(backend.path)
+        if counts:
+            raise RuntimeError(f"The data is in {shard_paths(backend.path, counts[0])[0]} and the other shard files, "
+                               f"not in {backend.path}; set SQLITE_SHARDS={counts[0]} or run "
+                               f"`python reshard.py 1 --from-shards {counts[0]}`")
+    backend.init()
+
+
+def get_group_state(group_id):
+    """Returns the group's GroupState (status, exchange date, roster), from cache when possible."""
+    state = state_cache.get(group_id)
+    if state is not None:
+        return state
+    return load_group_state(group_id)
+
+
+def load_group_state(group_id):
+    """Reads the group's state from the backend and caches it (if the backend allows)."""
+    loaded_at = state_cache.epoch()
+    backend = get_backend()
+    state = backend.load_group_state(group_id)
+    if backend.cacheable:
+        state_cache.put(group_id, state, loaded_at)
+    return state
+
+
+def cache_stats():
+    """Returns hit/miss counters for the per-group state cache."""
+    return state_cache.stats()
+
 
 def ensure_game_exists(group_id):
     """Initializes a new game entry if it doesn't exist."""
-    conn = get_db_connection()
-    try:
-        conn.execute("INSERT OR IGNORE INTO games (group_id, status, date_started) VALUES (?, ?, ?)",
-                     (group_id, 'JOINING', datetime.datetime.now().isoformat()))
-        # Ensure that older rows (created before 'status' existed) get a default status
-        conn.execute(
-            "UPDATE games SET status = ? WHERE group_id = ? AND (status IS NULL OR status = '')",
-            ('JOINING', group_id)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    cached = state_cache.get(group_id)
+    if cached is not None and cached.status:
+        return
+    get_backend().ensure_game_exists(group_id)
+    state_cache.invalidate(group_id)
 
 
 def get_game_status(group_id):
     """Returns the current status for the game (e.g., 'JOINING', 'DRAWING', 'COMPLETED')."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute("SELECT status FROM games WHERE group_id = ?", (group_id,))
-        row = cursor.fetchone()
-        return row[0] if row and row[0] else None
-    finally:
-        conn.close()
+    return get_group_state(group_id).status
 
 
 def update_game_status(group_id, status):
     """Sets the game's status to the provided value. If the game row doesn't exist, ensure_game_exists should be called first."""
-    conn = get_db_connection()
-    try:
-        conn.execute("UPDATE games SET status = ? WHERE group_id = ?", (status, group_id))
-        conn.commit()
-    finally:
-        conn.close()
+    if get_backend().update_game_status(group_id, status):
+        state_cache.update(group_id, status=status)
+    else:
+        state_cache.invalidate(group_id)
 
 def add_participant(user_id, group_id, username):
     """Adds a participant to the game. Returns True if added, False if already present."""
-    conn = get_db_connection()
-    try:
-        # Check if participant already exists
-        cursor = conn.execute("SELECT 1 FROM participants WHERE user_id = ? AND group_id = ?", (user_id, group_id))
-        if cursor.fetchone():
-            return False # Already exists
-
-        # If not, insert
-        conn.execute("INSERT INTO participants (user_id, group_id, username, first_name) VALUES (?, ?, ?, ?)",
-                     (user_id, group_id, username, username)) # Using username for first_name too, for simplicity
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    if not get_backend().add_participant(user_id, group_id, username):
+        state_cache.add_member(group_id, user_id)
+        return False # Already exists
+    state_cache.add_to_roster(group_id, user_id, username)
+    return True
+
+def is_known_participant(group_id, user_id):
+    """Whether the user is known to be in the group's game, from memory alone (no query).
+    False can also mean "not known"; add_participant has the final say."""
+    return get_backend().cacheable and state_cache.is_member(group_id, user_id)
+
+def add_participants_bulk(group_id, members):
+    """Adds many (user_id, username, team) participants in one transaction (see enroll.py).
+
+    Users already in the group are skipped. Returns the ids that were newly added; raises
+    GameStateError if the draw has started.
+    """
+    added = get_backend().add_participants_bulk(group_id, list(members))
+    if added:
+        state_cache.invalidate(group_id)
+    return added
 
 def get_participants_data(group_id):
     """Retrieves list of (user_id, username) for the group."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute("SELECT user_id, username FROM participants WHERE group_id = ?", (group_id,))
-        # Returns a list of tuples: [(123, 'Alice'), (456, 'Bob'), ...]
-        return cursor.fetchall()
-    finally:
-        conn.close()
+    # Returns a list of tuples: [(123, 'Alice'), (456, 'Bob'), ...]
+    return list(get_group_state(group_id).roster)
 
 def update_assignments_and_status(group_id, pairs):
-    """Saves the draw results (pairs) and updates game status to 'COMPLETED'."""
-    # Ensure the game row exists so the status update will apply
-    ensure_game_exists(group_id)
+    """Saves the draw results (pairs) and moves the game from 'DRAWING' to 'COMPLETED'.
 
-    conn = get_db_connection()
+    Raises GameStateError (and saves nothing) if the game is no longer DRAWING, e.g. because
+    it was cancelled while the names were being drawn.
+    """
     try:
-        # 1. Clear any previous assignments for this group
-        conn.execute("DELETE FROM assignments WHERE group_id = ?", (group_id,))
+        get_backend().update_assignments_and_status(group_id, pairs)
+    except GameStateError:
+        state_cache.invalidate(group_id)
+        raise
+    state_cache.update(group_id, status='COMPLETED')
+
 
-        # 2. Insert new assignments
-        assignment_data = [(group_id, santa_id, target_id) for santa_id, target_id in pairs]
-        conn.executemany("INSERT INTO assignments (group_id, santa_id, target_id) VALUES (?, ?, ?)", assignment_data)
+# --- Game state machine (see GAME_TRANSITIONS in storage.py) ---
 
-        # 3. Update game status
-        conn.execute("UPDATE games SET status = ? WHERE group_id = ?", ('COMPLETED', group_id))
+def transition_game(group_id, event):
+    """Atomically applies a state machine event (see GAME_TRANSITIONS) to the group's game.
 
-        conn.commit()
-    finally:
-        conn.close()
+    Returns a TransitionResult; `won` is True for exactly one of any set of racing callers.
+    """
+    result = get_backend().transition_game(group_id, event)
+    logging.info(f"transition_game: group_id={group_id} event={event} won={result.won} status={result.status}")
+    if result.won:
+        state_cache.update(group_id, status=result.status)
+    else:
+        state_cache.invalidate(group_id)
+    return result
 
 
 def try_set_status_to_drawing(group_id):
     """Attempt to set the game's status to 'DRAWING' only if it's currently JOINING/NULL/empty.
     Returns True if the status was changed (meaning this caller won the race), False otherwise.
     """
-    conn = get_db_connection()
+    return transition_game(group_id, 'start_draw').won
+
+
+# --- Draw jobs (see draw_jobs.py) ---
+
+def start_draw_job(group_id, owner, lease_until):
+    """Like transition_game(group_id, 'start_draw'), also recording a draw job leased to `owner`."""
+    result = get_backend().start_draw_job(group_id, owner, lease_until)
+    logging.info(f"start_draw_job: group_id={group_id} owner={owner} won={result.won} status={result.status}")
+    if result.won:
+        state_cache.update(group_id, status=result.status)
+    else:
+        state_cache.invalidate(group_id)
+    return result
+
+
+def save_draw_job(group_id, owner, pairs, lease_until):
+    """Like update_assignments_and_status, for the owner of the group's draw job.
+
+    Raises GameStateError if the game left DRAWING or another process took the job over.
+    """
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM games WHERE group_id = ?", (group_id,))
-        row = cursor.fetchone()
-        current = row[0] if row and row[0] else None
-        logging.info(f"try_set_status_to_drawing: group_id={group_id} current_status={current}")
-        # Only set to DRAWING if current status indicates JOINING/empty/null
-        if current is None or current == '' or (isinstance(current, str) and current.upper().strip() == 'JOINING'):
-            cursor.execute("UPDATE games SET status = ? WHERE group_id = ?", ('DRAWING', group_id))
-            conn.commit()
-            logging.info(f"try_set_status_to_drawing: updated rows={cursor.rowcount}")
-            return cursor.rowcount > 0
-        else:
-            logging.info(f"try_set_status_to_drawing: not updating because status is {current}")
-            return False
-    finally:
-        conn.close()
+        get_backend().save_draw_job(group_id, owner, pairs, lease_until)
+    except GameStateError:
+        state_cache.invalidate(group_id)
+        raise
+    state_cache.update(group_id, status='COMPLETED')
+
+
+def queue_draw_dms(group_id, owner, entries):
+    """Puts the draw's assignment DMs in the outbox and marks the job delivered. Returns the outbox ids."""
+    return get_backend().queue_draw_dms(group_id, owner, entries)
+
+
+def claim_draw_jobs(now, owner, lease_until, limit):
+    """Takes over draw jobs whose lease expired before `now`. Returns [DrawJob]."""
+    return get_backend().claim_draw_jobs(now, owner, lease_until, limit)
+
+
+def abort_draw_job(group_id, owner):
+    """Gives up on the group's draw job if `owner` holds it."""
+    get_backend().abort_draw_job(group_id, owner)
 
 # --- Functions for Exchange Date ---
 
-def update_exchange_date(group_id, date_text):
-    """Saves the gift exchange date for the game (used by /setdate)."""
-    # Ensure a game row exists so the exchange_date update will apply
-    ensure_game_exists(group_id)
+def update_exchange_date(group_id, date_text, exchange_on=None):
+    """Saves the gift exchange date for the game (used by /setdate).
 
-    conn = get_db_connection()
-    try:
-        conn.execute("UPDATE games SET exchange_date = ? WHERE group_id = ?", 
-                     (date_text, group_id))
-        conn.commit()
-    finally:
-        conn.close()
+    date_text is what the user typed; exchange_on is the datetime.date it was parsed to
+    (see dates.parse_exchange_date), which is what reminders and /daysleft use.
+    """
+    get_backend().update_exchange_date(group_id, date_text, exchange_on)
+    state_cache.update(group_id, exchange_date=date_text or None, exchange_on=exchange_on)
 
 def get_exchange_date(group_id):
     """Retrieves the saved gift exchange date (used by go_draw_callback)."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute("SELECT exchange_date FROM games WHERE group_id = ?", (group_id,))
-        result = cursor.fetchone()
-        # Returns the date text or None
-        return result[0] if result and result[0] else None 
-    finally:
-        conn.close()
+    # Returns the date text or None
+    return get_group_state(group_id).exchange_date
         
 # --- Add this new function to your database.py file ---
 
@@ -245,50 +301,129 @@ def get_all_assignments_for_user(user_id):
     Retrieves all Secret Santa assignments where the given user_id is the SANTA.
     Returns: A list of tuples: [(group_id, target_name, exchange_date), ...]
     """
-    conn = get_db_connection()
-    try:
-        # We join assignments (santa_id -> target_id), participants (target_id -> target_name), 
-        # and games (group_id -> exchange_date).
-        cursor = conn.execute("""
-            SELECT
-                t1.group_id,
-                t2.username,
-                t3.exchange_date
-            FROM assignments t1
-            JOIN participants t2 ON t1.target_id = t2.user_id
-            JOIN games t3 ON t1.group_id = t3.group_id
-            WHERE t1.santa_id = ?
-        """, (user_id,))
-        
-        # Returns a list of all assignments found for the user
-        return cursor.fetchall()
-    finally:
-        conn.close()        
+    return get_backend().get_all_assignments_for_user(user_id)
+
+
+def get_draw_history(user_id, seasons=3):
+    """Who the user drew in each of their last `seasons` seasons per group, including the active one.
+    Returns: [(group_id, season, year, target_name), ...], newest season first within a group.
+    Seasons moved to the archive are read from there.
+    """
+    history = get_backend().get_draw_history(user_id, seasons)
+    archive = get_archive() if STORAGE_BACKEND == 'sqlite' else None
+    return archive.draw_history(user_id, seasons, history) if archive else history
+
+
+def get_draw_rules(group_id):
+    """The storage.DrawRules for the group's next draw. Last season's pairs come from the
+    archive when that season was moved there."""
+    rules = get_backend().get_draw_rules(group_id)
+    if not rules.previous_pairs:
+        archive = get_archive() if STORAGE_BACKEND == 'sqlite' else None
+        if archive:
+            rules = rules._replace(previous_pairs=archive.last_pairs(group_id))
+    return rules
 
 
 def cancel_game(group_id):
     """Resets the game for the given group: deletes assignments and sets status back to 'JOINING'."""
-    # Ensure a games row exists
-    ensure_game_exists(group_id)
-    conn = get_db_connection()
-    try:
-        # Remove assignments for a reset and set status back to JOINING
-        conn.execute("DELETE FROM assignments WHERE group_id = ?", (group_id,))
-        conn.execute("UPDATE games SET status = ? WHERE group_id = ?", ('JOINING', group_id))
-        conn.commit()
-    finally:
-        conn.close()
+    get_backend().cancel_game(group_id)
+    # Assignment DMs still waiting in the outbox are about pairs that no longer exist
+    get_backend().supersede_outbox(group_id, 'assignment')
+    state_cache.update(group_id, status='JOINING')
 
 
 def cancel_game_full(group_id):
     """Fully resets the game for the given group: deletes assignments and participants,
-    clears exchange_date and sets status back to 'JOINING'."""
-    ensure_game_exists(group_id)
-    conn = get_db_connection()
-    try:
-        conn.execute("DELETE FROM assignments WHERE group_id = ?", (group_id,))
-        conn.execute("DELETE FROM participants WHERE group_id = ?", (group_id,))
-        conn.execute("UPDATE games SET status = ?, exchange_date = ? WHERE group_id = ?", ('JOINING', None, group_id))
-        conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+    clears exchange_date and sets status back to 'JOINING'.
+
+    A season that was already drawn is kept as history and a new season starts instead;
+    returns True in that case.
+    """
+    archived = get_backend().cancel_game_full(group_id)
+    get_backend().supersede_outbox(group_id, 'assignment')
+    state_cache.update(group_id, status='JOINING', exchange_date=None, exchange_on=None, roster=())
+    return archived
+
+
+# --- Pinned roster message ---
+
+def get_roster_message_id(group_id):
+    """Returns the id of the group's pinned roster message, or None if there isn't one yet."""
+    return get_backend().get_roster_message_id(group_id)
+
+
+def set_roster_message_id(group_id, message_id):
+    """Remembers which message holds the group's roster so it can be edited in place."""
+    get_backend().set_roster_message_id(group_id, message_id)
+
+
+# --- Countdown reminders ---
+
+def games_on_dates(dates):
+    """Returns [(group_id, exchange_on, status), ...] for games exchanging on any of `dates`."""
+    return get_backend().games_on_dates(dates)
+
+
+def get_assignments(group_id):
+    """Returns [(santa_id, target_id, target_username), ...] for the group's draw."""
+    return get_backend().get_assignments(group_id)
+
+
+def get_assignments_for_groups(group_ids):
+    """Returns {group_id: [(santa_id, target_id, target_username), ...]} for the groups' draws."""
+    return get_backend().get_assignments_for_groups(group_ids)
+
+
+def sent_reminders(dates):
+    """Returns the (group_id, exchange_on, days_before, recipient_id) reminders already delivered."""
+    return get_backend().sent_reminders(dates)
+
+
+def record_reminders(reminders):
+    """Marks (group_id, exchange_on, days_before, recipient_id) reminders as delivered."""
+    get_backend().record_reminders(reminders)
+
+
+def prune_reminders(before):
+    """Forgets delivery records for exchange dates before `before`."""
+    get_backend().prune_reminders(before)
+
+
+# --- Outbox of undelivered messages (see outbox.py) ---
+
+def enqueue_outbox(entries):
+    """Stores (chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error, leased_until) messages."""
+    get_backend().enqueue_outbox(entries)
+
+
+def claim_outbox(now, lease_until, limit):
+    """Returns up to `limit` due OutboxMessages, hidden from other claims until `lease_until`."""
+    return get_backend().claim_outbox(now, lease_until, limit)
+
+
+def claim_outbox_for_chat(chat_id, now, lease_until):
+    """Returns every pending OutboxMessage for the chat, due or not, hidden until `lease_until`.
+    Messages another claim still holds a lease on at `now` are left to it."""
+    return get_backend().claim_outbox_for_chat(chat_id, now, lease_until)
+
+
+def retry_outbox(retries):
+    """Reschedules messages after a failed delivery attempt.
+    retries: [(message_id, attempts, next_attempt_at, error), ...]"""
+    get_backend().retry_outbox(retries)
+
+
+def finish_outbox(message_ids, status):
+    """Marks messages 'delivered', 'expired' or 'superseded'; they won't be sent again."""
+    get_backend().finish_outbox(message_ids, status)
+
+
+def supersede_outbox(group_id, kind):
+    """Drops the group's pending messages of `kind`, e.g. assignment DMs from an earlier draw."""
+    get_backend().supersede_outbox(group_id, kind)
+
+
+def prune_outbox(before):
+    """Deletes finished messages that finished before `before` (Unix time)."""
+    get_backend().prune_outbox(before)
@@ -0,0 +1,104 @@
+"""Parsing of the exchange dates people type into /setdate.
+
+parse_exchange_date turns text like "Dec 24th", "24 December", "August 3rd 2026",
+"12/24" or "2026-12-24" into a datetime.date. Without a year, the next occurrence of
+that day is used (so "Jan 5" in December means next January). It runs once when the date
+is set; everything else works with the stored date.
+"""
+import datetime
+import re
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7,
+    'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+}
+# Also accept three-letter abbreviations and "sept"
+MONTHS.update({name[:3]: number for name, number in list(MONTHS.items())})
+MONTHS['sept'] = 9
+
+_DAY = r'(?P<day>\d{1,2})(?:st|nd|rd|th)?'
+_MONTH = r'(?P<month>[a-z]+)\.?'
+_YEAR = r'(?:,?\s*(?P<year>\d{4}))?'
+_WEEKDAY = r'(?:(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)[a-z]*,?\s+)?'
+
+_PATTERNS = [
+    # 2026-12-24
+    re.compile(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})'),
+    # Dec 24, December 24th 2026, Thursday December 24
+    re.compile(_WEEKDAY + _MONTH + r'\s+' + _DAY + _YEAR),
+    # 24 Dec, 24th of December, 24 December 2026
+    re.compile(_WEEKDAY + _DAY + r'\s+(?:of\s+)?' + _MONTH + _YEAR),
+    # 12/24, 24/12/2026, 24.12.
+    re.compile(r'(?P<first>\d{1,2})[/.](?P<second>\d{1,2})(?:[/.](?P<year>\d{4}|\d{2})?)?'),
+]
+
+
+def parse_exchange_date(text, today=None):
+    """Returns the date `text` refers to. Raises ValueError with a readable reason if it can't."""
+    today = today or datetime.date.today()
+    cleaned = ' '.join(text.strip().lower().split())
+    for pattern in _PATTERNS:
+        match = pattern.fullmatch(cleaned)
+        if match:
+            month, day = _month_and_day(match)
+            year = match.group('year')
+            if year:
+                year = int(year)
+                if year < 100:
+                    year += 2000
+                date = _make_date(year, month, day, text)
+                if date < today:
+                    raise ValueError(f"{text!r} has already passed.")
+                return date
+            return _next_occurrence(month, day, today, text)
+    raise ValueError(f"I couldn't understand the date {text!r}. Try something like 'Dec 24th' or 'January 5th'.")
+
+
+def _month_and_day(match):
+    groups = match.groupdict()
+    if 'first' in groups:
+        first, second = int(groups['first']), int(groups['second'])
+        if first > 12 >= second:
+            return second, first    # day/month
+        if second > 12 >= first:
+            return first, second    # month/day
+        if first == second:
+            return first, second
+        raise ValueError(f"{match.group(0)!r} could be day/month or month/day. Please write the month's name, e.g. 'Dec 24th'.")
+    month = groups['month']
+    if month.isdigit():
+        return int(month), int(groups['day'])
+    if month not in MONTHS:
+        raise ValueError(f"{month!r} isn't a month I know. Try something like 'Dec 24th'.")
+    return MONTHS[month], int(groups['day'])
+
+
+def _make_date(year, month, day, text):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        raise ValueError(f"{text!r} isn't a real date.") from None
+
+
+def _next_occurrence(month, day, today, text):
+    # Feb 29 may need to skip ahead to the next leap year
+    for year in range(today.year, today.year + 5):
+        try:
+            candidate = datetime.date(year, month, day)
+        except ValueError:
+            continue
+        if candidate >= today:
+            return candidate
+    raise ValueError(f"{text!r} isn't a real date.")
+
+
+def format_exchange_date(date):
+    """The form dates are shown in messages, e.g. 'Thursday, December 24, 2026'."""
+    return f"{date:%A}, {date:%B} {date.day}, {date.year}"
+
+
+def exchange_day_text(state):
+    """The exchange date for messages: the parsed date when there is one, else what was typed."""
+    if state.exchange_on:
+        return format_exchange_date(state.exchange_on)
+    return state.exchange_date
@@ -0,0 +1,321 @@
+"""Secret Santa draw: a random derangement of the participants, optionally with exclusions.
+
+    pairs = draw(user_ids)                                   # nobody draws themselves
+    pairs = draw(user_ids, exclusions=symmetric(couples))    # ...or their partner
+    pairs = draw(user_ids, groups=team_of)                   # ...or anyone on their team
+    pairs = draw(user_ids, exclusions=last_years_pairs)      # ...or last year's person
+
+How the assignment is produced:
+
+* Rejection sampling: shuffle until the permutation breaks no rule. This is exactly
+  uniform over all valid assignments and is used whenever a random shuffle has a
+  reasonable chance of being valid (always, when there are no constraints: about e
+  tries on average).
+* With at most EXACT_MAX participants, if rejection sampling gives up, every valid
+  assignment is listed and one is picked: exactly uniform too.
+* Otherwise the shuffle is repaired (conflicting santas swap targets with random
+  partners, falling back to augmenting paths as in bipartite matching) and the santas
+  the repair touched are mixed by a Markov chain over valid assignments: each step swaps
+  a touched santa's target with a random santa's, or rotates it through two random
+  others. Swaps alone can't reach every valid assignment (with three people, no swap
+  leads from one derangement to the other). The chain's stationary distribution is
+  uniform; everyone else keeps their target from the uniform shuffle, so the result is
+  close to uniform. Each conflict costs O(1) expected work (SWAP_PROBES tries, then
+  MIX_FACTOR mixing steps), so the draw is linear in n plus the number of rules.
+
+If no valid assignment exists, NoValidAssignment explains which participants cannot be
+matched.
+"""
+import random
+from collections import Counter, deque
+from operator import itemgetter
+
+REJECTION_ATTEMPTS = 64
+# Skip rejection sampling when a shuffle is expected to break more rules than this
+# (the chance of a valid shuffle is roughly exp(-expected violations))
+MAX_EXPECTED_VIOLATIONS = 3.0
+SWAP_PROBES = 64
+EXACT_MAX = 8
+# Mixing steps per santa the repair touched, plus MIX_MIN_STEPS for small draws
+MIX_FACTOR = 10
+MIX_MIN_STEPS = 100
+
+
+class NoValidAssignment(ValueError):
+    """Raised when the constraints leave no way to give everyone a recipient."""
+
+
+def symmetric(pairs):
+    """Expands (a, b) exclusions to both directions, e.g. for couples."""
+    result = set()
+    for a, b in pairs:
+        result.add((a, b))
+        result.add((b, a))
+    return result
+
+
+class _Rules:
+    """The constraints, with an O(1) allowed(santa, target) check on participant indices."""
+
+    def __init__(self, participants, exclusions, groups):
+        self.n = len(participants)
+        self.participants = participants
+        # Checked in participant space, so a large exclusion set is used without copying it
+        self.excluded = exclusions if isinstance(exclusions, (set, frozenset)) else set(exclusions)
+        self.labels = None
+        if groups:
+            label_ids = {}
+            self.labels = [label_ids.setdefault(groups[p], len(label_ids)) if groups.get(p) is not None else -1 - i
+                           for i, p in enumerate(participants)]
+
+    @property
+    def unconstrained(self):
+        return not self.excluded and self.labels is None
+
+    def allowed(self, santa, target):
+        if santa == target:
+            return False
+        labels = self.labels
+        if labels is not None and labels[santa] == labels[target]:
+            return False
+        participants = self.participants
+        return (participants[santa], participants[target]) not in self.excluded
+
+    def forbidden_counts(self):
+        """At most how many targets each santa may not draw (including themselves). Exclusions
+        count as given, even ones a group rule covers already or naming someone not drawing."""
+        labels = self.labels
+        if labels is None:
+            counts = [1] * self.n
+        else:
+            sizes = Counter(labels)
+            counts = [sizes[label] for label in labels]
+        index = {p: i for i, p in enumerate(self.participants)}
+        for santa, count in Counter(map(itemgetter(0), self.excluded)).items():
+            if santa in index:
+                counts[index[santa]] += count
+        return counts
+
+
+def draw(participants, exclusions=(), groups=None, rng=None, info=None):
+    """Returns [(santa, target), ...] covering every participant exactly once on each side.
+
+    participants: user ids (or any hashable values), at least two.
+    exclusions:   (santa, target) pairs that must not be drawn. Directed; see symmetric(). A set
+                  is used as is, so don't change it during the draw.
+    groups:       optional mapping participant -> label; nobody draws someone with the same
+                  label (team, household). Participants without a label are unrestricted.
+    rng:          random.Random instance, for reproducible draws.
+    info:         optional dict, filled with how the draw was produced (for benchmarks).
+    """
+    participants = list(participants)
+    n = len(participants)
+    if len(set(participants)) != n:
+        raise ValueError("Participants must be unique")
+    if n < 2:
+        raise NoValidAssignment("Need at least 2 participants")
+    rng = rng or random.Random()
+    rules = _Rules(participants, exclusions, groups)
+
+    perm, method = _draw_indices(rules, participants, rng)
+    if info is not None:
+        info['method'] = method
+    return [(participants[santa], participants[target]) for santa, target in enumerate(perm)]
+
+
+def _draw_indices(rules, participants, rng):
+    n = rules.n
+    if rules.unconstrained:
+        perm = _rejection_sample(rules, rng, attempts=None)
+        return perm, 'rejection'
+
+    forbidden = rules.forbidden_counts()
+    for santa, count in enumerate(forbidden):
+        if count >= n and not any(rules.allowed(santa, target) for target in range(n)):
+            raise NoValidAssignment(f"{participants[santa]} is not allowed to draw anyone")
+    if rules.labels is not None:
+        sizes = {}
+        for label in rules.labels:
+            sizes[label] = sizes.get(label, 0) + 1
+        size = max(sizes.values())
+        if size > n - size:
+            raise NoValidAssignment(
+                f"A group of {size} participants can only draw from the other {n - size}; "
+                f"no group may be more than half of everyone"
+            )
+
+    expected_violations = sum(forbidden) / n
+    if expected_violations <= MAX_EXPECTED_VIOLATIONS:
+        perm = _rejection_sample(rules, rng, attempts=REJECTION_ATTEMPTS)
+        if perm is not None:
+            return perm, 'rejection'
+
+    if n <= EXACT_MAX:
+        valid = _enumerate(rules)
+        if valid:
+            return list(rng.choice(valid)), 'exact'
+        # No assignment at all; _repair finds out who can't be matched
+
+    perm, touched = _repair(rules, participants, rng)
+    _mix(rules, perm, rng, touched)
+    return perm, 'repair+mix'
+
+
+def _rejection_sample(rules, rng, attempts):
+    """Shuffles until valid; exactly uniform. attempts=None means keep going (unconstrained)."""
+    n = rules.n
+    perm = list(range(n))
+    allowed = rules.allowed
+    if rules.unconstrained:
+        allowed = int.__ne__
+    tries = 0
+    while attempts is None or tries < attempts:
+        tries += 1
+        rng.shuffle(perm)
+        if all(allowed(i, perm[i]) for i in range(n)):
+            return perm
+    return None
+
+
+def _enumerate(rules):
+    """Every valid assignment, by backtracking. Only for small n."""
+    n = rules.n
+    allowed = rules.allowed
+    valid = []
+    perm = [-1] * n
+    taken = [False] * n
+
+    def place(santa):
+        if santa == n:
+            valid.append(tuple(perm))
+            return
+        for target in range(n):
+            if not taken[target] and allowed(santa, target):
+                taken[target] = True
+                perm[santa] = target
+                place(santa + 1)
+                taken[target] = False
+
+    place(0)
+    return valid
+
+
+def _repair(rules, participants, rng):
+    """Turns a random shuffle into a valid assignment by swapping, then augmenting paths.
+    Returns the assignment and the santas whose targets were changed."""
+    n = rules.n
+    allowed = rules.allowed
+    perm = list(range(n))
+    rng.shuffle(perm)
+
+    # The santas still in conflict, in random order, with their positions for O(1) removal
+    conflicts = [santa for santa in range(n) if not allowed(santa, perm[santa])]
+    rng.shuffle(conflicts)
+    position = {santa: i for i, santa in enumerate(conflicts)}
+
+    def resolved(santa):
+        i = position.pop(santa)
+        last = conflicts.pop()
+        if last != santa:
+            conflicts[i] = last
+            position[last] = i
+
+    random_ = rng.random
+    touched = []
+    unmatched = []
+    while conflicts:
+        santa = conflicts[-1]
+        for probe in range(SWAP_PROBES):
+            # Every other probe tries another conflicting santa: with dense rules (two teams)
+            # they are often the only ones holding a target the other can take
+            other = conflicts[int(random_() * len(conflicts))] if probe & 1 else int(random_() * n)
+            if other != santa and allowed(santa, perm[other]) and allowed(other, perm[santa]):
+                perm[santa], perm[other] = perm[other], perm[santa]
+                touched += (santa, other)
+                resolved(santa)
+                if other in position:
+                    resolved(other)
+                break
+        else:
+            resolved(santa)
+            unmatched.append(santa)
+
+    if unmatched:
+        for santa in unmatched:
+            perm[santa] = -1
+        owner = [-1] * n
+        for santa in range(n):
+            if perm[santa] != -1:
+                owner[perm[santa]] = santa
+        for santa in unmatched:
+            _augment(rules, participants, perm, owner, santa, rng, touched)
+    return perm, list(dict.fromkeys(touched))
+
+
+def _augment(rules, participants, perm, owner, start, rng, touched):
+    """Finds an alternating path from an unmatched santa to a free target (BFS) and flips it."""
+    n = rules.n
+    allowed = rules.allowed
+    # Scan targets from a random offset so the paths found don't favour low indices
+    offset = rng.randrange(n)
+    targets = list(range(offset, n)) + list(range(offset))
+    parent = {}           # target -> santa that reached it
+    visited_santas = {start}
+    queue = deque([start])
+    while queue:
+        santa = queue.popleft()
+        for target in targets:
+            if target in parent or not allowed(santa, target):
+                continue
+            parent[target] = santa
+            if owner[target] == -1:
+                # Flip the path back to the start
+                while True:
+                    s = parent[target]
+                    previous = perm[s]
+                    perm[s] = target
+                    owner[target] = s
+                    touched.append(s)
+                    if s == start:
+                        return
+                    target = previous
+            next_santa = owner[target]
+            if next_santa not in visited_santas:
+                visited_santas.add(next_santa)
+                queue.append(next_santa)
+    names = sorted(str(participants[s]) for s in visited_santas)
+    shown = ", ".join(names[:10]) + (f" and {len(names) - 10} more" if len(names) > 10 else "")
+    raise NoValidAssignment(
+        f"No valid assignment exists: {len(visited_santas)} participants ({shown}) "
+        f"can only draw from {len(parent)} possible recipients"
+    )
+
+
+def _mix(rules, perm, rng, santas):
+    """Markov chain over valid assignments (uniform stationary distribution): each step swaps
+    the target of one of `santas` with a random santa's, or rotates the targets of one of
+    `santas` and two random santas, if the result is valid. `santas` is fixed for the whole
+    run, so every move is as likely as the one undoing it."""
+    n = rules.n
+    k = len(santas)
+    if not k:
+        return
+    allowed = rules.allowed
+    steps = MIX_FACTOR * k + MIX_MIN_STEPS
+    # int(random() * n) is uniform enough here and much faster than randrange
+    random_ = rng.random
+    for step in range(steps):
+        a = santas[int(random_() * k)]
+        b = int(random_() * n)
+        if a == b:
+            continue
+        ta, tb = perm[a], perm[b]
+        if step & 1:
+            c = int(random_() * n)
+            if c == a or c == b:
+                continue
+            tc = perm[c]
+            if allowed(a, tb) and allowed(b, tc) and allowed(c, ta):
+                perm[a], perm[b], perm[c] = tb, tc, ta
+        elif allowed(a, tb) and allowed(b, ta):
+            perm[a], perm[b] = tb, ta
@@ -0,0 +1,228 @@
+"""Draws as durable jobs, so a crash mid-draw can't leave a game stuck in DRAWING.
+
+A draw moves through three phases, each recorded in the same atomic step as the work it
+stands for:
+
+    leased     the game went JOINING -> DRAWING and OWNER holds the job's lease
+    assigned   the pairs are saved and the game is COMPLETED
+    delivered  every assignment DM is in the outbox
+
+The lease names its owner and runs out LEASE_SECONDS later. Each step checks that the
+owner still holds it, so a process that stalled past its lease can't redo the work of
+the one that took over.
+
+A sweeper runs at startup and every SWEEP_INTERVAL_SECONDS. It takes over jobs whose
+lease ran out (a query on a partial index of unfinished jobs, so it costs the same
+however many games there are) and resumes each from its phase: a leased job draws again,
+as nobody has seen those pairs; an assigned job queues the DMs for the saved pairs. DMs
+that were being sent when the process died go out through the outbox once their own
+lease runs out. A job still failing after MAX_ATTEMPTS takeovers is given up.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import async_db as db
+import database
+import dates
+import draw_engine
+import outbox
+
+LEASE_SECONDS = 60
+SWEEP_INTERVAL_SECONDS = 60
+SWEEP_BATCH = 20
+MAX_ATTEMPTS = 3
+# Unique per run, so a restarted process doesn't think it still holds its old leases
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+RECOVERED_TEXT = "The draw was interrupted, so I've finished it."
+GAVE_UP_TEXT = "The draw was interrupted and I couldn't finish it. Start the draw again when everyone is in."
+
+
+def no_draw_text(error):
+    """The group message for a draw the teams make impossible (a draw_engine.NoValidAssignment)."""
+    return f"I can't draw names: {error}\n\nChange the teams with /import and start the draw again."
+
+
+def draw_summary_text(participant_count, results, id_to_name):
+    """Builds the "Draw Complete" group message from the per-recipient DM results."""
+    success_count = sum(1 for r in results if r.ok)
+    blocked = sorted({id_to_name[r.chat_id] for r in results if not r.ok and r.permanent})
+    unreachable = sorted({id_to_name[r.chat_id] for r in results if not r.ok and not r.permanent})
+
+    failed_info = ""
+    if blocked:
+        failed_list = "\n".join([f"• @{name}" for name in blocked])
+        failed_info += (
+            f"\n\nDM Failures!\n"
+            f"The following users need to start a private chat with me:\n"
+            f"{failed_list}\n"
+            f"I'll send them their assignment as soon as they do."
+        )
+    if unreachable:
+        failed_list = "\n".join([f"• @{name}" for name in unreachable])
+        failed_info += (
+            f"\n\nCould not reach Telegram for:\n"
+            f"{failed_list}\n"
+            f"I'll keep trying to send their assignment."
+        )
+
+    return (
+        f"Draw Complete!\n\n"
+        f"Participants: {participant_count}\n"
+        f"DMs Sent: {success_count}\n"
+        f"{failed_info}\n"
+        "Check your DMs to see who you got!"
+    )
+
+
+async def start(group_id):
+    """JOINING -> DRAWING, with the draw job leased to this process. Returns the TransitionResult."""
+    return await db.start_draw_job(group_id, OWNER, time.time() + LEASE_SECONDS)
+
+
+async def roster(group_id):
+    """The (user_id, username) roster to draw from, read from the database rather than the
+    state cache: members enrolled by another process (python enroll.py) aren't in the cache."""
+    return list((await db.load_group_state(group_id)).roster)
+
+
+async def save_draw(group_id, pairs):
+    """Stores the pairs and completes the draw. Returns False if the game left DRAWING (or the
+    job was taken over) meanwhile."""
+    try:
+        await db.save_draw_job(group_id, OWNER, pairs, time.time() + LEASE_SECONDS)
+        return True
+    except database.GameStateError:
+        return False
+    except Exception:
+        # Don't leave the game stuck in DRAWING if saving failed
+        await db.transition_game(group_id, 'abort_draw')
+        await db.abort_draw_job(group_id, OWNER)
+        raise
+
+
+async def send_assignment_dms(bot, group_id, pairs, id_to_name):
+    """DMs every santa their target, completing the job.
+
+    The DMs are stored in the outbox before they're sent, so ones that fail (or are cut off by
+    a crash) are retried later. Returns fanout's DMResults, or None if the job was taken over.
+    """
+    exchange_day = dates.exchange_day_text(await db.get_group_state(group_id))
+    date_info = f"\nExchange Day: {exchange_day}" if exchange_day else ""
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("My Santa Assignments", callback_data='summary_btn')]])
+    messages = [
+        (santa_id,
+         f"You are @{id_to_name[target_id]}'s secret santa!\n\n"
+         f"Make sure you get them something good!\n"
+         f"{date_info}",
+         {'reply_markup': reply_markup})
+        for santa_id, target_id in pairs
+    ]
+    try:
+        message_ids = await db.queue_draw_dms(group_id, OWNER, outbox.queued_entries(group_id, 'assignment', messages))
+    except database.GameStateError:
+        return None
+    return await outbox.send_queued(bot, message_ids, messages)
+
+
+def draw(user_ids, rules):
+    """draw_engine.draw under the group's DrawRules: nobody draws their own team, nor (where the
+    teams leave a way around it) the person they drew last season."""
+    teams = rules.teams or None
+    try:
+        return draw_engine.draw(user_ids, exclusions=rules.previous_pairs, groups=teams)
+    except draw_engine.NoValidAssignment:
+        if not rules.previous_pairs:
+            raise
+    # Small groups can't always avoid last season's pairs; teams are the hard rule
+    return draw_engine.draw(user_ids, groups=teams)
+
+
+async def run(bot, group_id, participants):
+    """Draws names among (user_id, username) participants for a job this process holds, saves
+    them and DMs the santas. Returns the DM results, or None if the game was reset meanwhile.
+
+    Raises draw_engine.NoValidAssignment, with the game back in JOINING, if the teams leave no
+    valid draw."""
+    rules = await db.get_draw_rules(group_id)
+    try:
+        # Big constrained draws are CPU work; keep them off the event loop
+        pairs = await asyncio.to_thread(draw, [user_id for user_id, _ in participants], rules)
+    except draw_engine.NoValidAssignment:
+        await db.transition_game(group_id, 'abort_draw')
+        await db.abort_draw_job(group_id, OWNER)
+        raise
+    if not await save_draw(group_id, pairs):
+        return None
+    return await send_assignment_dms(bot, group_id, pairs, dict(participants))
+
+
+async def _tell_group(bot, group_id, text):
+    try:
+        await bot.send_message(chat_id=group_id, text=text)
+    except Exception as e:
+        logging.info(f"Draw jobs: could not message {group_id}: {e}")
+
+
+async def resume(bot, job):
+    """Carries on a DrawJob this process just took over, from the phase it got to."""
+    group_id = job.group_id
+    state = await db.load_group_state(group_id)
+    if state.status != ('DRAWING' if job.phase == 'leased' else 'COMPLETED'):
+        # The game moved on without the job, e.g. it was cancelled
+        await db.abort_draw_job(group_id, OWNER)
+        return
+
+    if job.attempts > MAX_ATTEMPTS or (job.phase == 'leased' and len(state.roster) < 2):
+        logging.warning(f"Draw jobs: giving up on the {job.phase} draw for {group_id} after {job.attempts} takeovers")
+        await db.abort_draw_job(group_id, OWNER)
+        if job.phase == 'leased':
+            await db.transition_game(group_id, 'abort_draw')
+            await _tell_group(bot, group_id, GAVE_UP_TEXT)
+        return
+
+    id_to_name = dict(state.roster)
+    if job.phase == 'leased':
+        try:
+            results = await run(bot, group_id, state.roster)
+        except draw_engine.NoValidAssignment as e:
+            await _tell_group(bot, group_id, no_draw_text(e))
+            return
+    else:
+        pairs = [(santa_id, target_id) for santa_id, target_id, _ in await db.get_assignments(group_id)]
+        results = await send_assignment_dms(bot, group_id, pairs, id_to_name)
+    if results is None:
+        return
+    logging.info(f"Draw jobs: finished the {job.phase} draw for {group_id}")
+    await _tell_group(bot, group_id, f"{RECOVERED_TEXT}\n\n{draw_summary_text(len(id_to_name), results, id_to_name)}")
+
+
+async def _resume_logged(bot, job):
+    try:
+        await resume(bot, job)
+    except Exception as e:
+        # The lease runs out again and a later sweep retries
+        logging.warning(f"Draw jobs: could not resume the draw for {job.group_id}: {e}")
+
+
+async def sweep(context):
+    """Job callback: resumes draws whose lease ran out."""
+    while True:
+        now = time.time()
+        jobs = await db.claim_draw_jobs(now, OWNER, now + LEASE_SECONDS, SWEEP_BATCH)
+        if jobs:
+            logging.info(f"Draw jobs: resuming {len(jobs)} interrupted draws")
+            await asyncio.gather(*(_resume_logged(context.bot, job) for job in jobs))
+        if len(jobs) < SWEEP_BATCH:
+            return
+
+
+def schedule(application):
+    """Starts the sweeper on the application's JobQueue, first right away."""
+    application.job_queue.run_repeating(sweep, interval=SWEEP_INTERVAL_SECONDS, first=0, name='draw-sweeper')
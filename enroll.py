@@ -0,0 +1,172 @@
+"""Bulk enrollment of participants from a roster file, for groups too big to click Join one by one.
+
+Used by the /import command (an admin sends the file to the group) and from the command line:
+
+    python enroll.py -1001234567890 staff.csv
+    python enroll.py -1001234567890 staff.jsonl --db /srv/santa/santa.db
+
+Each row needs the person's numeric Telegram user id and the name to show, and can give a
+team (or household): nobody draws someone from their own team, so couples can share one.
+
+    CSV    a header row with user_id, username and optionally team columns (other columns
+           are ignored), or just user_id and username without a header
+    JSONL  one {"user_id": 123, "username": "alice", "team": "sales"} object per line
+
+Everyone is added in one transaction and people already in the game are skipped; the
+group's roster message is then refreshed once. A running bot only sees command-line imports
+in its cached roster (/participants) once the cache entry expires, but the draw always reads
+the roster from the database, so nobody imported is left out of it.
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+
+import click
+
+import async_db
+import database
+import roster
+from storage import GameStateError, normalize_status
+
+MAX_ROWS = 10000
+NAME_COLUMNS = ('username', 'name', 'first_name')
+TEAM_COLUMNS = ('team', 'household')
+
+
+class RosterFileError(ValueError):
+    """The roster file can't be read; the message says where and why."""
+
+
+def parse_roster(data, filename=''):
+    """Returns [(user_id, username, team), ...] from the bytes of a CSV or JSONL roster file.
+    team is None for people without one."""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise RosterFileError("the file is not UTF-8 text") from None
+
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in ('.jsonl', '.ndjson', '.json') or (extension != '.csv' and text.lstrip().startswith('{')):
+        members = _parse_jsonl(text)
+    else:
+        members = _parse_csv(text)
+
+    if not members:
+        raise RosterFileError("no participants found")
+    if len(members) > MAX_ROWS:
+        raise RosterFileError(f"{len(members)} rows is more than the limit of {MAX_ROWS}")
+    return members
+
+
+def _member(user_id, username, team, where):
+    try:
+        user_id = int(str(user_id).strip())
+    except ValueError:
+        raise RosterFileError(f"{where}: user_id {user_id!r} is not a number") from None
+    if user_id <= 0:
+        raise RosterFileError(f"{where}: {user_id} is not a Telegram user id")
+    username = str(username or '').strip().lstrip('@')
+    if not username:
+        raise RosterFileError(f"{where}: missing username")
+    team = str(team or '').strip()
+    return user_id, username, team or None
+
+
+def _parse_csv(text):
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(field.strip() for field in row)]
+    if not rows:
+        return []
+    header = [field.strip().lower() for field in rows[0]]
+    if 'user_id' in header:
+        id_column = header.index('user_id')
+        name_column = next((header.index(name) for name in NAME_COLUMNS if name in header), None)
+        if name_column is None:
+            raise RosterFileError("line 1: no username column")
+        team_column = next((header.index(name) for name in TEAM_COLUMNS if name in header), None)
+        rows = rows[1:]
+        first_line = 2
+    else:
+        id_column, name_column, team_column = 0, 1, None
+        first_line = 1
+
+    members = []
+    for line, row in enumerate(rows, first_line):
+        if len(row) <= max(id_column, name_column):
+            raise RosterFileError(f"line {line}: expected user_id and username")
+        team = row[team_column] if team_column is not None and team_column < len(row) else None
+        members.append(_member(row[id_column], row[name_column], team, f"line {line}"))
+    return members
+
+
+def _parse_jsonl(text):
+    members = []
+    for line, raw in enumerate(text.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise RosterFileError(f"line {line}: invalid JSON ({e.msg})") from None
+        if not isinstance(row, dict) or 'user_id' not in row:
+            raise RosterFileError(f"line {line}: expected an object with user_id and username")
+        username = next((row[name] for name in NAME_COLUMNS if row.get(name)), None)
+        team = next((row[name] for name in TEAM_COLUMNS if row.get(name)), None)
+        members.append(_member(row['user_id'], username, team, f"line {line}"))
+    return members
+
+
+def can_enroll(status):
+    """Whether people can still be added: after the draw they wouldn't have a target."""
+    return normalize_status(status) in ('JOINING', '')
+
+
+async def _refresh_roster(token, group_id):
+    from telegram import Bot
+    async with Bot(token) as bot:
+        await roster.publisher.refresh(bot, group_id)
+    async_db.shutdown()
+
+
+@click.command(context_settings={'ignore_unknown_options': True})  # group ids are negative
+@click.argument('group_id', type=int)
+@click.argument('roster_file', type=click.File('rb'))
+@click.option('--db', 'db_path', help=f"SQLite database file (default: {database.DATABASE_NAME}).")
+@click.option('--refresh/--no-refresh', default=True,
+              help="Update the group's roster message afterwards (needs TELEGRAM_TOKEN).")
+def main(group_id, roster_file, db_path, refresh):
+    """Adds everyone in ROSTER_FILE (CSV or JSONL) to the game in GROUP_ID."""
+    if db_path:
+        database.DATABASE_NAME = db_path
+    try:
+        members = parse_roster(roster_file.read(), roster_file.name)
+    except RosterFileError as e:
+        raise click.ClickException(f"{roster_file.name}: {e}")
+
+    database.init_db()
+    try:
+        try:
+            added = database.add_participants_bulk(group_id, members)
+        except GameStateError:
+            raise click.ClickException(f"The game in {group_id} is {database.get_game_status(group_id)}; "
+                                       f"participants can only be added before the draw.")
+        click.echo(f"{len(added)} added, {len(members) - len(added)} already in the game.")
+
+        if added and refresh:
+            token = os.getenv('TELEGRAM_TOKEN') or os.getenv('TOKEN')
+            if token:
+                asyncio.run(_refresh_roster(token, group_id))
+            else:
+                click.echo("TELEGRAM_TOKEN is not set; the roster message will update on the next join.")
+    finally:
+        database.close_db()
+
+
+if __name__ == '__main__':
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
+    main()
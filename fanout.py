@@ -0,0 +1,98 @@
+"""Concurrent, rate-limited delivery of direct messages (e.g. draw results).
+
+All sends share one global token bucket sized to Telegram's bot-wide limit of roughly
+30 messages per second. A RetryAfter from Telegram pauses every sender, not just the one
+that hit it; transient network errors are retried with exponential backoff.
+"""
+import asyncio
+import datetime
+import logging
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+from aiolimiter import AsyncLimiter
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+MESSAGES_PER_SECOND = 30
+MAX_CONCURRENT_SENDS = 50
+MAX_ATTEMPTS = 4
+BASE_BACKOFF_SECONDS = 0.5
+
+_limiter = AsyncLimiter(MESSAGES_PER_SECOND, 1)
+_paused_until = 0.0
+
+
+@dataclass
+class DMResult:
+    """Outcome of delivering one message to one recipient."""
+    chat_id: int
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+    # True when retrying cannot help, e.g. the user never started a chat with the bot
+    permanent: bool = False
+
+
+def retry_after_seconds(exc):
+    delay = exc.retry_after
+    if isinstance(delay, datetime.timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+async def _wait_for_flood_pause():
+    loop = asyncio.get_running_loop()
+    while True:
+        remaining = _paused_until - loop.time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(remaining)
+
+
+async def send_dm(bot, chat_id, text, **kwargs):
+    """Sends one message under the global rate limit, retrying where it makes sense."""
+    global _paused_until
+    loop = asyncio.get_running_loop()
+    attempts = 0
+    while True:
+        attempts += 1
+        await _wait_for_flood_pause()
+        async with _limiter:
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return DMResult(chat_id, True, attempts)
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so make everyone wait
+                _paused_until = max(_paused_until, loop.time() + retry_after_seconds(e))
+                error = e
+            except (Forbidden, BadRequest) as e:
+                return DMResult(chat_id, False, attempts, str(e), permanent=True)
+            except NetworkError as e:
+                error = e
+        if attempts >= MAX_ATTEMPTS:
+            logging.error(f"Failed to DM {chat_id} after {attempts} attempts: {error}")
+            return DMResult(chat_id, False, attempts, str(error))
+        if not isinstance(error, RetryAfter):
+            backoff = BASE_BACKOFF_SECONDS * (2 ** (attempts - 1))
+            await asyncio.sleep(backoff + random.uniform(0, backoff))
+
+
+async def send_dms(bot, messages, concurrency=MAX_CONCURRENT_SENDS):
+    """Sends many DMs concurrently.
+
+    `messages` is an iterable of (chat_id, text) or (chat_id, text, send_message kwargs).
+    Returns one DMResult per message, in the same order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(message):
+        chat_id, text, *extra = message
+        async with semaphore:
+            try:
+                return await send_dm(bot, chat_id, text, **(extra[0] if extra else {}))
+            except Exception as e:
+                logging.error(f"Failed to DM {chat_id}: {e}")
+                return DMResult(chat_id, False, 1, str(e), permanent=True)
+
+    return await asyncio.gather(*(deliver(m) for m in messages))
@@ -1,6 +1,19 @@
+import asyncio
 import logging
-import random
+import admins
+import admission
+import archive
 import database 
+import dates
+import draw_engine
+import enroll
+import async_db as db
+import draw_jobs
+import metrics
+import outbox
+import reminders
+import roster
+import update_processor
 from telegram.ext import ContextTypes
 from telegram import Update
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
@@ -8,11 +21,14 @@ from telegram.ext import (
     Application, 
     CommandHandler, 
     CallbackQueryHandler, 
+    ChatMemberHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,     
     filters             
 )
+from telegram.request import HTTPXRequest
+from storage import GameStateError
 import datetime
 import os
 try:
@@ -25,6 +41,35 @@ TOKEN = os.getenv('TELEGRAM_TOKEN') or os.getenv('TOKEN')
 if not TOKEN:
     raise SystemExit('Error: TELEGRAM_TOKEN environment variable not set.')
 
+# Prometheus endpoint on localhost (disabled unless set) and the user ids allowed to run /stats
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+BOT_ADMIN_IDS = {int(x) for x in os.getenv('BOT_ADMIN_IDS', '').replace(',', ' ').split()}
+
+# Update delivery. BOT_MODE=webhook serves Telegram's webhook from a local HTTP server
+# (tornado, via python-telegram-bot) meant to sit behind a reverse proxy that terminates TLS:
+#   WEBHOOK_URL     public https URL the proxy forwards to us (required)
+#   WEBHOOK_SECRET  secret token Telegram sends with every request; others get 403 (required)
+#   WEBHOOK_LISTEN / WEBHOOK_PORT / WEBHOOK_PATH  where the local server listens
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8443)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS') or 40)
+# Updates queued or being handled. When that many are outstanding, the webhook holds Telegram's
+# request (and polling stops fetching) until one finishes; see update_processor.BacklogQueue.
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE') or 1000)
+# Handlers running at once across all chats; each chat's updates still run one at a time
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES') or 64)
+# Updates that arrive while the bot is down are processed on the next start unless this is set
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '').lower() in ('1', 'true', 'yes')
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise SystemExit(f"Error: BOT_MODE must be 'polling' or 'webhook', not {BOT_MODE!r}.")
+if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    raise SystemExit('Error: webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET.')
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -35,6 +80,9 @@ SETTING_DATE = 1
 async def start_secret_santa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles /start command."""
     if update.effective_chat.type not in ["group", "supergroup"]:
+        # Starting a private chat is what unblocks DMs that failed earlier; send those now
+        if await outbox.deliver_pending(context.bot, update.effective_chat.id):
+            return
         await update.message.reply_text(
             "Use this bot in a group chat, please and thank you. \n\n\nBuilt by @jernal_y✨"
             )
@@ -42,7 +90,7 @@ async def start_secret_santa(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     group_id = update.effective_chat.id
     
-    database.ensure_game_exists(group_id) 
+    await db.ensure_game_exists(group_id) 
 
     keyboard = [[InlineKeyboardButton("Join Secret Santa", callback_data='join_game')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -64,39 +112,81 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/setdate - Set the gift exchange date\n"
         "/daysleft - Show how many days are left until the gift exchange\n"
         "/summary - Get a summary of your secret santa game\n"
+        "/mysanta - (in a DM with me) See who you're buying for in every group\n"
+        "/history - (in a DM with me) See who you drew in your last few seasons\n"
         "/help - Show this help message\n"
         "/cancel - Cancel the current operation and start afresh\n"
-        "/participants - Show the list of participants\n",
+        "/participants - Show the list of participants\n"
+        "/import - (admins) Add everyone in a CSV or JSONL roster file\n",
     )    
 
+MAX_ROSTER_FILE_BYTES = 1024 * 1024
+HISTORY_SEASONS = 3
+
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles /import: an admin adds everyone listed in a roster file at once (see enroll.py).
+
+    The file can be sent with /import as its caption, or /import can be a reply to it.
+    """
+    if update.effective_chat.type not in ["group", "supergroup"]:
+        await update.message.reply_text("This command must be used in a group chat.")
+        return
+
+    group_id = update.effective_chat.id
+    denial = await admin_denial(context.bot, group_id, update.effective_user.id, "import participants")
+    if denial:
+        await update.message.reply_text(denial)
+        return
+
+    message = update.message
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply_text(
+            "Send a CSV or JSONL roster file with /import as its caption, or reply /import to one.\n\n"
+            "Each row needs the person's user_id and username. An optional team column keeps "
+            "people on the same team (or in the same household) from drawing each other."
+        )
+        return
+    if document.file_size and document.file_size > MAX_ROSTER_FILE_BYTES:
+        await message.reply_text("That file is too big. Roster files can be up to 1 MB.")
+        return
+
+    await db.ensure_game_exists(group_id)
+    if not enroll.can_enroll(await db.get_game_status(group_id)):
+        await message.reply_text("Participants can only be added before the draw.")
+        return
+
+    file = await context.bot.get_file(document.file_id)
+    data = await file.download_as_bytearray()
+    try:
+        members = enroll.parse_roster(bytes(data), document.file_name or '')
+    except enroll.RosterFileError as e:
+        await message.reply_text(f"Couldn't read the roster file: {e}")
+        return
+
+    try:
+        added = await db.add_participants_bulk(group_id, members)
+    except GameStateError:
+        # The draw started while the file was being read
+        await message.reply_text("Participants can only be added before the draw.")
+        return
+    await roster.publisher.refresh(context.bot, group_id)
+    await message.reply_text(f"Imported {len(added)} participants ({len(members) - len(added)} were already in).")
+
+
 async def join_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles the Join button."""
     query = update.callback_query
     
     user = query.from_user
     group_id = query.message.chat_id
+    if db.is_known_participant(group_id, user.id):
+        # Repeated clicks are answered from memory
+        await query.answer("You are already in the list!", show_alert=False)
+        return
     username = user.username or user.first_name
-    firstname = user.first_name 
-    added = database.add_participant(user.id, group_id, username) 
-
-    
-    participants = database.get_participants_data(group_id) 
-    count = len(participants)
-    
-    #  Start: Logic for updating the group message keyboard and content 
-    names_list = "\n".join([f"• @{p[1]}" for p in participants])
-    if count >= 2:
-        keyboard = [
-            [InlineKeyboardButton("Join!", callback_data='join_game')],
-            [InlineKeyboardButton("Draw", callback_data='go_draw')]
-        ]
-        group_status_text = 'Is everyone in? Hit Draw!'
-    else:
-        keyboard = [[InlineKeyboardButton("Join!", callback_data='join_game')]]
-        group_status_text = 'Waiting for more people to join...'
-        
-    reply_markup_group = InlineKeyboardMarkup(keyboard) 
-    #  End: Logic for updating the group message keyboard and content 
+    added = await db.add_participant(user.id, group_id, username) 
 
     if added:
         await query.answer("Joining the Secret Santa list...")
@@ -108,60 +198,21 @@ async def join_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
            
         )
 
+        dm_failed = False
         try:
-            # 1. Attempt to send DM to user
+            # Attempt to send DM to user; failures are reported to the group in the next roster update
             await context.bot.send_message(
                 chat_id=user.id, 
                 text=dm_text,
                     
             )
         except Exception:
-            # 2. If DM fails, send a clearer warning to the group
-            try:
-                await context.bot.send_message(
-                    chat_id=group_id, 
-                    text=f"@{username} I couldn't DM you! Please start a private chat with me first "
-                         f"(by searching for me or clicking my name).",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logging.debug(f"Failed to warn group about DM failure: {e}")
-
-        # Announce join to the group
-        try:
-            mention = f"@{user.username}" if user.username else user.first_name
-            await context.bot.send_message(
-                chat_id=group_id,
-                text=f"{mention} has joined the Secret Santa!",
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logging.debug(f"Could not send join announcement: {e}")
+            dm_failed = True
 
-        # Update the inline group message and also post a fresh summary message
-        try:
-            await query.edit_message_text(
-                 text=f"Secret Santa Members\n\n"
-                     f"Total: {count}\n"
-                     f"{names_list}\n\n"
-                     f"{group_status_text}",
-                reply_markup=reply_markup_group, 
-                parse_mode='Markdown'
-            )
-
-            try:
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    text=f"Secret Santa Members\n\n"
-                        f"Total: {count}\n"
-                         f"{names_list}\n\n"
-                         f"{group_status_text}",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logging.debug(f"Could not send group update message: {e}")
-        except Exception as e:
-            logging.debug(f"Could not edit original inline message: {e}")
+        # The group announcement and roster message are batched across joins
+        mention = f"@{user.username}" if user.username else user.first_name
+        roster.publisher.note_join(context.bot, group_id, mention, dm_failed=dm_failed,
+                                   message_id=query.message.message_id)
     else:
         await query.answer("You are already in the list!", show_alert=False)
 
@@ -174,15 +225,12 @@ async def join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user = update.message.from_user
     group_id = update.effective_chat.id
+    if db.is_known_participant(group_id, user.id):
+        await update.message.reply_text("You are already in the list!")
+        return
     username = user.username or user.first_name
-    firstname = user.first_name
 
-    added = database.add_participant(user.id, group_id, username)
-
-    participants = database.get_participants_data(group_id)
-    count = len(participants)
-
-    names_list = "\n".join([f"• @{p[1]}" for p in participants])
+    added = await db.add_participant(user.id, group_id, username)
 
     if added:
         # Try to DM confirmation
@@ -191,50 +239,48 @@ async def join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Wait for the Draw to start."
         )
 
+        dm_failed = False
         try:
             await context.bot.send_message(chat_id=user.id, text=dm_text)
         except Exception:
-            try:
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    text=(f" @{username} I couldn't DM you! Please start a private chat with me first ")
-                )
-            except Exception as e:
-                logging.debug(f"Failed to warn group about DM failure: {e}")
-
-        # Announce to group
-        try:
-            mention = f"@{user.username}" if user.username else user.first_name
-            await context.bot.send_message(chat_id=group_id, text=f"{mention} has joined the Secret Santa!")
-        except Exception as e:
-            logging.debug(f"Could not send join announcement: {e}")
+            dm_failed = True
 
-        # Post a fresh summary message in the group
-        try:
-            if count >= 2:
-                keyboard = [
-                    [InlineKeyboardButton("Join!", callback_data='join_game')],
-                    [InlineKeyboardButton("Draw", callback_data='go_draw')]
-                ]
-                group_status_text = 'Is everyone in? Hit Draw!'
-            else:
-                keyboard = [[InlineKeyboardButton("Join!", callback_data='join_game')]]
-                group_status_text = 'Waiting for more people to join...'
-
-            reply_markup_group = InlineKeyboardMarkup(keyboard)
-
-            await context.bot.send_message(
-                chat_id=group_id,
-                text=(f"Secret Santa Members\n\nTotal: {count}\n"
-                      f"{names_list}\n\n{group_status_text}"),
-                reply_markup=reply_markup_group
-            )
-        except Exception as e:
-            logging.debug(f"Could not send group update message: {e}")
+        # Shares the batched announcement and roster message with the Join button
+        mention = f"@{user.username}" if user.username else user.first_name
+        roster.publisher.note_join(context.bot, group_id, mention, dm_failed=dm_failed)
     else:
         await update.message.reply_text("You are already in the list!")
 
 
+DRAW_RESET_TEXT = "The game was reset while the names were being drawn. Start the draw again when everyone is in."
+
+
+def draw_rejection_text(status):
+    """Explains why a draw can't start given the game's current status."""
+    if status == 'COMPLETED':
+        return "Draw already completed for this group."
+    if status == 'DRAWING':
+        return "A draw is already in progress. Please wait; if it was interrupted, I'll finish it in a minute or two."
+    return f"Cannot start draw. Current status: {status}"
+
+
+async def admin_denial(bot, group_id, user_id, action):
+    """Returns why the user may not `action` in the group, or None if they're an admin."""
+    try:
+        if await admins.cache.is_admin(bot, group_id, user_id):
+            return None
+        return f"Only group admins can {action}."
+    except Exception as e:
+        # If we cannot determine admin status, be conservative and deny
+        logging.info(f"Could not fetch admins of {group_id}: {e}")
+        return f"Could not verify admin status. Only group admins can {action}."
+
+
+async def chat_member_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """An admin was promoted, demoted or left (or the bot's own rights changed): refetch the admins next time."""
+    if admins.changes_admins(update):
+        admins.cache.invalidate(update.effective_chat.id)
+
 
 async def draw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles /draw command to perform the Secret Santa draw (group command)."""
@@ -245,106 +291,46 @@ async def draw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_id = update.effective_chat.id
 
     # Only allow group admins/creator to run the draw
-    try:
-        user = update.effective_user or update.message.from_user
-        member = await context.bot.get_chat_member(group_id, user.id)
-        if member.status not in ("administrator", "creator"):
-            await update.message.reply_text("Only group admins can start the draw.")
-            return
-    except Exception:
-        # If we cannot determine admin status, be conservative and deny
-        await update.message.reply_text("Could not verify admin status. Only group admins can start the draw.")
+    user = update.effective_user or update.message.from_user
+    denial = await admin_denial(context.bot, group_id, user.id, "start the draw")
+    if denial:
+        await update.message.reply_text(denial)
         return
 
-    # Ensure a game row exists and check status to avoid double-draws
-    database.ensure_game_exists(group_id)
-    status = database.get_game_status(group_id)
-    if status == 'COMPLETED':
-        await update.message.reply_text("Draw already completed for this group.")
-        return
-    if status == 'DRAWING':
-        await update.message.reply_text("A draw is already in progress. Please wait.")
+    # Ensure a game row exists and check the (cached) status to reject obvious double-draws early
+    await db.ensure_game_exists(group_id)
+    status = await db.get_game_status(group_id)
+    if status in ('COMPLETED', 'DRAWING'):
+        await update.message.reply_text(draw_rejection_text(status))
         return
 
-    participants = database.get_participants_data(group_id)
+    # Uncached: members enrolled from the command line count too
+    participants = await draw_jobs.roster(group_id)
 
     if len(participants) < 2:
         await update.message.reply_text("Need at least 2 people!")
         return
 
+    # Atomic JOINING -> DRAWING transition; exactly one of any concurrent draws wins it
+    transition = await draw_jobs.start(group_id)
+    if not transition.won:
+        await update.message.reply_text(draw_rejection_text(transition.status))
+        return
+    # Joins are closed now; take the final roster from the database, not the cache
+    participants = await draw_jobs.roster(group_id)
+
     await update.message.reply_text("Drawing names now...")
 
-    # Attempt an atomic status transition to DRAWING; if it fails, another draw is in progress or completed.
     try:
-        set_ok = database.try_set_status_to_drawing(group_id)
-        if not set_ok:
-            current = database.get_game_status(group_id)
-            if current is None or (isinstance(current, str) and current.strip() == ''):
-                try:
-                    database.update_game_status(group_id, 'DRAWING')
-                except Exception:
-                    logging.debug("Fallback: failed to set DRAWING directly")
-            else:
-                await update.message.reply_text(f"Cannot start draw. Current status: {current}")
-                return
-    except Exception:
-        logging.debug("Failed to atomically set game status to DRAWING; falling back to non-atomic update")
-        try:
-            database.update_game_status(group_id, 'DRAWING')
-        except Exception:
-            logging.debug("Failed to set game status to DRAWING; continuing anyway")
-
-    user_ids = [p[0] for p in participants]
-    id_to_name = {p[0]: p[1] for p in participants}
-
-    random.shuffle(user_ids)
-
-    pairs = []
-    for i in range(len(user_ids)):
-        santa_id = user_ids[i]
-        target_id = user_ids[(i + 1) % len(user_ids)]
-        pairs.append((santa_id, target_id))
-
-    database.update_assignments_and_status(group_id, pairs)
-    exchange_date = database.get_exchange_date(group_id)
-    date_info = f"\nExchange Day: {exchange_date}" if exchange_date else ""
-
-    failed_dms = []
-    success_count = 0
-    for santa_id, target_id in pairs:
-        target_name = id_to_name[target_id]
-        try:
-            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Refresh Summary", callback_data='summary_btn')]])
-            await context.bot.send_message(
-                chat_id=santa_id,
-                text=f"You are @{target_name}'s secret santa!\n\n"
-                     f"Make sure you get them something good!\n"
-                     f"{date_info}"
-            )
-            success_count += 1
-        except Exception as e:
-            logging.error(f"Failed to DM {santa_id}: {e}")
-            failed_user_info = next((p for p in participants if p[0] == santa_id), None)
-            if failed_user_info:
-                failed_dms.append(failed_user_info[1])
-
-    failed_info = ""
-    if failed_dms:
-        unique_failed_dms = sorted(list(set(failed_dms)))
-        failed_list = "\n".join([f"• @{name}" for name in unique_failed_dms])
-        failed_info = (
-            f"\n\nDM Failures!\n"
-            f"The following users need to start a private chat with me:\n"
-            f"{failed_list}"
-        )
+        results = await draw_jobs.run(context.bot, group_id, participants)
+    except draw_engine.NoValidAssignment as e:
+        await update.message.reply_text(draw_jobs.no_draw_text(e))
+        return
+    if results is None:
+        await update.message.reply_text(DRAW_RESET_TEXT)
+        return
 
-    await update.message.reply_text(
-        f"Draw Complete!\n\n"
-        f"Participants: {len(user_ids)}\n"
-        f"DMs Sent: {success_count}\n"
-        f"{failed_info}\n"
-        "Check your DMs to see who you got!"
-    )
+    await update.message.reply_text(draw_jobs.draw_summary_text(len(participants), results, dict(participants)))
 
 
 async def go_draw_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -355,91 +341,42 @@ async def go_draw_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group_id = query.message.chat_id
 
     # Admin check
-    try:
-        member = await context.bot.get_chat_member(group_id, user.id)
-        if member.status not in ("administrator", "creator"):
-            await context.bot.send_message(chat_id=group_id, text="Only group admins can start the draw.")
-            return
-    except Exception:
-        await context.bot.send_message(chat_id=group_id, text="Could not verify admin status. Only group admins can start the draw.")
+    denial = await admin_denial(context.bot, group_id, user.id, "start the draw")
+    if denial:
+        await context.bot.send_message(chat_id=group_id, text=denial)
         return
 
     # Reuse the same logic as draw_command but adapted for callback context
-    database.ensure_game_exists(group_id)
-    status = database.get_game_status(group_id)
-    if status == 'COMPLETED':
-        await context.bot.send_message(chat_id=group_id, text="Draw already completed for this group.")
-        return
-    if status == 'DRAWING':
-        await context.bot.send_message(chat_id=group_id, text="A draw is already in progress. Please wait.")
+    await db.ensure_game_exists(group_id)
+    status = await db.get_game_status(group_id)
+    if status in ('COMPLETED', 'DRAWING'):
+        await context.bot.send_message(chat_id=group_id, text=draw_rejection_text(status))
         return
 
-    participants = database.get_participants_data(group_id)
+    participants = await draw_jobs.roster(group_id)
     if len(participants) < 2:
         await context.bot.send_message(chat_id=group_id, text="Need at least 2 people!")
         return
 
+    transition = await draw_jobs.start(group_id)
+    if not transition.won:
+        await context.bot.send_message(chat_id=group_id, text=draw_rejection_text(transition.status))
+        return
+    participants = await draw_jobs.roster(group_id)
+
     await context.bot.send_message(chat_id=group_id, text="Drawing names now...")
 
     try:
-        set_ok = database.try_set_status_to_drawing(group_id)
-        if not set_ok:
-            current = database.get_game_status(group_id)
-            if current is None or (isinstance(current, str) and current.strip() == ''):
-                try:
-                    database.update_game_status(group_id, 'DRAWING')
-                except Exception:
-                    logging.debug("Fallback: failed to set DRAWING directly")
-            else:
-                await context.bot.send_message(chat_id=group_id, text=f"Cannot start draw. Current status: {current}")
-                return
-    except Exception:
-        logging.debug("Failed to atomically set game status to DRAWING; falling back to non-atomic update")
-        try:
-            database.update_game_status(group_id, 'DRAWING')
-        except Exception:
-            logging.debug("Failed to set game status to DRAWING; continuing anyway")
-
-    user_ids = [p[0] for p in participants]
-    id_to_name = {p[0]: p[1] for p in participants}
-    random.shuffle(user_ids)
-    pairs = []
-    for i in range(len(user_ids)):
-        santa_id = user_ids[i]
-        target_id = user_ids[(i + 1) % len(user_ids)]
-        pairs.append((santa_id, target_id))
-
-    database.update_assignments_and_status(group_id, pairs)
-    exchange_date = database.get_exchange_date(group_id)
-    date_info = f"\nExchange Day: {exchange_date}" if exchange_date else ""
-
-    failed_dms = []
-    success_count = 0
-    for santa_id, target_id in pairs:
-        target_name = id_to_name[target_id]
-        try:
-            await context.bot.send_message(
-                chat_id=santa_id,
-                text=f"You are @{target_name}'s secret santa!\n\nMake sure you get them something good!\n{date_info}"
-            )
-            success_count += 1
-        except Exception as e:
-            logging.error(f"Failed to DM {santa_id}: {e}")
-            failed_user_info = next((p for p in participants if p[0] == santa_id), None)
-            if failed_user_info:
-                failed_dms.append(failed_user_info[1])
-
-    failed_info = ""
-    if failed_dms:
-        unique_failed_dms = sorted(list(set(failed_dms)))
-        failed_list = "\n".join([f"• @{name}" for name in unique_failed_dms])
-        failed_info = (
-            f"\n\nDM Failures!\nThe following users need to start a private chat with me:\n{failed_list}"
-        )
+        results = await draw_jobs.run(context.bot, group_id, participants)
+    except draw_engine.NoValidAssignment as e:
+        await context.bot.send_message(chat_id=group_id, text=draw_jobs.no_draw_text(e))
+        return
+    if results is None:
+        await context.bot.send_message(chat_id=group_id, text=DRAW_RESET_TEXT)
+        return
 
-    await context.bot.send_message(chat_id=group_id, text=(
-        f"Draw Complete!\n\nParticipants: {len(user_ids)}\nDMs Sent: {success_count}\n{failed_info}\nCheck your DMs to see who you got!"
-    ))
+    await context.bot.send_message(chat_id=group_id,
+                                   text=draw_jobs.draw_summary_text(len(participants), results, dict(participants)))
 
 async def set_date_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the conversation by asking for the gift exchange date."""
@@ -465,10 +402,15 @@ async def setdate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # If user provided the date inline: /setdate Dec 24
     if context.args:
         exchange_date = " ".join(context.args)
+        try:
+            exchange_on = dates.parse_exchange_date(exchange_date)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return ConversationHandler.END
         group_id = update.effective_chat.id
-        database.ensure_game_exists(group_id)
-        database.update_exchange_date(group_id, exchange_date)
-        await update.message.reply_text(f"Saved exchange date: {exchange_date}")
+        await db.ensure_game_exists(group_id)
+        await db.update_exchange_date(group_id, exchange_date, exchange_on)
+        await update.message.reply_text(f"Saved exchange date: {dates.format_exchange_date(exchange_on)}")
         return ConversationHandler.END
 
     # Otherwise start the interactive flow
@@ -478,13 +420,18 @@ async def set_date_finish(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Receives the date and saves it to the database."""
     group_id = update.effective_chat.id
     exchange_date = update.message.text
+    try:
+        exchange_on = dates.parse_exchange_date(exchange_date)
+    except ValueError as e:
+        # Stay in the conversation so they can try again (or /cancel)
+        await update.message.reply_text(f"{e}\n\nTo cancel, use /cancel.")
+        return SETTING_DATE
     # Ensure the game row exists so the date is saved
-    database.ensure_game_exists(group_id)
-    database.update_exchange_date(group_id, exchange_date)
+    await db.ensure_game_exists(group_id)
+    await db.update_exchange_date(group_id, exchange_date, exchange_on)
     
     await update.message.reply_text(
-        f"It's a date!: on {exchange_date}\n\n",
-        parse_mode='Markdown'
+        f"It's a date!: on {dates.format_exchange_date(exchange_on)}\n\n",
     )
     return ConversationHandler.END
 
@@ -497,46 +444,38 @@ async def days_left(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles /daysleft command, calculating days remaining until exchange."""
     group_id = update.effective_chat.id
     
-    date_str = database.get_exchange_date(group_id)
-    
-    if not date_str:
+    state = await db.get_group_state(group_id)
+
+    if not state.exchange_date:
         await update.message.reply_text(
             "⚠️ The gift exchange date has not been set yet! "
             "Please use the `/setdate` command first."
         )
         return
 
-    try:
-        today = datetime.date.today()
-        current_year = today.year
-        cleaned_date_str = date_str.lower().replace('st', '').replace('nd', '').replace('rd', '').replace('th', '')
-        exchange_date = datetime.datetime.strptime(f"{cleaned_date_str} {current_year}", "%b %d %Y").date()
-        if exchange_date < today:
-            next_year = current_year + 1
-            exchange_date = datetime.datetime.strptime(f"{cleaned_date_str} {next_year}", "%b %d %Y").date()
-
-        time_until = exchange_date - today
-        days_remaining = time_until.days
-        if days_remaining < 0:
-            await update.message.reply_text(
-                f"How were the gifts?"
-            )
-        elif days_remaining == 0:
-            await update.message.reply_text(
-                f"IT'S TODAY!\n\n"
-                f"Let's see those gifts!"
-            )
-        else:
-            await update.message.reply_text(
-                f"You have exactly {days_remaining} days left to shop! Happy gifting!"
-            )
-
-    except ValueError:
+    if state.exchange_on is None:
+        # Set before dates were parsed at /setdate, and not understood when migrating
         await update.message.reply_text(
             f"Error Calculating Date!\n\n"
-            f"I couldn't understand the date format: {date_str}.\n"
+            f"I couldn't understand the date format: {state.exchange_date}.\n"
             " Ask the admin to use `/setdate` with a clear format (e.g., 'Dec 24th')."
         )
+        return
+
+    days_remaining = (state.exchange_on - datetime.date.today()).days
+    if days_remaining < 0:
+        await update.message.reply_text(
+            f"How were the gifts?"
+        )
+    elif days_remaining == 0:
+        await update.message.reply_text(
+            f"IT'S TODAY!\n\n"
+            f"Let's see those gifts!"
+        )
+    else:
+        await update.message.reply_text(
+            f"You have exactly {days_remaining} days left to shop! Happy gifting!"
+        )
 
 
 async def participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -546,7 +485,7 @@ async def participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     group_id = update.effective_chat.id
-    participants = database.get_participants_data(group_id)
+    participants = await db.get_participants_data(group_id)
 
     if not participants:
         await update.message.reply_text(
@@ -570,13 +509,12 @@ async def showdate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Debug: shows stored exchange date and game status for the current group/chat."""
     group_id = update.effective_chat.id
     # Ensure DB row exists
-    database.ensure_game_exists(group_id)
-    status = database.get_game_status(group_id)
-    exchange_date = database.get_exchange_date(group_id)
-    participants = database.get_participants_data(group_id)
-    participants_display = 'none' if len(participants) == 0 else str(len(participants))
+    await db.ensure_game_exists(group_id)
+    state = await db.get_group_state(group_id)
+    participants_display = 'none' if len(state.roster) == 0 else str(len(state.roster))
     await update.message.reply_text(
-        f"Game status: {status}\nExchange date: {exchange_date or '(not set)'}\nParticipants: {participants_display}"
+        f"Game status: {state.status}\nExchange date: {state.exchange_date or '(not set)'}"
+        f" (parsed: {state.exchange_on or 'none'})\nParticipants: {participants_display}"
     )
 
 
@@ -587,9 +525,17 @@ async def cancelgame_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     group_id = update.effective_chat.id
+    denial = await admin_denial(context.bot, group_id, update.effective_user.id, "reset the game")
+    if denial:
+        await update.message.reply_text(denial)
+        return
     try:
-        database.cancel_game_full(group_id)
-        await update.message.reply_text("Secret Santa fully reset. Participants and date cleared; status set to JOINING.")
+        archived = await db.cancel_game_full(group_id)
+        roster.publisher.forget(group_id)
+        text = "Secret Santa fully reset. Participants and date cleared; status set to JOINING."
+        if archived:
+            text += "\nLast season's draw is kept; participants can see it with /history."
+        await update.message.reply_text(text)
     except Exception as e:
         logging.debug(f"Failed to fully cancel game for {group_id}: {e}")
         await update.message.reply_text("Failed to fully reset the game. See logs.")
@@ -604,15 +550,15 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     group_id = update.effective_chat.id
-    database.ensure_game_exists(group_id)
-    status = database.get_game_status(group_id)
-    if status != 'COMPLETED':
+    await db.ensure_game_exists(group_id)
+    state = await db.get_group_state(group_id)
+    if state.status != 'COMPLETED':
         await update.message.reply_text("The draw has not been completed yet. Use this after the draw.")
         return
 
-    participants = database.get_participants_data(group_id)
+    participants = state.roster
     count = len(participants)
-    exchange_date = database.get_exchange_date(group_id) or '(not set)'
+    exchange_date = dates.exchange_day_text(state) or '(not set)'
     if count == 0:
         await update.message.reply_text(
             f"Secret Santa Summary\n\nParticipants: none\n\nExchange Day: {exchange_date}"
@@ -627,11 +573,138 @@ async def summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Exchange Day: {exchange_date}"
     )
 
-def main():
-    database.init_db()
+def _latency_lines(histograms, limit=10):
+    """One line per label, busiest (by total time) first: calls, p50 and p95 in ms."""
+    lines = []
+    ranked = sorted(histograms.items(), key=lambda item: item[1].sum, reverse=True)
+    for name, h in ranked[:limit]:
+        lines.append(f"• {name}: {h.count} calls, p50 {h.quantile(0.5) * 1000:.1f}ms, "
+                     f"p95 {h.quantile(0.95) * 1000:.1f}ms")
+    return lines
+
+
+def update_queue_depth(application):
+    """Updates fetched but not yet handled, by stage."""
+    depth = {'queued': application.update_queue.qsize()}
+    if isinstance(application.update_queue, update_processor.BacklogQueue):
+        depth['outstanding'] = application.update_queue.outstanding
+    if isinstance(application.update_processor, update_processor.PerChatUpdateProcessor):
+        depth.update(application.update_processor.depth())
+    return depth
+
+
+def stats_text(application):
+    """Builds the /stats reply from the in-process metrics."""
+    depth = update_queue_depth(application)
+    sections = ["Updates: " + ", ".join(f"{count} {stage.replace('_', ' ')}" for stage, count in depth.items())]
+    for title, histogram_name, error_name in (
+        ("Handlers", 'santa_handler_seconds', 'santa_handler_errors_total'),
+        ("Database", 'santa_db_query_seconds', 'santa_db_query_errors_total'),
+        ("Telegram API", 'santa_telegram_api_seconds', 'santa_telegram_api_errors_total'),
+    ):
+        histograms = metrics.snapshot(histogram_name)
+        errors = metrics.snapshot(error_name)
+        lines = _latency_lines(histograms)
+        if errors:
+            lines.append("Errors: " + ", ".join(f"{name} {count}" for name, count in sorted(errors.items())))
+        sections.append(f"{title}\n" + ("\n".join(lines) or "(no calls yet)"))
+
+    lock_wait = metrics.snapshot('santa_sqlite_lock_wait_seconds')
+    if lock_wait:
+        total = sum(h.sum for h in lock_wait.values())
+        worst = max(lock_wait.items(), key=lambda item: item[1].sum)
+        sections.append(f"SQLite lock wait: {total * 1000:.1f}ms total, most in {worst[0]}")
+    cache = database.cache_stats()
+    sections.append(f"State cache: {cache['size']} groups, {cache['hit_ratio']:.0%} hits")
+    admin_cache = admins.cache.stats()
+    sections.append(f"Admin cache: {admin_cache['size']} groups, {admin_cache['hits']} hits, "
+                    f"{admin_cache['misses']} misses, {admin_cache['stale']} served stale")
+    return "Bot stats\n\n" + "\n\n".join(sections)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles /stats: latency and error counts for bot operators (BOT_ADMIN_IDS)."""
+    if update.effective_user.id not in BOT_ADMIN_IDS:
+        await update.message.reply_text("Only bot admins can see stats.")
+        return
+    await update.message.reply_text(stats_text(context.application))
+
+
+async def flush_rosters(application: Application):
+    """post_stop hook: publishes batched join updates before the bot disconnects."""
+    await roster.publisher.flush_all(application.bot)
+
+
+async def close_database(application: Application):
+    """post_shutdown hook: drains queued database work and closes the pooled SQLite connections."""
+    db.shutdown()
+    database.close_db()
+
+
+async def group_title(bot, group_id):
+    try:
+        chat = await bot.get_chat(group_id)
+        return chat.title or str(group_id)
+    except Exception:
+        return f"Group {group_id}"
+
+
+async def my_assignments_text(bot, user_id):
+    """Lists who the user is buying for in every group they've been drawn in."""
+    assignments = await db.get_all_assignments_for_user(user_id)
+    if not assignments:
+        return "You don't have any Secret Santa assignments yet."
+
+    titles = await asyncio.gather(*(group_title(bot, group_id) for group_id, _, _ in assignments))
+    lines = []
+    for title, (group_id, target_name, exchange_date) in zip(titles, assignments):
+        line = f"• {title}: you are @{target_name}'s secret santa"
+        if exchange_date:
+            line += f" (Exchange Day: {exchange_date})"
+        lines.append(line)
+    return "Your Secret Santa Assignments\n\n" + "\n".join(lines)
+
+
+async def my_assignments_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles /mysanta in a private chat: the user's assignments across all groups."""
+    if update.effective_chat.type != "private":
+        await update.message.reply_text("Send me /mysanta in a private chat so your assignments stay secret!")
+        return
+    await update.message.reply_text(await my_assignments_text(context.bot, update.effective_user.id))
 
-    application = Application.builder().token(TOKEN).build()
 
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles /history in a private chat: who the user drew in their last few seasons per group."""
+    if update.effective_chat.type != "private":
+        await update.message.reply_text("Send me /history in a private chat so your assignments stay secret!")
+        return
+    history = await db.get_draw_history(update.effective_user.id, HISTORY_SEASONS)
+    if not history:
+        await update.message.reply_text("You haven't been drawn in any Secret Santa yet.")
+        return
+
+    group_ids = list(dict.fromkeys(group_id for group_id, _, _, _ in history))
+    titles = dict(zip(group_ids, await asyncio.gather(*(group_title(context.bot, g) for g in group_ids))))
+    lines = []
+    for group_id in group_ids:
+        lines.append(f"\n{titles[group_id]}")
+        for _, season, year, target_name in (row for row in history if row[0] == group_id):
+            lines.append(f"• {year or f'Season {season}'}: @{target_name}")
+    await update.message.reply_text("Your Secret Santa History\n" + "\n".join(lines))
+
+
+async def summary_button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the 'My Santa Assignments' button on the draw DM."""
+    query = update.callback_query
+    await query.answer()
+    await context.bot.send_message(
+        chat_id=query.from_user.id,
+        text=await my_assignments_text(context.bot, query.from_user.id)
+    )
+
+
+def register_handlers(application: Application):
+    """Adds all of the bot's handlers to the application (shared with the load-test harness)."""
     date_conv_handler = ConversationHandler(
         entry_points=[CommandHandler('setdate', setdate_command)],
         states={
@@ -649,18 +722,66 @@ def main():
     application.add_handler(CommandHandler("participants", participants))
     application.add_handler(CommandHandler(["draw", "redraw"], draw_command))
     application.add_handler(CommandHandler("join", join_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r'^/import(@\w+)?(\s|$)'),
+                                           import_command))
     application.add_handler(CommandHandler("summary", summary_command))
+    application.add_handler(CommandHandler("mysanta", my_assignments_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CallbackQueryHandler(summary_button_callback, pattern='^summary_btn$'))
     application.add_handler(CommandHandler("help", help_command))
 
     # Debug helpers
-    application.add_handler(CommandHandler("chatid", lambda u, c: chatid_command(u, c)))
-    application.add_handler(CommandHandler("showdate", lambda u, c: showdate_command(u, c)))
+    application.add_handler(CommandHandler("chatid", chatid_command))
+    application.add_handler(CommandHandler("showdate", showdate_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     # application.add_handler(CommandHandler("cancel", cancel))
     application.add_handler(CommandHandler("cancel", cancelgame_command))
-   
-    
+    application.add_handler(ChatMemberHandler(chat_member_updated, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+
+def main():
+    metrics.instrument_database(database, database.QUERIES)
+    metrics.add_gauge('santa_state_cache', 'Per-group state cache counters', database.cache_stats)
+    metrics.add_gauge('santa_admin_cache', 'Group admin cache counters', admins.cache.stats)
+    database.init_db()
+
+    application = (
+        Application.builder().token(TOKEN)
+        .request(metrics.InstrumentedRequest(HTTPXRequest(connection_pool_size=256)))
+        .update_queue(update_processor.BacklogQueue(UPDATE_QUEUE_SIZE))
+        .concurrent_updates(update_processor.PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES, UPDATE_QUEUE_SIZE,
+                                                                    admission.AdmissionControl()))
+        .post_stop(flush_rosters).post_shutdown(close_database)
+        .build()
+    )
+    register_handlers(application)
+    metrics.instrument_application(application)
+    reminders.schedule(application)
+    outbox.schedule(application)
+    draw_jobs.schedule(application)
+    archive.schedule(application)
+    metrics.add_gauge('santa_update_queue_depth', 'Updates queued, waiting and running',
+                      lambda: update_queue_depth(application))
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+
+    if BOT_MODE == 'webhook':
+        print(f"Bot serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+        )
+        return
+
     print("Bot started polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=DROP_PENDING_UPDATES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
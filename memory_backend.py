@@ -0,0 +1,367 @@
+"""In-memory storage backend for tests and benchmarks. Nothing survives the process.
+
+One lock guards all the data, which makes every operation (including transitions) atomic.
+"""
+import datetime
+import itertools
+import threading
+import time
+
+from state_cache import GroupState
+from storage import GAME_TRANSITIONS, DrawJob, DrawRules, GameStateError, OutboxMessage, TransitionResult, normalize_status
+
+
+class MemoryBackend:
+    cacheable = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # The active season of each group
+        self.games = {}          # group_id -> {'season', 'status', 'exchange_date', 'exchange_on', 'date_started', 'roster_message_id'}
+        self.participants = {}   # group_id -> {user_id: username}, in join order
+        self.teams = {}          # group_id -> {user_id: team label}
+        self.assignments = {}    # group_id -> {santa_id: target_id}
+        self._by_santa = {}      # santa_id -> set of group_ids
+        # Past seasons, oldest first
+        self.seasons = {}        # group_id -> [{'game', 'participants', 'assignments'}]
+        self._past_by_santa = {} # santa_id -> set of group_ids with past seasons they drew in
+        self.reminders = set()   # (group_id, exchange_on, days_before, recipient_id)
+        self.outbox = {}         # id -> {'message': OutboxMessage, 'status', 'next_attempt_at', 'last_error', 'leased_until',
+                                 #       'finished_at'}
+        self._outbox_ids = itertools.count(1)
+        self.draw_jobs = {}      # group_id -> {'phase', 'owner', 'lease_until', 'attempts'} of the active season
+
+    def init(self):
+        pass
+
+    def close(self):
+        pass
+
+    def load_group_state(self, group_id):
+        with self._lock:
+            game = self.games.get(group_id, {})
+            return GroupState(
+                status=game.get('status') or None,
+                exchange_date=game.get('exchange_date') or None,
+                exchange_on=game.get('exchange_on'),
+                roster=tuple(self.participants.get(group_id, {}).items()),
+            )
+
+    def _ensure_game(self, group_id):
+        game = self.games.get(group_id)
+        if game is None:
+            game = self.games[group_id] = {
+                'season': len(self.seasons.get(group_id, ())) + 1,
+                'status': 'JOINING', 'exchange_date': None, 'exchange_on': None,
+                'date_started': datetime.datetime.now().isoformat(), 'roster_message_id': None,
+            }
+        elif not game['status']:
+            game['status'] = 'JOINING'
+        return game
+
+    def ensure_game_exists(self, group_id):
+        with self._lock:
+            self._ensure_game(group_id)
+
+    def update_game_status(self, group_id, status):
+        with self._lock:
+            game = self.games.get(group_id)
+            if game is None:
+                return False
+            game['status'] = status
+            return True
+
+    def add_participant(self, user_id, group_id, username):
+        with self._lock:
+            self._ensure_game(group_id)
+            members = self.participants.setdefault(group_id, {})
+            if user_id in members:
+                return False
+            members[user_id] = username
+            return True
+
+    def add_participants_bulk(self, group_id, members):
+        with self._lock:
+            status = self._ensure_game(group_id)['status']
+            if normalize_status(status) != 'JOINING':
+                raise GameStateError(f"Cannot add participants to {group_id}: status is {status}")
+            current = self.participants.setdefault(group_id, {})
+            teams = self.teams.setdefault(group_id, {})
+            added = []
+            for user_id, username, team in members:
+                if user_id not in current:
+                    current[user_id] = username
+                    added.append(user_id)
+                if team is not None:
+                    teams[user_id] = team
+            return added
+
+    def _apply_transition(self, group_id, event):
+        from_states, to_state = GAME_TRANSITIONS[event]
+        game = self.games.get(group_id)
+        if game is None:
+            return TransitionResult(False, None)
+        if normalize_status(game['status']) in from_states:
+            game['status'] = to_state
+            return TransitionResult(True, to_state)
+        return TransitionResult(False, game['status'] or None)
+
+    def _clear_assignments(self, group_id):
+        for santa_id in self.assignments.pop(group_id, {}):
+            groups = self._by_santa.get(santa_id)
+            if groups is not None:
+                groups.discard(group_id)
+                if not groups:
+                    del self._by_santa[santa_id]
+
+    def _complete_draw(self, group_id, pairs):
+        self._ensure_game(group_id)
+        result = self._apply_transition(group_id, 'complete_draw')
+        if not result.won:
+            raise GameStateError(f"Cannot complete draw for {group_id}: status is {result.status}")
+        self._clear_assignments(group_id)
+        self.assignments[group_id] = dict(pairs)
+        for santa_id, _ in pairs:
+            self._by_santa.setdefault(santa_id, set()).add(group_id)
+
+    def update_assignments_and_status(self, group_id, pairs):
+        with self._lock:
+            self._complete_draw(group_id, pairs)
+
+    def transition_game(self, group_id, event):
+        with self._lock:
+            return self._apply_transition(group_id, event)
+
+    def start_draw_job(self, group_id, owner, lease_until):
+        with self._lock:
+            result = self._apply_transition(group_id, 'start_draw')
+            if result.won:
+                self.draw_jobs[group_id] = {'phase': 'leased', 'owner': owner, 'lease_until': lease_until, 'attempts': 0}
+            return result
+
+    def _held_job(self, group_id, owner, phase):
+        job = self.draw_jobs.get(group_id)
+        if job is None or job['owner'] != owner or job['phase'] != phase:
+            raise GameStateError(f"Draw job for {group_id} is no longer {phase} by {owner}")
+        return job
+
+    def save_draw_job(self, group_id, owner, pairs, lease_until):
+        with self._lock:
+            job = self._held_job(group_id, owner, 'leased')
+            self._complete_draw(group_id, pairs)
+            job.update(phase='assigned', lease_until=lease_until)
+
+    def queue_draw_dms(self, group_id, owner, entries):
+        with self._lock:
+            job = self._held_job(group_id, owner, 'assigned')
+            ids = self._enqueue(entries)
+            job.update(phase='delivered', lease_until=None)
+            return ids
+
+    def claim_draw_jobs(self, now, owner, lease_until, limit):
+        with self._lock:
+            expired = sorted((job['lease_until'], group_id) for group_id, job in self.draw_jobs.items()
+                             if job['phase'] in ('leased', 'assigned') and job['lease_until'] <= now)
+            claimed = []
+            for _, group_id in expired[:limit]:
+                job = self.draw_jobs[group_id]
+                job.update(owner=owner, lease_until=lease_until, attempts=job['attempts'] + 1)
+                claimed.append(DrawJob(group_id, job['phase'], job['attempts']))
+            return claimed
+
+    def abort_draw_job(self, group_id, owner):
+        with self._lock:
+            job = self.draw_jobs.get(group_id)
+            if job is not None and job['owner'] == owner:
+                self._abort_unfinished_job(group_id)
+
+    def _abort_unfinished_job(self, group_id):
+        job = self.draw_jobs.get(group_id)
+        if job is not None and job['phase'] in ('leased', 'assigned'):
+            job.update(phase='aborted', lease_until=None)
+
+    def update_exchange_date(self, group_id, date_text, exchange_on):
+        with self._lock:
+            game = self._ensure_game(group_id)
+            game['exchange_date'] = date_text
+            game['exchange_on'] = exchange_on
+
+    def get_all_assignments_for_user(self, user_id):
+        with self._lock:
+            rows = []
+            for group_id in sorted(self._by_santa.get(user_id, ())):
+                target_id = self.assignments[group_id][user_id]
+                members = self.participants.get(group_id, {})
+                if target_id in members and group_id in self.games:
+                    rows.append((group_id, members[target_id], self.games[group_id]['exchange_date']))
+            return rows
+
+    def cancel_game(self, group_id):
+        with self._lock:
+            self._ensure_game(group_id)
+            self._clear_assignments(group_id)
+            self._apply_transition(group_id, 'cancel')
+            self._abort_unfinished_job(group_id)
+
+    @staticmethod
+    def _year(game):
+        if game['exchange_on']:
+            return game['exchange_on'].year
+        return int(game['date_started'][:4]) if game['date_started'] else None
+
+    def get_draw_history(self, user_id, seasons):
+        with self._lock:
+            rows = []
+            current = self._by_santa.get(user_id, set())
+            for group_id in sorted(current | self._past_by_santa.get(user_id, set())):
+                drawn = []
+                if group_id in current:
+                    drawn.append((self.games[group_id], self.participants.get(group_id, {}),
+                                  self.assignments[group_id]))
+                drawn += [(past['game'], past['participants'], past['assignments'])
+                          for past in reversed(self.seasons.get(group_id, []))]
+                found = [(group_id, game['season'], self._year(game), members[assignments[user_id]])
+                         for game, members, assignments in drawn
+                         if user_id in assignments and assignments[user_id] in members]
+                rows += found[:seasons]
+            return rows
+
+    def cancel_game_full(self, group_id):
+        with self._lock:
+            game = self._ensure_game(group_id)
+            self._abort_unfinished_job(group_id)
+            assignments = self.assignments.get(group_id)
+            if assignments:
+                # Names were drawn: keep the season as history and start the next one
+                self.seasons.setdefault(group_id, []).append({
+                    'game': dict(game, ended_at=datetime.datetime.now().isoformat()),
+                    'participants': self.participants.pop(group_id, {}),
+                    'assignments': dict(assignments),
+                })
+                self.teams.pop(group_id, None)
+                for santa_id in assignments:
+                    self._past_by_santa.setdefault(santa_id, set()).add(group_id)
+                self._clear_assignments(group_id)
+                del self.games[group_id]
+                self._ensure_game(group_id)
+                return True
+            self._clear_assignments(group_id)
+            self.participants.pop(group_id, None)
+            self.teams.pop(group_id, None)
+            self._apply_transition(group_id, 'cancel')
+            game['exchange_date'] = None
+            game['exchange_on'] = None
+            game['roster_message_id'] = None
+            return False
+
+    def games_on_dates(self, dates):
+        dates = set(dates)
+        with self._lock:
+            return [(group_id, game['exchange_on'], game['status']) for group_id, game in self.games.items()
+                    if game['exchange_on'] in dates]
+
+    def get_assignments(self, group_id):
+        with self._lock:
+            members = self.participants.get(group_id, {})
+            return [(santa_id, target_id, members[target_id])
+                    for santa_id, target_id in self.assignments.get(group_id, {}).items() if target_id in members]
+
+    def get_draw_rules(self, group_id):
+        with self._lock:
+            seasons = self.seasons.get(group_id)
+            previous = list(seasons[-1]['assignments'].items()) if seasons else []
+            return DrawRules(previous, dict(self.teams.get(group_id, {})))
+
+    def get_assignments_for_groups(self, group_ids):
+        with self._lock:
+            result = {}
+            for group_id in group_ids:
+                members = self.participants.get(group_id, {})
+                pairs = [(santa_id, target_id, members[target_id])
+                         for santa_id, target_id in self.assignments.get(group_id, {}).items() if target_id in members]
+                if pairs:
+                    result[group_id] = pairs
+            return result
+
+    def sent_reminders(self, dates):
+        dates = set(dates)
+        with self._lock:
+            return {key for key in self.reminders if key[1] in dates}
+
+    def record_reminders(self, reminders):
+        with self._lock:
+            self.reminders.update(tuple(r) for r in reminders)
+
+    def prune_reminders(self, before):
+        with self._lock:
+            self.reminders = {key for key in self.reminders if key[1] >= before}
+
+    def _enqueue(self, entries):
+        now = time.time()
+        ids = []
+        for chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error, leased_until in entries:
+            message_id = next(self._outbox_ids)
+            self.outbox[message_id] = {
+                'message': OutboxMessage(message_id, chat_id, group_id, kind, text, options, attempts, now),
+                'status': 'pending', 'next_attempt_at': next_attempt_at, 'last_error': last_error,
+                'leased_until': leased_until, 'finished_at': None,
+            }
+            ids.append(message_id)
+        return ids
+
+    def enqueue_outbox(self, entries):
+        with self._lock:
+            self._enqueue(entries)
+
+    def _claim(self, entries, lease_until):
+        for entry in entries:
+            entry['next_attempt_at'] = entry['leased_until'] = lease_until
+        return [entry['message'] for entry in entries]
+
+    def claim_outbox(self, now, lease_until, limit):
+        with self._lock:
+            due = sorted((e for e in self.outbox.values() if e['status'] == 'pending' and e['next_attempt_at'] <= now),
+                         key=lambda e: e['next_attempt_at'])
+            return self._claim(due[:limit], lease_until)
+
+    def claim_outbox_for_chat(self, chat_id, now, lease_until):
+        with self._lock:
+            return self._claim([e for e in self.outbox.values()
+                                if e['status'] == 'pending' and e['message'].chat_id == chat_id
+                                and (e['leased_until'] is None or e['leased_until'] <= now)], lease_until)
+
+    def retry_outbox(self, retries):
+        with self._lock:
+            for message_id, attempts, next_attempt_at, error in retries:
+                entry = self.outbox.get(message_id)
+                if entry and entry['status'] == 'pending':
+                    entry['message'] = entry['message']._replace(attempts=attempts)
+                    entry.update(next_attempt_at=next_attempt_at, last_error=error, leased_until=None)
+
+    def _finish(self, entries, status):
+        now = time.time()
+        for entry in entries:
+            if entry['status'] == 'pending':
+                entry.update(status=status, finished_at=now)
+
+    def finish_outbox(self, message_ids, status):
+        with self._lock:
+            self._finish([self.outbox[i] for i in message_ids if i in self.outbox], status)
+
+    def supersede_outbox(self, group_id, kind):
+        with self._lock:
+            self._finish([e for e in self.outbox.values()
+                          if e['message'].group_id == group_id and e['message'].kind == kind], 'superseded')
+
+    def prune_outbox(self, before):
+        with self._lock:
+            for message_id in [i for i, e in self.outbox.items() if e['status'] != 'pending' and e['finished_at'] < before]:
+                del self.outbox[message_id]
+
+    def get_roster_message_id(self, group_id):
+        with self._lock:
+            return self.games.get(group_id, {}).get('roster_message_id')
+
+    def set_roster_message_id(self, group_id, message_id):
+        with self._lock:
+            self._ensure_game(group_id)['roster_message_id'] = message_id
@@ -0,0 +1,313 @@
+"""In-process metrics: latency histograms and counters, exported as Prometheus text.
+
+What gets recorded (all labelled by handler, query or API method name):
+
+    santa_handler_seconds           histogram of handler latency, per handler
+    santa_handler_errors_total      handlers that raised
+    santa_db_query_seconds          histogram of database.py call latency, per function
+    santa_db_query_errors_total
+    santa_sqlite_lock_wait_seconds  time spent waiting for the SQLite write lock, per function
+    santa_telegram_api_seconds      histogram of Bot API call latency, per method
+    santa_telegram_api_errors_total failed Bot API calls, per method
+
+Histogram counts double as call counts. Gauges (e.g. cache stats) are read from callbacks
+registered with add_gauge() at export time.
+
+Enable the HTTP endpoint with start_http_server(port); it serves /metrics on localhost.
+"""
+import bisect
+import functools
+import http.server
+import logging
+import threading
+import time
+
+from telegram.request import BaseRequest
+
+# Upper bounds in seconds; the last bucket (+Inf) is implicit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating within the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * ((rank - seen) / n)
+            seen += n
+        return self.buckets[-1]
+
+
+class _Metric:
+    def __init__(self, name, kind, help_text, label):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.label = label
+        self.values = {}
+
+
+_metrics = {}
+_gauges = []
+
+
+def _metric(name, kind, help_text, label):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = _Metric(name, kind, help_text, label)
+    return metric
+
+
+def observe(name, label_value, seconds, help_text='', label='name'):
+    """Records one observation in the named histogram."""
+    with _lock:
+        metric = _metric(name, 'histogram', help_text, label)
+        histogram = metric.values.get(label_value)
+        if histogram is None:
+            histogram = metric.values[label_value] = Histogram()
+        histogram.observe(seconds)
+
+
+def inc(name, label_value, amount=1, help_text='', label='name'):
+    """Increments the named counter."""
+    with _lock:
+        metric = _metric(name, 'counter', help_text, label)
+        metric.values[label_value] = metric.values.get(label_value, 0) + amount
+
+
+def add_gauge(name, help_text, read):
+    """Registers a gauge whose value(s) come from read() at export time.
+
+    read() returns a number, or a dict of {label value: number} (labelled 'name').
+    """
+    _gauges.append((name, help_text, read))
+
+
+def snapshot(name):
+    """Returns {label value: Histogram or number} for one metric (copies, safe to read)."""
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            return {}
+        if metric.kind == 'histogram':
+            copies = {}
+            for key, h in metric.values.items():
+                copy = Histogram(h.buckets)
+                copy.counts, copy.sum, copy.count = list(h.counts), h.sum, h.count
+                copies[key] = copy
+            return copies
+        return dict(metric.values)
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+def current_query():
+    """Name of the database.py function running on this thread, if any (for lock-wait labels)."""
+    return getattr(_local, 'query', None)
+
+
+# --- Instrumentation ---
+
+def instrument_database(module, names):
+    """Wraps the module's query functions `names` so each outermost call is timed as a query."""
+    for name in names:
+        func = getattr(module, name)
+        if not getattr(func, '_instrumented', False):
+            setattr(module, name, _wrap_query(name, func))
+
+
+def _wrap_query(name, func):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        if getattr(_local, 'query', None) is not None:
+            # Nested call (e.g. ensure_game_exists inside a draw); counted in the outer query
+            return func(*args, **kwargs)
+        _local.query = name
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            inc('santa_db_query_errors_total', name, help_text='database.py calls that raised', label='query')
+            raise
+        finally:
+            _local.query = None
+            observe('santa_db_query_seconds', name, time.perf_counter() - start,
+                    help_text='Latency of database.py calls', label='query')
+    timed._instrumented = True
+    return timed
+
+
+def record_lock_wait(seconds):
+    """Called by the connection pool with the time it took to get the SQLite write lock."""
+    observe('santa_sqlite_lock_wait_seconds', current_query() or 'unknown', seconds,
+            help_text='Time spent waiting for the SQLite write lock', label='query')
+
+
+def handler_name(handler):
+    return getattr(handler.callback, '__name__', None) or type(handler).__name__
+
+
+def instrument_application(application):
+    """Wraps the callback of every registered handler (including inside ConversationHandlers)."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+def _instrument_handler(handler):
+    # ConversationHandler exposes its nested handlers instead of a callback
+    if hasattr(handler, 'entry_points'):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument_handler(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                _instrument_handler(nested)
+        return
+    callback = handler.callback
+    if getattr(callback, '_instrumented', False):
+        return
+    name = handler_name(handler)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            inc('santa_handler_errors_total', name, help_text='Handlers that raised', label='handler')
+            raise
+        finally:
+            observe('santa_handler_seconds', name, time.perf_counter() - start,
+                    help_text='Handler latency', label='handler')
+    timed._instrumented = True
+    handler.callback = timed
+
+
+class InstrumentedRequest(BaseRequest):
+    """Wraps a BaseRequest (the Bot API HTTP layer) to count and time every API call."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout)
+        except Exception:
+            inc('santa_telegram_api_errors_total', api_method, help_text='Failed Bot API calls', label='method')
+            raise
+        finally:
+            observe('santa_telegram_api_seconds', api_method, time.perf_counter() - start,
+                    help_text='Bot API call latency', label='method')
+        if code >= 400:
+            inc('santa_telegram_api_errors_total', api_method, help_text='Failed Bot API calls', label='method')
+        return code, payload
+
+
+# --- Export ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def prometheus_text():
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key in sorted(metric.values, key=str):
+                value = metric.values[key]
+                label = f'{metric.label}="{_escape(key)}"'
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        lines.append(f'{metric.name}_bucket{{{label},le="{_format_bound(bound)}"}} {cumulative}')
+                    lines.append(f'{metric.name}_bucket{{{label},le="+Inf"}} {value.count}')
+                    lines.append(f'{metric.name}_sum{{{label}}} {value.sum}')
+                    lines.append(f'{metric.name}_count{{{label}}} {value.count}')
+                else:
+                    lines.append(f'{metric.name}{{{label}}} {value}')
+    for name, help_text, read in _gauges:
+        try:
+            value = read()
+        except Exception as e:
+            logging.debug(f"Gauge {name} failed: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for key in sorted(value, key=str):
+                lines.append(f'{name}{{name="{_escape(key)}"}} {value[key]}')
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serves /metrics from a daemon thread. Returns the server (call shutdown() to stop it)."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,358 @@
+"""Ordered, versioned schema migrations keyed on PRAGMA user_version.
+
+Each migration runs exactly once, inside its own transaction, and bumps user_version
+as part of that transaction. When the database is already current, startup costs a
+single PRAGMA read.
+
+To change the schema, append a new function to MIGRATIONS; never edit or reorder one
+that has already shipped.
+"""
+import datetime
+import logging
+
+import dates
+
+
+def _games_columns(conn):
+    return [row[1] for row in conn.execute("PRAGMA table_info(games)")]
+
+
+def _base_schema(conn):
+    """The original games/participants/assignments tables, repairing a malformed games table."""
+    # 1. Games Table (Stores overall group settings and status)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS games (
+            group_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            date_started TEXT,
+            exchange_date TEXT
+        )
+    """)
+
+    # 2. Participants Table (Stores who is in which game)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS participants (
+            user_id INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            first_name TEXT,
+            PRIMARY KEY (user_id, group_id)
+        )
+    """)
+
+    # 3. Assignments Table (Stores the draw results: who got who)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS assignments (
+            group_id INTEGER NOT NULL,
+            santa_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            PRIMARY KEY (group_id, santa_id),
+            FOREIGN KEY (group_id) REFERENCES games(group_id),
+            FOREIGN KEY (santa_id) REFERENCES participants(user_id),
+            FOREIGN KEY (target_id) REFERENCES participants(user_id)
+        )
+    """)
+
+    # Older databases could end up with malformed column names in `games` (caused by inline
+    # SQL comments). Rebuild it by copying into a fresh table and renaming that into place;
+    # renaming the *old* table instead is what left assignments pointing at "games_old".
+    cols = set(_games_columns(conn))
+    known = {'group_id', 'status', 'date_started', 'exchange_date', 'roster_message_id'}
+    if cols - known:
+        conn.execute("""
+            CREATE TABLE games_new (
+                group_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                date_started TEXT,
+                exchange_date TEXT
+            )
+        """)
+        common = [c for c in ['group_id', 'status', 'date_started', 'exchange_date'] if c in cols]
+        if 'group_id' in common:
+            cols_sql = ",".join(common)
+            conn.execute(f"INSERT OR IGNORE INTO games_new ({cols_sql}) SELECT {cols_sql} FROM games")
+        conn.execute("DROP TABLE games")
+        conn.execute("ALTER TABLE games_new RENAME TO games")
+
+
+def _games_missing_columns(conn):
+    """Adds the games columns that older databases may lack."""
+    cols = set(_games_columns(conn))
+    for name, sql_type in [('status', 'TEXT'), ('date_started', 'TEXT'), ('exchange_date', 'TEXT'),
+                           ('roster_message_id', 'INTEGER')]:
+        if name not in cols:
+            conn.execute(f"ALTER TABLE games ADD COLUMN {name} {sql_type}")
+    conn.execute("UPDATE games SET status = 'JOINING' WHERE status IS NULL OR status = ''")
+
+
+def _backfill_games_rows(conn):
+    """Creates games rows for groups that only have participants/assignments (was migrate_games.py)."""
+    conn.execute("""
+        INSERT OR IGNORE INTO games (group_id, status, date_started)
+        SELECT g.group_id,
+               CASE WHEN EXISTS (SELECT 1 FROM assignments a WHERE a.group_id = g.group_id)
+                    THEN 'COMPLETED' ELSE 'JOINING' END,
+               ?
+        FROM (SELECT group_id FROM participants UNION SELECT group_id FROM assignments) g
+    """, (datetime.datetime.now().isoformat(),))
+
+
+def _fix_assignments_foreign_key(conn):
+    """Rebuilds assignments if its foreign key still references the dropped games_old table."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'assignments'").fetchone()
+    if row is None or 'games_old' not in row[0]:
+        return
+    conn.execute("""
+        CREATE TABLE assignments_new (
+            group_id INTEGER NOT NULL,
+            santa_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            PRIMARY KEY (group_id, santa_id),
+            FOREIGN KEY (group_id) REFERENCES games(group_id),
+            FOREIGN KEY (santa_id) REFERENCES participants(user_id),
+            FOREIGN KEY (target_id) REFERENCES participants(user_id)
+        )
+    """)
+    conn.execute("INSERT INTO assignments_new (group_id, santa_id, target_id) "
+                 "SELECT group_id, santa_id, target_id FROM assignments")
+    conn.execute("DROP TABLE assignments")
+    conn.execute("ALTER TABLE assignments_new RENAME TO assignments")
+
+
+def _lookup_indexes(conn):
+    """Indexes for the roster and per-santa lookups (both primary keys lead with the other column)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_participants_group ON participants (group_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_assignments_santa ON assignments (santa_id)")
+
+
+def _exchange_on_column(conn):
+    """Adds the parsed exchange date (exchange_on, ISO YYYY-MM-DD) next to the typed text, indexed for date ranges."""
+    if 'exchange_on' not in _games_columns(conn):
+        conn.execute("ALTER TABLE games ADD COLUMN exchange_on DATE")
+    today = datetime.date.today()
+    rows = conn.execute(
+        "SELECT group_id, exchange_date FROM games WHERE exchange_date IS NOT NULL AND exchange_on IS NULL"
+    ).fetchall()
+    for group_id, text in rows:
+        try:
+            exchange_on = dates.parse_exchange_date(text, today)
+        except ValueError:
+            continue    # Left NULL; /daysleft asks for the date to be set again
+        conn.execute("UPDATE games SET exchange_on = ? WHERE group_id = ?", (exchange_on.isoformat(), group_id))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_exchange_on ON games (exchange_on)")
+
+
+def _reminders_sent_table(conn):
+    """Which countdown reminders have been delivered, keyed by date first for the daily lookup."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reminders_sent (
+            exchange_on DATE NOT NULL,
+            group_id INTEGER NOT NULL,
+            days_before INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            sent_at TEXT NOT NULL,
+            PRIMARY KEY (exchange_on, group_id, days_before, recipient_id)
+        ) WITHOUT ROWID
+    """)
+
+
+def _outbox_table(conn):
+    """Messages waiting for (re)delivery. The partial indexes only cover pending rows."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            group_id INTEGER,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            options TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) WHERE status = 'pending'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox (chat_id) WHERE status = 'pending'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_group ON outbox (group_id, kind) WHERE status = 'pending'")
+
+
+def _seasons(conn):
+    """One games row per (group_id, season) with its own game_id; participants and assignments belong to a game.
+
+    Exactly one season per group is active (idx_games_active). The hot-path indexes only
+    cover active games, and participants/assignments are WITHOUT ROWID tables clustered by
+    game_id, so past seasons sit in their own pages and stay out of the working set.
+    Existing rows become season 1 of their group.
+    """
+    conn.execute("""
+        CREATE TABLE games_new (
+            game_id INTEGER PRIMARY KEY,
+            group_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            date_started TEXT,
+            exchange_date TEXT,
+            exchange_on DATE,
+            roster_message_id INTEGER,
+            active INTEGER NOT NULL DEFAULT 1,
+            ended_at TEXT,
+            UNIQUE (group_id, season)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO games_new (group_id, season, status, date_started, exchange_date, exchange_on, roster_message_id)
+        SELECT group_id, 1, status, date_started, exchange_date, exchange_on, roster_message_id FROM games
+    """)
+    # Participants could be added without a games row (/join never created one)
+    conn.execute("""
+        INSERT INTO games_new (group_id, season, status, date_started)
+        SELECT o.group_id, 1,
+               CASE WHEN EXISTS (SELECT 1 FROM assignments a WHERE a.group_id = o.group_id)
+                    THEN 'COMPLETED' ELSE 'JOINING' END,
+               ?
+        FROM (SELECT group_id FROM participants UNION SELECT group_id FROM assignments) o
+        WHERE o.group_id NOT IN (SELECT group_id FROM games_new)
+    """, (datetime.datetime.now().isoformat(),))
+
+    conn.execute("""
+        CREATE TABLE participants_new (
+            game_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            first_name TEXT,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (game_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # seq keeps the join order that rowid used to provide
+    conn.execute("""
+        INSERT INTO participants_new (game_id, user_id, username, first_name, seq)
+        SELECT g.game_id, p.user_id, p.username, p.first_name, p.rowid
+        FROM participants p JOIN games_new g ON g.group_id = p.group_id
+    """)
+    conn.execute("""
+        CREATE TABLE assignments_new (
+            game_id INTEGER NOT NULL,
+            santa_id INTEGER NOT NULL,
+            target_id INTEGER NOT NULL,
+            PRIMARY KEY (game_id, santa_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO assignments_new (game_id, santa_id, target_id)
+        SELECT g.game_id, a.santa_id, a.target_id
+        FROM assignments a JOIN games_new g ON g.group_id = a.group_id
+    """)
+
+    for table in ('assignments', 'participants', 'games'):
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    conn.execute("CREATE UNIQUE INDEX idx_games_active ON games (group_id) WHERE active = 1")
+    conn.execute("CREATE INDEX idx_games_exchange_on ON games (exchange_on) WHERE active = 1")
+    conn.execute("CREATE INDEX idx_participants_order ON participants (game_id, seq)")
+    # Also carries game_id (the rest of the primary key), for both /mysanta and draw history
+    conn.execute("CREATE INDEX idx_assignments_santa ON assignments (santa_id)")
+
+
+def _draw_jobs_table(conn):
+    """One row per drawn season tracking the draw's progress (see draw_jobs.py).
+
+    The partial index only covers unfinished jobs, so the sweeper's search for expired
+    leases stays small however many games there are. Games already stuck in DRAWING get an
+    expired job, so the first sweep finishes their draw.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS draw_jobs (
+            game_id INTEGER PRIMARY KEY REFERENCES games(game_id),
+            group_id INTEGER NOT NULL,
+            phase TEXT NOT NULL,
+            owner TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_draw_jobs_lease ON draw_jobs (lease_until) "
+                 "WHERE phase IN ('leased', 'assigned')")
+    conn.execute("""
+        INSERT OR IGNORE INTO draw_jobs (game_id, group_id, phase, owner, lease_until, attempts, updated_at)
+        SELECT game_id, group_id, 'leased', NULL, 0, 0, strftime('%s', 'now')
+        FROM games WHERE active = 1 AND UPPER(TRIM(status)) = 'DRAWING'
+    """)
+
+
+def _participant_teams(conn):
+    """A team (or household) label per participant, set from /import roster files; nobody
+    draws someone with the same label (see draw_jobs.draw)."""
+    conn.execute("ALTER TABLE participants ADD COLUMN team TEXT")
+
+
+def _outbox_leases(conn):
+    """When a claimed message's lease runs out, in its own column: a claim also moves
+    next_attempt_at forward, so that alone can't tell a message being sent from one not yet due."""
+    conn.execute("ALTER TABLE outbox ADD COLUMN leased_until REAL")
+
+
+def _exchange_on_from_start(conn):
+    """Re-backfills exchange_on for games whose date _exchange_on_column resolved against the
+    day it ran rather than the day the game started ('jan 1st' in a game started 2025-12-15
+    became 2027-01-01). Dates from /setdate are resolved against the day it's sent, which is
+    normally within a year of the season's start, so only dates past that are re-parsed."""
+    rows = conn.execute(
+        "SELECT game_id, exchange_date, date_started, exchange_on FROM games "
+        "WHERE exchange_date IS NOT NULL AND exchange_on > date(date_started, '+1 year')"
+    ).fetchall()
+    for game_id, text, date_started, exchange_on in rows:
+        try:
+            fixed = dates.parse_exchange_date(text, datetime.date.fromisoformat(date_started[:10]))
+        except ValueError:
+            continue    # Unreadable start, or a date with its year typed out; keeps its value
+        if fixed.isoformat() != exchange_on:
+            conn.execute("UPDATE games SET exchange_on = ? WHERE game_id = ?", (fixed.isoformat(), game_id))
+
+
+# Append only. The position in this list (starting at 1) is the schema version.
+MIGRATIONS = [
+    _base_schema,
+    _games_missing_columns,
+    _backfill_games_rows,
+    _fix_assignments_foreign_key,
+    _lookup_indexes,
+    _exchange_on_column,
+    _reminders_sent_table,
+    _outbox_table,
+    _seasons,
+    _draw_jobs_table,
+    _participant_teams,
+    _outbox_leases,
+    _exchange_on_from_start,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(pool):
+    """Applies any pending migrations using the given ConnectionPool. Returns how many ran."""
+    with pool.reader() as conn:
+        if get_version(conn) >= LATEST_VERSION:
+            return 0
+
+    applied = 0
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        with pool.writer() as conn:
+            # Re-check under the write lock: another process may have migrated meanwhile
+            if get_version(conn) >= version:
+                continue
+            logging.info(f"Applying schema migration {version}: {migration.__name__.strip('_')}")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        applied += 1
+    return applied
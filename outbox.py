@@ -0,0 +1,137 @@
+"""Durable outbox for direct messages that couldn't be delivered.
+
+When a draw's assignment DM fails (usually because the santa never started a chat with the
+bot), the message is stored instead of being lost. A job retries due messages with
+exponential backoff, and a user's pending messages go out as soon as they send /start in
+a private chat. Only the stored message is resent; assignments are never touched, so one
+unreachable santa no longer means redrawing the whole group.
+
+Cancelling a game supersedes its pending assignment messages, and messages nobody could
+receive within EXPIRE_AFTER_SECONDS are given up on.
+"""
+import json
+import logging
+import time
+
+from telegram import InlineKeyboardMarkup
+
+import async_db as db
+import fanout
+
+BASE_RETRY_SECONDS = 60
+MAX_RETRY_SECONDS = 6 * 60 * 60
+EXPIRE_AFTER_SECONDS = 14 * 24 * 60 * 60
+DRAIN_INTERVAL_SECONDS = 30
+DRAIN_BATCH = fanout.MESSAGES_PER_SECOND * 3
+# A claimed message is hidden from other drainers this long; after a crash it's retried then
+LEASE_SECONDS = 2 * 60
+PRUNE_INTERVAL_SECONDS = 60 * 60
+KEEP_FINISHED_SECONDS = 7 * 24 * 60 * 60
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the `attempts`th failed attempt: 1, 2, 4, ... minutes, capped."""
+    return min(MAX_RETRY_SECONDS, BASE_RETRY_SECONDS * 2 ** (attempts - 1))
+
+
+def encode_options(kwargs):
+    """Stores send_message keyword arguments (only reply_markup is supported) as JSON."""
+    if not kwargs:
+        return None
+    options = dict(kwargs)
+    if options.get('reply_markup') is not None:
+        options['reply_markup'] = options['reply_markup'].to_dict()
+    return json.dumps(options)
+
+
+def decode_options(options):
+    if not options:
+        return {}
+    kwargs = json.loads(options)
+    if kwargs.get('reply_markup') is not None:
+        kwargs['reply_markup'] = InlineKeyboardMarkup.de_json(kwargs['reply_markup'], None)
+    return kwargs
+
+
+def queued_entries(group_id, kind, messages):
+    """Outbox entries for (chat_id, text, kwargs) messages that are about to be sent with
+    send_queued. They stay leased for as long as sending them should take; if the sender
+    dies mid-send, the drain job picks up the rest after that."""
+    lease_until = time.time() + LEASE_SECONDS + len(messages) / fanout.MESSAGES_PER_SECOND
+    return [(chat_id, group_id, kind, text, encode_options(kwargs), 0, lease_until, None, lease_until)
+            for chat_id, text, kwargs in messages]
+
+
+async def send_queued(bot, message_ids, messages):
+    """Sends messages already stored as `message_ids` (see queued_entries) and records each outcome.
+
+    Returns fanout's DMResults in the same order.
+    """
+    results = await fanout.send_dms(bot, messages)
+    now = time.time()
+    retries = [(message_id, 1, now + retry_delay(1), result.error)
+               for message_id, result in zip(message_ids, results) if not result.ok]
+    if retries:
+        await db.retry_outbox(retries)
+    delivered = [message_id for message_id, result in zip(message_ids, results) if result.ok]
+    if delivered:
+        await db.finish_outbox(delivered, 'delivered')
+    return results
+
+
+async def _deliver(bot, messages):
+    """Sends claimed messages and records each outcome. Returns how many were delivered."""
+    now = time.time()
+    expired = [m.id for m in messages if now - m.created_at > EXPIRE_AFTER_SECONDS]
+    live = [m for m in messages if now - m.created_at <= EXPIRE_AFTER_SECONDS]
+
+    results = await fanout.send_dms(bot, [(m.chat_id, m.text, decode_options(m.options)) for m in live])
+    delivered = []
+    retries = []
+    for message, result in zip(live, results):
+        if result.ok:
+            delivered.append(message.id)
+        else:
+            attempts = message.attempts + 1
+            retries.append((message.id, attempts, now + retry_delay(attempts), result.error))
+
+    if retries:
+        await db.retry_outbox(retries)
+    if delivered:
+        await db.finish_outbox(delivered, 'delivered')
+    if expired:
+        await db.finish_outbox(expired, 'expired')
+        logging.info(f"Outbox: gave up on {len(expired)} messages older than {EXPIRE_AFTER_SECONDS}s")
+    return len(delivered)
+
+
+async def deliver_pending(bot, chat_id):
+    """Sends every pending message for `chat_id` now (e.g. when the user sends /start), except
+    those a draw or the drain job is sending already."""
+    now = time.time()
+    messages = await db.claim_outbox_for_chat(chat_id, now, now + LEASE_SECONDS)
+    if not messages:
+        return 0
+    delivered = await _deliver(bot, messages)
+    logging.info(f"Outbox: delivered {delivered} of {len(messages)} pending messages to {chat_id}")
+    return delivered
+
+
+async def drain(context):
+    """Job callback: retries the messages that are due."""
+    now = time.time()
+    messages = await db.claim_outbox(now, now + LEASE_SECONDS, DRAIN_BATCH)
+    if messages:
+        delivered = await _deliver(context.bot, messages)
+        logging.info(f"Outbox: redelivered {delivered} of {len(messages)} due messages")
+
+
+async def prune(context):
+    """Job callback: deletes messages that were finished a while ago."""
+    await db.prune_outbox(time.time() - KEEP_FINISHED_SECONDS)
+
+
+def schedule(application):
+    """Starts the outbox jobs on the application's JobQueue."""
+    application.job_queue.run_repeating(drain, interval=DRAIN_INTERVAL_SECONDS, first=5, name='outbox-drain')
+    application.job_queue.run_repeating(prune, interval=PRUNE_INTERVAL_SECONDS, first=60, name='outbox-prune')
@@ -0,0 +1,697 @@
+"""Redis storage backend, so several bot workers can share game state.
+
+Keys (all under the configurable prefix, 'santa:' by default):
+
+    game:<group_id>          hash: season, status, exchange_date, exchange_on (ISO date),
+                             date_started, roster_message_id (the active season)
+    members:<group_id>       hash: user_id -> username
+    order:<group_id>         list: user_ids in join order
+    teams:<group_id>         hash: user_id -> team label, for members imported with one
+    assignments:<group_id>   hash: santa_id -> target_id
+    santa:<user_id>          set: group_ids where the user has an assignment (for /mysanta)
+    season:<group_id>:<n>    hash: game fields of past season n, plus ended_at
+    members:<group_id>:<n>, assignments:<group_id>:<n>   the same for past season n
+    history:<user_id>        set: '<group_id>:<n>' past seasons where the user was a santa
+    date:<YYYY-MM-DD>        set: group_ids whose exchange_on is that day (for reminders)
+    reminders:<YYYY-MM-DD>   set: '<group_id>:<days_before>:<recipient_id>' delivered for that
+                             exchange day; expires REMINDER_RETENTION_DAYS after it
+    outbox:<id>              hash: one outbox message (see outbox.py); expires
+                             OUTBOX_RETENTION_SECONDS after it is finished
+    outbox:due               sorted set: pending outbox ids by next attempt time
+    outbox:chat:<chat_id>    set: pending outbox ids for a chat
+    outbox:group:<group_id>:<kind>  set: pending outbox ids about a group
+    drawjob:<group_id>       hash: phase, owner, lease_until, attempts of the active season's draw
+                             (see draw_jobs.py)
+    drawjobs                 sorted set: group_ids of unfinished draw jobs by lease expiry
+
+Anything that checks and then writes runs as a Lua script, which Redis executes
+atomically, so racing workers see exactly one winner per transition. Some scripts touch
+keys derived from their arguments (the santa:<user_id> sets), so this expects a single
+Redis server rather than a cluster.
+"""
+import datetime
+import time
+
+import redis
+
+from state_cache import GroupState
+from storage import GAME_TRANSITIONS, DrawJob, DrawRules, GameStateError, OutboxMessage, TransitionResult
+
+REMINDER_RETENTION_DAYS = 30
+OUTBOX_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+
+def _lua_list(values):
+    return "{" + ", ".join(f"'{v}'" for v in values) + "}"
+
+
+# Shared Lua helpers, prepended to the scripts that need them
+_LUA_HELPERS = """
+local function ensure_game(game, now)
+    local status = redis.call('HGET', game, 'status')
+    if not status or status == '' then
+        redis.call('HSET', game, 'status', 'JOINING')
+    end
+    redis.call('HSETNX', game, 'date_started', now)
+    redis.call('HSETNX', game, 'season', 1)
+end
+
+local function transition(game, to_state, from_states)
+    if redis.call('EXISTS', game) == 0 then
+        return {0, ''}
+    end
+    local status = redis.call('HGET', game, 'status') or ''
+    local current = string.upper(string.match(status, '^%s*(.-)%s*$'))
+    for _, allowed in ipairs(from_states) do
+        if current == allowed then
+            redis.call('HSET', game, 'status', to_state)
+            return {1, to_state}
+        end
+    end
+    return {0, status}
+end
+
+local function set_exchange_on(game, prefix, group_id, exchange_on)
+    local old = redis.call('HGET', game, 'exchange_on')
+    if old then
+        redis.call('SREM', prefix .. 'date:' .. old, group_id)
+    end
+    if exchange_on == '' then
+        redis.call('HDEL', game, 'exchange_on')
+    else
+        redis.call('HSET', game, 'exchange_on', exchange_on)
+        redis.call('SADD', prefix .. 'date:' .. exchange_on, group_id)
+    end
+end
+
+local function clear_assignments(assignments, prefix, group_id)
+    for _, santa in ipairs(redis.call('HKEYS', assignments)) do
+        redis.call('SREM', prefix .. 'santa:' .. santa, group_id)
+    end
+    redis.call('DEL', assignments)
+end
+
+local function abort_unfinished_job(prefix, group_id)
+    local job = prefix .. 'drawjob:' .. group_id
+    local phase = redis.call('HGET', job, 'phase')
+    if phase == 'leased' or phase == 'assigned' then
+        redis.call('HSET', job, 'phase', 'aborted')
+        redis.call('HDEL', job, 'lease_until')
+        redis.call('ZREM', prefix .. 'drawjobs', group_id)
+    end
+end
+
+local function holds_job(job, owner, phase)
+    return redis.call('HGET', job, 'owner') == owner and redis.call('HGET', job, 'phase') == phase
+end
+
+local function enqueue_outbox(due, prefix, chat_id, group_id, kind, text, options, attempts, next_attempt_at,
+                              last_error, leased_until, now)
+    local id = redis.call('INCR', prefix .. 'outbox:ids')
+    redis.call('HSET', prefix .. 'outbox:' .. id, 'chat_id', chat_id, 'group_id', group_id, 'kind', kind,
+               'text', text, 'options', options, 'attempts', attempts, 'last_error', last_error,
+               'created_at', now, 'status', 'pending')
+    if leased_until ~= '' then
+        redis.call('HSET', prefix .. 'outbox:' .. id, 'leased_until', leased_until)
+    end
+    redis.call('ZADD', due, next_attempt_at, id)
+    redis.call('SADD', prefix .. 'outbox:chat:' .. chat_id, id)
+    redis.call('SADD', prefix .. 'outbox:group:' .. group_id .. ':' .. kind, id)
+    return id
+end
+"""
+
+# complete_draw(): DRAWING -> COMPLETED and the pairs in ARGV[first], ARGV[first + 1], ...
+_LUA_COMPLETE_DRAW = _LUA_HELPERS + f"""
+local function complete_draw(game, assignments, now, prefix, group_id, first)
+    ensure_game(game, now)
+    local result = transition(game, '{GAME_TRANSITIONS['complete_draw'][1]}', {_lua_list(GAME_TRANSITIONS['complete_draw'][0])})
+    if result[1] == 0 then
+        return result
+    end
+    clear_assignments(assignments, prefix, group_id)
+    for i = first, #ARGV, 2 do
+        redis.call('HSET', assignments, ARGV[i], ARGV[i + 1])
+        redis.call('SADD', prefix .. 'santa:' .. ARGV[i], group_id)
+    end
+    return result
+end
+"""
+
+# KEYS: game. ARGV: now
+_ENSURE_GAME = _LUA_HELPERS + """
+ensure_game(KEYS[1], ARGV[1])
+"""
+
+# KEYS: game. ARGV: new status, allowed current statuses...
+_TRANSITION = _LUA_HELPERS + """
+local from_states = {}
+for i = 2, #ARGV do
+    from_states[#from_states + 1] = ARGV[i]
+end
+return transition(KEYS[1], ARGV[1], from_states)
+"""
+
+# KEYS: game. ARGV: status
+_UPDATE_STATUS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1])
+return 1
+"""
+
+# KEYS: members, order. ARGV: user_id, username
+_ADD_PARTICIPANT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: members, order, teams, game. ARGV: now, user_1, username_1, team_1 ('' for none), user_2, ...
+# Returns {1, added user ids}, or {0, status} if the season is past JOINING.
+_ADD_PARTICIPANTS = _LUA_HELPERS + """
+ensure_game(KEYS[4], ARGV[1])
+local status = redis.call('HGET', KEYS[4], 'status')
+if string.upper(status) ~= 'JOINING' then
+    return {0, status}
+end
+local added = {}
+for i = 2, #ARGV, 3 do
+    if redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+        added[#added + 1] = ARGV[i]
+    end
+    if ARGV[i + 2] ~= '' then
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 2])
+    end
+end
+return {1, added}
+"""
+
+# KEYS: game, assignments. ARGV: now, prefix, group_id, santa_1, target_1, santa_2, target_2...
+_COMPLETE_DRAW = _LUA_COMPLETE_DRAW + """
+return complete_draw(KEYS[1], KEYS[2], ARGV[1], ARGV[2], ARGV[3], 4)
+"""
+
+# KEYS: game, drawjob, drawjobs. ARGV: group_id, owner, lease_until
+_START_DRAW_JOB = _LUA_HELPERS + f"""
+local result = transition(KEYS[1], '{GAME_TRANSITIONS['start_draw'][1]}', {_lua_list(GAME_TRANSITIONS['start_draw'][0])})
+if result[1] == 1 then
+    redis.call('DEL', KEYS[2])
+    redis.call('HSET', KEYS[2], 'phase', 'leased', 'owner', ARGV[2], 'lease_until', ARGV[3], 'attempts', 0)
+    redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+end
+return result
+"""
+
+# KEYS: game, assignments, drawjob, drawjobs. ARGV: now, prefix, group_id, owner, lease_until, santa_1, target_1, ...
+# Returns {won, status} like _COMPLETE_DRAW, or {-1, ''} if the owner lost the lease.
+_SAVE_DRAW_JOB = _LUA_COMPLETE_DRAW + """
+if not holds_job(KEYS[3], ARGV[4], 'leased') then
+    return {-1, ''}
+end
+local result = complete_draw(KEYS[1], KEYS[2], ARGV[1], ARGV[2], ARGV[3], 6)
+if result[1] == 1 then
+    redis.call('HSET', KEYS[3], 'phase', 'assigned', 'lease_until', ARGV[5])
+    redis.call('ZADD', KEYS[4], ARGV[5], ARGV[3])
+end
+return result
+"""
+
+# KEYS: drawjob, drawjobs, outbox:due. ARGV: prefix, group_id, owner, now, then 9 outbox fields per message
+# (chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error, leased_until).
+# Returns the new outbox ids, or -1 if the owner lost the lease.
+_QUEUE_DRAW_DMS = _LUA_HELPERS + """
+if not holds_job(KEYS[1], ARGV[3], 'assigned') then
+    return -1
+end
+local ids = {}
+for i = 5, #ARGV, 9 do
+    ids[#ids + 1] = enqueue_outbox(KEYS[3], ARGV[1], ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], ARGV[i + 4],
+                                   ARGV[i + 5], ARGV[i + 6], ARGV[i + 7], ARGV[i + 8], ARGV[4])
+end
+redis.call('HSET', KEYS[1], 'phase', 'delivered')
+redis.call('HDEL', KEYS[1], 'lease_until')
+redis.call('ZREM', KEYS[2], ARGV[2])
+return ids
+"""
+
+# KEYS: drawjobs. ARGV: prefix, now, owner, lease_until, limit. Returns {{group_id, phase, attempts}, ...}
+_CLAIM_DRAW_JOBS = """
+local claimed = {}
+for _, group_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'LIMIT', 0, tonumber(ARGV[5]))) do
+    local job = ARGV[1] .. 'drawjob:' .. group_id
+    redis.call('HSET', job, 'owner', ARGV[3], 'lease_until', ARGV[4])
+    local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+    redis.call('ZADD', KEYS[1], ARGV[4], group_id)
+    claimed[#claimed + 1] = {group_id, redis.call('HGET', job, 'phase'), attempts}
+end
+return claimed
+"""
+
+# KEYS: drawjob. ARGV: prefix, group_id, owner
+_ABORT_DRAW_JOB = _LUA_HELPERS + """
+if redis.call('HGET', KEYS[1], 'owner') == ARGV[3] then
+    abort_unfinished_job(ARGV[1], ARGV[2])
+end
+"""
+
+# KEYS: game, assignments, members, order, teams. ARGV: now, prefix, group_id, full ('1' to also clear the roster)
+# A full cancel of a drawn season keeps it as history and starts the next season (returns 1).
+_CANCEL = _LUA_HELPERS + f"""
+ensure_game(KEYS[1], ARGV[1])
+abort_unfinished_job(ARGV[2], ARGV[3])
+if ARGV[4] == '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+    local season = redis.call('HGET', KEYS[1], 'season')
+    local past = ARGV[3] .. ':' .. season
+    redis.call('HSET', ARGV[2] .. 'season:' .. past, unpack(redis.call('HGETALL', KEYS[1])))
+    redis.call('HSET', ARGV[2] .. 'season:' .. past, 'ended_at', ARGV[1])
+    for _, santa in ipairs(redis.call('HKEYS', KEYS[2])) do
+        redis.call('SREM', ARGV[2] .. 'santa:' .. santa, ARGV[3])
+        redis.call('SADD', ARGV[2] .. 'history:' .. santa, past)
+    end
+    redis.call('RENAME', KEYS[2], ARGV[2] .. 'assignments:' .. past)
+    if redis.call('EXISTS', KEYS[3]) == 1 then
+        redis.call('RENAME', KEYS[3], ARGV[2] .. 'members:' .. past)
+    end
+    redis.call('DEL', KEYS[4], KEYS[5])
+    set_exchange_on(KEYS[1], ARGV[2], ARGV[3], '')
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], 'status', 'JOINING', 'date_started', ARGV[1], 'season', tonumber(season) + 1)
+    return 1
+end
+clear_assignments(KEYS[2], ARGV[2], ARGV[3])
+transition(KEYS[1], '{GAME_TRANSITIONS['cancel'][1]}', {_lua_list(GAME_TRANSITIONS['cancel'][0])})
+if ARGV[4] == '1' then
+    redis.call('DEL', KEYS[3], KEYS[4], KEYS[5])
+    set_exchange_on(KEYS[1], ARGV[2], ARGV[3], '')
+    redis.call('HDEL', KEYS[1], 'exchange_date', 'roster_message_id')
+end
+return 0
+"""
+
+# KEYS: game. ARGV: now, prefix, group_id, date text, exchange_on ('' clears either)
+_UPDATE_EXCHANGE_DATE = _LUA_HELPERS + """
+ensure_game(KEYS[1], ARGV[1])
+if ARGV[4] == '' then
+    redis.call('HDEL', KEYS[1], 'exchange_date')
+else
+    redis.call('HSET', KEYS[1], 'exchange_date', ARGV[4])
+end
+set_exchange_on(KEYS[1], ARGV[2], ARGV[3], ARGV[5])
+"""
+
+# KEYS: outbox:due. ARGV: prefix, chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error,
+# leased_until, now
+_OUTBOX_ENQUEUE = _LUA_HELPERS + """
+return enqueue_outbox(KEYS[1], ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6], ARGV[7], ARGV[8], ARGV[9], ARGV[10],
+                      ARGV[11])
+"""
+
+# KEYS: outbox:due. ARGV: prefix, now, lease_until, limit
+_OUTBOX_CLAIM = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'LIMIT', 0, tonumber(ARGV[4]))
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[1], ARGV[3], id)
+    redis.call('HSET', ARGV[1] .. 'outbox:' .. id, 'leased_until', ARGV[3])
+end
+return ids
+"""
+
+# KEYS: outbox:due, outbox:chat:<chat_id>. ARGV: prefix, now, lease_until
+# Skips finished messages and those another claim still holds a lease on.
+_OUTBOX_CLAIM_CHAT = """
+local claimed = {}
+for _, id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    local leased_until = tonumber(redis.call('HGET', ARGV[1] .. 'outbox:' .. id, 'leased_until'))
+    if redis.call('ZSCORE', KEYS[1], id) and (not leased_until or leased_until <= tonumber(ARGV[2])) then
+        redis.call('ZADD', KEYS[1], ARGV[3], id)
+        redis.call('HSET', ARGV[1] .. 'outbox:' .. id, 'leased_until', ARGV[3])
+        claimed[#claimed + 1] = id
+    end
+end
+return claimed
+"""
+
+# KEYS: outbox:<id>, outbox:due. ARGV: attempts, next_attempt_at, last_error, id
+_OUTBOX_RETRY = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'pending' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'attempts', ARGV[1], 'last_error', ARGV[3])
+redis.call('HDEL', KEYS[1], 'leased_until')
+redis.call('ZADD', KEYS[2], 'XX', ARGV[2], ARGV[4])
+return 1
+"""
+
+# KEYS: outbox:due. ARGV: prefix, status, now, retention seconds, ids...
+_OUTBOX_FINISH = """
+for i = 5, #ARGV do
+    local key = ARGV[1] .. 'outbox:' .. ARGV[i]
+    if redis.call('HGET', key, 'status') == 'pending' then
+        local fields = redis.call('HMGET', key, 'chat_id', 'group_id', 'kind')
+        redis.call('HSET', key, 'status', ARGV[2], 'finished_at', ARGV[3])
+        redis.call('EXPIRE', key, ARGV[4])
+        redis.call('ZREM', KEYS[1], ARGV[i])
+        redis.call('SREM', ARGV[1] .. 'outbox:chat:' .. fields[1], ARGV[i])
+        redis.call('SREM', ARGV[1] .. 'outbox:group:' .. fields[2] .. ':' .. fields[3], ARGV[i])
+    end
+end
+"""
+
+# KEYS: santa set. ARGV: prefix, user_id
+_ASSIGNMENTS_FOR_USER = """
+local rows = {}
+for _, group_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local target = redis.call('HGET', ARGV[1] .. 'assignments:' .. group_id, ARGV[2])
+    local game = ARGV[1] .. 'game:' .. group_id
+    if target and redis.call('EXISTS', game) == 1 then
+        local name = redis.call('HGET', ARGV[1] .. 'members:' .. group_id, target)
+        if name then
+            rows[#rows + 1] = {group_id, name, redis.call('HGET', game, 'exchange_date') or ''}
+        end
+    end
+end
+return rows
+"""
+
+
+class RedisBackend:
+    # Other workers write the same keys, so a per-process cache would go stale
+    cacheable = False
+
+    def __init__(self, url, prefix='santa:'):
+        self.url = url
+        self.prefix = prefix
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self._ensure_game = self.redis.register_script(_ENSURE_GAME)
+        self._transition = self.redis.register_script(_TRANSITION)
+        self._update_status = self.redis.register_script(_UPDATE_STATUS)
+        self._add_participant = self.redis.register_script(_ADD_PARTICIPANT)
+        self._add_participants = self.redis.register_script(_ADD_PARTICIPANTS)
+        self._complete_draw = self.redis.register_script(_COMPLETE_DRAW)
+        self._start_draw_job = self.redis.register_script(_START_DRAW_JOB)
+        self._save_draw_job = self.redis.register_script(_SAVE_DRAW_JOB)
+        self._queue_draw_dms = self.redis.register_script(_QUEUE_DRAW_DMS)
+        self._claim_draw_jobs = self.redis.register_script(_CLAIM_DRAW_JOBS)
+        self._abort_draw_job = self.redis.register_script(_ABORT_DRAW_JOB)
+        self._cancel = self.redis.register_script(_CANCEL)
+        self._assignments_for_user = self.redis.register_script(_ASSIGNMENTS_FOR_USER)
+        self._update_exchange_date = self.redis.register_script(_UPDATE_EXCHANGE_DATE)
+        self._outbox_enqueue = self.redis.register_script(_OUTBOX_ENQUEUE)
+        self._outbox_claim = self.redis.register_script(_OUTBOX_CLAIM)
+        self._outbox_claim_chat = self.redis.register_script(_OUTBOX_CLAIM_CHAT)
+        self._outbox_retry = self.redis.register_script(_OUTBOX_RETRY)
+        self._outbox_finish = self.redis.register_script(_OUTBOX_FINISH)
+
+    def _key(self, kind, id_):
+        return f"{self.prefix}{kind}:{id_}"
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().isoformat()
+
+    def init(self):
+        # Fail at startup rather than on the first update if the server is unreachable
+        self.redis.ping()
+
+    def close(self):
+        self.redis.close()
+
+    def load_group_state(self, group_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hmget(self._key('game', group_id), 'status', 'exchange_date', 'exchange_on')
+        pipe.lrange(self._key('order', group_id), 0, -1)
+        pipe.hgetall(self._key('members', group_id))
+        (status, exchange_date, exchange_on), order, members = pipe.execute()
+        return GroupState(
+            status=status or None,
+            exchange_date=exchange_date or None,
+            exchange_on=datetime.date.fromisoformat(exchange_on) if exchange_on else None,
+            roster=tuple((int(user_id), members[user_id]) for user_id in order if user_id in members),
+        )
+
+    def ensure_game_exists(self, group_id):
+        self._ensure_game(keys=[self._key('game', group_id)], args=[self._now()])
+
+    def update_game_status(self, group_id, status):
+        return bool(self._update_status(keys=[self._key('game', group_id)], args=[status]))
+
+    def add_participant(self, user_id, group_id, username):
+        keys = [self._key('members', group_id), self._key('order', group_id)]
+        return bool(self._add_participant(keys=keys, args=[user_id, username]))
+
+    def add_participants_bulk(self, group_id, members):
+        if not members:
+            return []
+        args = [self._now()]
+        for user_id, username, team in members:
+            args += [user_id, username, '' if team is None else team]
+        keys = [self._key('members', group_id), self._key('order', group_id), self._key('teams', group_id),
+                self._key('game', group_id)]
+        ok, result = self._add_participants(keys=keys, args=args)
+        if not ok:
+            raise GameStateError(f"Cannot add participants to {group_id}: status is {result}")
+        return [int(user_id) for user_id in result]
+
+    def update_assignments_and_status(self, group_id, pairs):
+        args = [self._now(), self.prefix, group_id]
+        for santa_id, target_id in pairs:
+            args += [santa_id, target_id]
+        won, status = self._complete_draw(
+            keys=[self._key('game', group_id), self._key('assignments', group_id)], args=args)
+        if not won:
+            raise GameStateError(f"Cannot complete draw for {group_id}: status is {status or None}")
+
+    def transition_game(self, group_id, event):
+        from_states, to_state = GAME_TRANSITIONS[event]
+        won, status = self._transition(keys=[self._key('game', group_id)], args=[to_state, *from_states])
+        return TransitionResult(bool(won), status or None)
+
+    def start_draw_job(self, group_id, owner, lease_until):
+        won, status = self._start_draw_job(
+            keys=[self._key('game', group_id), self._key('drawjob', group_id), self.prefix + 'drawjobs'],
+            args=[group_id, owner, lease_until])
+        return TransitionResult(bool(won), status or None)
+
+    def save_draw_job(self, group_id, owner, pairs, lease_until):
+        args = [self._now(), self.prefix, group_id, owner, lease_until]
+        for santa_id, target_id in pairs:
+            args += [santa_id, target_id]
+        won, status = self._save_draw_job(
+            keys=[self._key('game', group_id), self._key('assignments', group_id),
+                  self._key('drawjob', group_id), self.prefix + 'drawjobs'], args=args)
+        if won == -1:
+            raise GameStateError(f"Draw job for {group_id} is no longer leased by {owner}")
+        if not won:
+            raise GameStateError(f"Cannot complete draw for {group_id}: status is {status or None}")
+
+    def queue_draw_dms(self, group_id, owner, entries):
+        args = [self.prefix, group_id, owner, time.time()]
+        for chat_id, entry_group_id, kind, text, options, attempts, next_attempt_at, last_error, leased_until in entries:
+            args += [chat_id, '' if entry_group_id is None else entry_group_id, kind, text, options or '',
+                     attempts, next_attempt_at, last_error or '', '' if leased_until is None else leased_until]
+        ids = self._queue_draw_dms(
+            keys=[self._key('drawjob', group_id), self.prefix + 'drawjobs', self.prefix + 'outbox:due'], args=args)
+        if ids == -1:
+            raise GameStateError(f"Draw job for {group_id} is no longer assigned to {owner}")
+        return [int(message_id) for message_id in ids]
+
+    def claim_draw_jobs(self, now, owner, lease_until, limit):
+        rows = self._claim_draw_jobs(keys=[self.prefix + 'drawjobs'], args=[self.prefix, now, owner, lease_until, limit])
+        return [DrawJob(int(group_id), phase, int(attempts)) for group_id, phase, attempts in rows]
+
+    def abort_draw_job(self, group_id, owner):
+        self._abort_draw_job(keys=[self._key('drawjob', group_id)], args=[self.prefix, group_id, owner])
+
+    def update_exchange_date(self, group_id, date_text, exchange_on):
+        self._update_exchange_date(
+            keys=[self._key('game', group_id)],
+            args=[self._now(), self.prefix, group_id, date_text or '', exchange_on.isoformat() if exchange_on else ''])
+
+    def get_all_assignments_for_user(self, user_id):
+        rows = self._assignments_for_user(keys=[self._key('santa', user_id)], args=[self.prefix, user_id])
+        return sorted((int(group_id), name, exchange_date or None) for group_id, name, exchange_date in rows)
+
+    def get_draw_history(self, user_id, seasons):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.smembers(self._key('santa', user_id))
+        pipe.smembers(self._key('history', user_id))
+        current, past = pipe.execute()
+        # (group_id, game hash, assignments hash, members hash) for every season the user drew in
+        drawn = [(group_id, self._key('game', group_id), self._key('assignments', group_id),
+                  self._key('members', group_id)) for group_id in current]
+        for entry in past:
+            group_id, _ = entry.split(':')
+            drawn.append((group_id, self._key('season', entry), self._key('assignments', entry),
+                          self._key('members', entry)))
+
+        pipe = self.redis.pipeline(transaction=False)
+        for _, game, assignments, _ in drawn:
+            pipe.hmget(game, 'season', 'exchange_on', 'date_started')
+            pipe.hget(assignments, user_id)
+        replies = pipe.execute()
+        pipe = self.redis.pipeline(transaction=False)
+        for (_, _, _, members), target in zip(drawn, replies[1::2]):
+            pipe.hget(members, target or '')
+        names = pipe.execute()
+
+        per_group = {}
+        for (group_id, *_), (season, exchange_on, date_started), name in zip(drawn, replies[0::2], names):
+            if name and season:
+                year = exchange_on or date_started
+                per_group.setdefault(int(group_id), []).append((int(season), int(year[:4]) if year else None, name))
+        rows = []
+        for group_id in sorted(per_group):
+            for season, year, name in sorted(per_group[group_id], reverse=True)[:seasons]:
+                rows.append((group_id, season, year, name))
+        return rows
+
+    def _cancel_game(self, group_id, full):
+        keys = [self._key('game', group_id), self._key('assignments', group_id),
+                self._key('members', group_id), self._key('order', group_id), self._key('teams', group_id)]
+        return bool(self._cancel(keys=keys, args=[self._now(), self.prefix, group_id, '1' if full else '0']))
+
+    def cancel_game(self, group_id):
+        self._cancel_game(group_id, full=False)
+
+    def cancel_game_full(self, group_id):
+        return self._cancel_game(group_id, full=True)
+
+    def games_on_dates(self, dates):
+        dates = list(dates)
+        pipe = self.redis.pipeline(transaction=False)
+        for day in dates:
+            pipe.smembers(self._key('date', day.isoformat()))
+        games = [(int(group_id), day) for day, members in zip(dates, pipe.execute()) for group_id in members]
+        pipe = self.redis.pipeline(transaction=False)
+        for group_id, _ in games:
+            pipe.hget(self._key('game', group_id), 'status')
+        return [(group_id, day, status) for (group_id, day), status in zip(games, pipe.execute())]
+
+    def get_assignments(self, group_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hgetall(self._key('assignments', group_id))
+        pipe.hgetall(self._key('members', group_id))
+        assignments, members = pipe.execute()
+        return [(int(santa_id), int(target_id), members[target_id])
+                for santa_id, target_id in assignments.items() if target_id in members]
+
+    def get_draw_rules(self, group_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hget(self._key('game', group_id), 'season')
+        pipe.hgetall(self._key('teams', group_id))
+        season, teams = pipe.execute()
+        # Past seasons are only kept once drawn, so the one before the active season has pairs
+        previous = self.redis.hgetall(self._key('assignments', f"{group_id}:{int(season) - 1}")) if season else {}
+        return DrawRules([(int(santa_id), int(target_id)) for santa_id, target_id in previous.items()],
+                         {int(user_id): team for user_id, team in teams.items()})
+
+    def get_assignments_for_groups(self, group_ids):
+        group_ids = list(group_ids)
+        pipe = self.redis.pipeline(transaction=False)
+        for group_id in group_ids:
+            pipe.hgetall(self._key('assignments', group_id))
+            pipe.hgetall(self._key('members', group_id))
+        replies = pipe.execute()
+        result = {}
+        for group_id, assignments, members in zip(group_ids, replies[::2], replies[1::2]):
+            pairs = [(int(santa_id), int(target_id), members[target_id])
+                     for santa_id, target_id in assignments.items() if target_id in members]
+            if pairs:
+                result[group_id] = pairs
+        return result
+
+    def sent_reminders(self, dates):
+        dates = list(dates)
+        pipe = self.redis.pipeline(transaction=False)
+        for day in dates:
+            pipe.smembers(self._key('reminders', day.isoformat()))
+        sent = set()
+        for day, members in zip(dates, pipe.execute()):
+            for member in members:
+                group_id, days_before, recipient_id = member.split(':')
+                sent.add((int(group_id), day, int(days_before), int(recipient_id)))
+        return sent
+
+    def record_reminders(self, reminders):
+        pipe = self.redis.pipeline(transaction=False)
+        for group_id, day, days_before, recipient_id in reminders:
+            key = self._key('reminders', day.isoformat())
+            pipe.sadd(key, f"{group_id}:{days_before}:{recipient_id}")
+            expires = datetime.datetime.combine(day + datetime.timedelta(days=REMINDER_RETENTION_DAYS), datetime.time())
+            pipe.expireat(key, expires)
+        pipe.execute()
+
+    def prune_reminders(self, before):
+        # Delivery records expire on their own (see record_reminders)
+        pass
+
+    def enqueue_outbox(self, entries):
+        now = time.time()
+        due = self.prefix + 'outbox:due'
+        pipe = self.redis.pipeline(transaction=False)
+        for chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error, leased_until in entries:
+            self._outbox_enqueue(keys=[due], client=pipe, args=[
+                self.prefix, chat_id, '' if group_id is None else group_id, kind, text, options or '',
+                attempts, next_attempt_at, last_error or '', '' if leased_until is None else leased_until, now])
+        pipe.execute()
+
+    def _load_outbox(self, ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for message_id in ids:
+            pipe.hgetall(self._key('outbox', message_id))
+        messages = []
+        for message_id, row in zip(ids, pipe.execute()):
+            if row.get('status') != 'pending':
+                continue    # Finished since it was claimed
+            messages.append(OutboxMessage(
+                int(message_id), int(row['chat_id']), int(row['group_id']) if row['group_id'] else None,
+                row['kind'], row['text'], row['options'] or None, int(row['attempts']), float(row['created_at'])))
+        return messages
+
+    def claim_outbox(self, now, lease_until, limit):
+        ids = self._outbox_claim(keys=[self.prefix + 'outbox:due'], args=[self.prefix, now, lease_until, limit])
+        return self._load_outbox(ids)
+
+    def claim_outbox_for_chat(self, chat_id, now, lease_until):
+        ids = self._outbox_claim_chat(keys=[self.prefix + 'outbox:due', self._key('outbox:chat', chat_id)],
+                                      args=[self.prefix, now, lease_until])
+        return self._load_outbox(sorted(ids, key=int))
+
+    def retry_outbox(self, retries):
+        # One round trip for the whole batch; each script still checks its message is pending
+        pipe = self.redis.pipeline(transaction=False)
+        for message_id, attempts, next_attempt_at, error in retries:
+            self._outbox_retry(keys=[self._key('outbox', message_id), self.prefix + 'outbox:due'],
+                               args=[attempts, next_attempt_at, error or '', message_id], client=pipe)
+        pipe.execute()
+
+    def finish_outbox(self, message_ids, status):
+        if message_ids:
+            self._outbox_finish(keys=[self.prefix + 'outbox:due'],
+                                args=[self.prefix, status, time.time(), OUTBOX_RETENTION_SECONDS, *message_ids])
+
+    def supersede_outbox(self, group_id, kind):
+        self.finish_outbox(list(self.redis.smembers(self._key('outbox:group', f"{group_id}:{kind}"))), 'superseded')
+
+    def prune_outbox(self, before):
+        # Finished messages expire on their own (see finish_outbox)
+        pass
+
+    def get_roster_message_id(self, group_id):
+        message_id = self.redis.hget(self._key('game', group_id), 'roster_message_id')
+        return int(message_id) if message_id else None
+
+    def set_roster_message_id(self, group_id, message_id):
+        game = self._key('game', group_id)
+        pipe = self.redis.pipeline(transaction=True)
+        self._ensure_game(keys=[game], args=[self._now()], client=pipe)
+        if message_id is None:
+            pipe.hdel(game, 'roster_message_id')
+        else:
+            pipe.hset(game, 'roster_message_id', message_id)
+        pipe.execute()
@@ -0,0 +1,114 @@
+"""Countdown reminders a week before, the day before and on the exchange day.
+
+A job runs every CHECK_INTERVAL_SECONDS. From SEND_HOUR (server local time) it finds the
+games whose exchange date is REMINDER_DAYS away with one indexed query, and sends the
+group a countdown and, once names are drawn, each santa a reminder of who they're buying
+for. Every group gets a fixed slot within SPREAD_SECONDS after SEND_HOUR, so thousands of
+groups don't all fire at once; messages go out in batches through fanout's rate limiter.
+
+Each delivered reminder is recorded, so a restart neither repeats nor skips one: the next
+run sends whatever is due and not yet recorded.
+"""
+import datetime
+import logging
+from typing import NamedTuple
+
+import async_db as db
+import database
+import dates
+import fanout
+from storage import normalize_status
+
+REMINDER_DAYS = (7, 1, 0)
+SEND_HOUR = 9
+SPREAD_SECONDS = 2 * 60 * 60
+CHECK_INTERVAL_SECONDS = 5 * 60
+# Recorded after each batch, so a crash repeats at most one batch
+BATCH_SIZE = fanout.MESSAGES_PER_SECOND
+MAX_PER_RUN = 3000
+KEEP_RECORDS_DAYS = 30
+
+
+class Reminder(NamedTuple):
+    group_id: int
+    exchange_on: datetime.date
+    days_before: int
+    recipient_id: int
+    text: str
+
+
+def slot_offset(group_id):
+    """Seconds after SEND_HOUR at which the group's reminders become due (stable per group)."""
+    return (group_id * 2654435761) % SPREAD_SECONDS
+
+
+def group_reminder_text(days_before, exchange_on):
+    day = dates.format_exchange_date(exchange_on)
+    if days_before == 0:
+        return "It's gift exchange day! 🎁\n\nHave fun, and don't forget your gift!"
+    if days_before == 1:
+        return f"The gift exchange is tomorrow ({day})! Make sure your gift is ready."
+    return f"{days_before} days to go until the gift exchange on {day}. Time to start shopping!"
+
+
+def santa_reminder_text(days_before, exchange_on, target_name):
+    if days_before == 0:
+        return f"Today's the gift exchange! Bring your gift for @{target_name}."
+    when = "tomorrow" if days_before == 1 else f"in {days_before} days"
+    return (f"Reminder: the gift exchange is {when} ({dates.format_exchange_date(exchange_on)}).\n\n"
+            f"You are @{target_name}'s secret santa!")
+
+
+def due_reminders(now):
+    """Returns the reminders due at `now` that haven't been delivered yet."""
+    today = now.date()
+    window_start = datetime.datetime.combine(today, datetime.time(SEND_HOUR))
+    if now < window_start:
+        return []
+    days_before = {today + datetime.timedelta(days=days): days for days in REMINDER_DAYS}
+    games = database.games_on_dates(list(days_before))
+    if not games:
+        return []
+    games = [(group_id, exchange_on, status) for group_id, exchange_on, status in games
+             if now >= window_start + datetime.timedelta(seconds=slot_offset(group_id))]
+    if not games:
+        return []
+    sent = database.sent_reminders(list(days_before))
+    # Every drawn group's assignments in one query, not one per group
+    assignments = database.get_assignments_for_groups(
+        [group_id for group_id, _, status in games if normalize_status(status) == 'COMPLETED'])
+
+    due = []
+    for group_id, exchange_on, status in games:
+        days = days_before[exchange_on]
+        if (group_id, exchange_on, days, group_id) not in sent:
+            due.append(Reminder(group_id, exchange_on, days, group_id, group_reminder_text(days, exchange_on)))
+        if normalize_status(status) == 'COMPLETED':
+            for santa_id, _, target_name in assignments.get(group_id, ()):
+                if (group_id, exchange_on, days, santa_id) not in sent:
+                    due.append(Reminder(group_id, exchange_on, days, santa_id,
+                                        santa_reminder_text(days, exchange_on, target_name)))
+    return due
+
+
+async def send_due_reminders(context):
+    """Job callback: sends due reminders in batches, recording each batch as it completes."""
+    now = datetime.datetime.now()
+    due = (await db.run_read(due_reminders, now))[:MAX_PER_RUN]
+    delivered = 0
+    for start in range(0, len(due), BATCH_SIZE):
+        batch = due[start:start + BATCH_SIZE]
+        results = await fanout.send_dms(context.bot, [(r.recipient_id, r.text) for r in batch])
+        # Permanent failures (blocked bot, left group) are recorded too, so they aren't retried forever
+        done = [r for r, result in zip(batch, results) if result.ok or result.permanent]
+        await db.record_reminders([(r.group_id, r.exchange_on, r.days_before, r.recipient_id) for r in done])
+        delivered += sum(1 for result in results if result.ok)
+    if due:
+        logging.info(f"Reminders: {delivered} of {len(due)} delivered")
+    await db.prune_reminders(now.date() - datetime.timedelta(days=KEEP_RECORDS_DAYS))
+
+
+def schedule(application):
+    """Starts the reminder job on the application's JobQueue."""
+    application.job_queue.run_repeating(send_due_reminders, interval=CHECK_INTERVAL_SECONDS, first=10,
+                                        name='countdown-reminders')
@@ -0,0 +1,182 @@
+"""Moves the SQLite data between shard layouts, offline (stop the bot first).
+
+    python reshard.py 4                    santa.db -> santa.0-of-4.db .. santa.3-of-4.db
+    python reshard.py 8 --from-shards 4    4 shards -> 8 shards
+    python reshard.py 1 --from-shards 4    back to a single santa.db
+
+Start the bot with SQLITE_SHARDS set to the new count afterwards. The source files are
+left as they are; delete them once the bot runs on the new layout.
+
+Every group moves with all its seasons, draw jobs, sent reminders and outbox messages to
+the shard its group_id hashes to (see sharded_backend.py). Game ids and outbox ids are
+assigned afresh in the target files. Each target file is written in one transaction under a
+temporary name, the row counts are checked against the source, and only then do the files
+get their real names; a failed run deletes them.
+"""
+import os
+import sqlite3
+
+import click
+
+import database
+from sharded_backend import shard_index, shard_paths
+from sqlite_backend import SQLiteBackend
+
+# Tables keyed by game_id, copied after their games
+GAME_TABLES = ('participants', 'assignments', 'draw_jobs')
+TABLES = ('games',) + GAME_TABLES + ('reminders_sent', 'outbox')
+STAGED_SUFFIX = '.resharding'
+
+
+def _layout(db_path, shards):
+    return [db_path] if shards == 1 else shard_paths(db_path, shards)
+
+
+def _empty(path):
+    """Whether the database file at `path` holds no rows (or no schema yet)."""
+    conn = sqlite3.connect(path)
+    try:
+        return not any(conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in TABLES)
+    except sqlite3.OperationalError:
+        return True
+    finally:
+        conn.close()
+
+
+def _discard(paths):
+    """Deletes the database files and their WAL and shared-memory files, where they exist."""
+    for path in paths:
+        for name in (path, path + '-wal', path + '-shm', path + '-journal'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def _migrate(path):
+    """Creates or upgrades the schema in `path`."""
+    backend = SQLiteBackend(path, readers=1)
+    backend.init()
+    backend.close()
+
+
+def _columns(conn, table, skip=()):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in skip]
+
+
+def _insert(conn, table, columns, rows):
+    placeholders = ",".join("?" * len(columns))
+    conn.executemany(f"INSERT INTO {table} ({','.join(columns)}) VALUES ({placeholders})", rows)
+
+
+def _counts(conns):
+    return {table: sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for conn in conns)
+            for table in TABLES}
+
+
+def reshard(sources, targets):
+    """Copies every row from the `sources` files into the `targets` files."""
+    count = len(targets)
+    source_conns = [sqlite3.connect(path) for path in sources]
+    target_conns = [sqlite3.connect(path, isolation_level=None) for path in targets]
+    try:
+        for conn in target_conns:
+            conn.execute("BEGIN IMMEDIATE")
+
+        for source in source_conns:
+            # Old game_id -> (target, new game_id)
+            games = {}
+            game_columns = _columns(source, 'games', skip=('game_id',))
+            for game_id, *row in source.execute(f"SELECT game_id, {','.join(game_columns)} FROM games ORDER BY game_id"):
+                group_id = row[game_columns.index('group_id')]
+                target = shard_index(group_id, count)
+                cursor = target_conns[target].execute(
+                    f"INSERT INTO games ({','.join(game_columns)}) VALUES ({','.join('?' * len(game_columns))})", row)
+                games[game_id] = (target, cursor.lastrowid)
+
+            for table in GAME_TABLES:
+                columns = _columns(source, table, skip=('game_id',))
+                by_target = {}
+                for game_id, *row in source.execute(f"SELECT game_id, {','.join(columns)} FROM {table}"):
+                    target, new_game_id = games[game_id]
+                    by_target.setdefault(target, []).append((new_game_id, *row))
+                for target, rows in by_target.items():
+                    _insert(target_conns[target], table, ['game_id'] + columns, rows)
+
+            columns = _columns(source, 'reminders_sent')
+            group_column = columns.index('group_id')
+            by_target = {}
+            for row in source.execute(f"SELECT {','.join(columns)} FROM reminders_sent"):
+                by_target.setdefault(shard_index(row[group_column], count), []).append(row)
+            for target, rows in by_target.items():
+                _insert(target_conns[target], 'reminders_sent', columns, rows)
+
+            # Messages about a group follow the group; the rest follow their chat
+            columns = _columns(source, 'outbox', skip=('id',))
+            chat_column, group_column = columns.index('chat_id'), columns.index('group_id')
+            by_target = {}
+            for row in source.execute(f"SELECT {','.join(columns)} FROM outbox ORDER BY id"):
+                owner = row[chat_column] if row[group_column] is None else row[group_column]
+                by_target.setdefault(shard_index(owner, count), []).append(row)
+            for target, rows in by_target.items():
+                _insert(target_conns[target], 'outbox', columns, rows)
+
+        expected, copied = _counts(source_conns), _counts(target_conns)
+        if expected != copied:
+            raise click.ClickException(f"Row counts don't match, nothing was written: {expected} != {copied}")
+        for conn in target_conns:
+            conn.execute("COMMIT")
+        return [_counts([conn]) for conn in target_conns]
+    except BaseException:
+        for conn in target_conns:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        raise
+    finally:
+        for conn in source_conns + target_conns:
+            conn.close()
+
+
+@click.command()
+@click.argument('shards', type=click.IntRange(min=1))
+@click.option('--db', 'db_path', default=database.DATABASE_NAME, show_default=True,
+              help="SQLite database file; shard files are named after it.")
+@click.option('--from-shards', type=click.IntRange(min=1), default=1, show_default=True,
+              help="How many shards the data is in now.")
+def main(shards, db_path, from_shards):
+    """Splits the database into SHARDS files (or merges it back with SHARDS = 1)."""
+    sources = _layout(db_path, from_shards)
+    targets = _layout(db_path, shards)
+    if set(sources) & set(targets):
+        raise click.ClickException("The data is already in that layout.")
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        raise click.ClickException(f"{missing[0]} does not exist; is --from-shards right?")
+
+    for path in targets:
+        if os.path.exists(path) and not _empty(path):
+            raise click.ClickException(f"{path} already has data; move it away first.")
+
+    for path in sources:
+        _migrate(path)
+    # The targets are built under temporary names and only take their real ones once every
+    # row is in, so a failed run leaves no half-made shard files for the bot to start on
+    staged = [path + STAGED_SUFFIX for path in targets]
+    _discard(staged)
+    try:
+        for path in staged:
+            _migrate(path)
+        all_counts = reshard(sources, staged)
+    except BaseException:
+        _discard(staged)
+        raise
+    _discard(targets)   # Empty leftovers of an earlier run
+    for path, target in zip(staged, targets):
+        os.replace(path, target)
+
+    for path, counts in zip(targets, all_counts):
+        click.echo(f"{path}: {counts['games']} games, {counts['participants']} participants, "
+                   f"{counts['assignments']} assignments, {counts['outbox']} outbox messages")
+    click.echo(f"Done. Start the bot with SQLITE_SHARDS={shards}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""Debounced, in-place roster updates for join storms.
+
+Every join used to post a "has joined" message plus a fresh copy of the whole member
+list, which quickly runs into Telegram's ~20 messages/minute per-group limit. Instead,
+joins are collected for JOIN_WINDOW_SECONDS and then published together as one edit of
+the group's single pinned roster message, which names the people who just joined
+(skipped when its text hasn't changed). A busy group costs at most four edits a minute;
+only the "I couldn't DM you" warning is still a message of its own.
+
+If Telegram answers with RetryAfter, the batch is put back and published again once the
+wait is over, together with whoever joined in the meantime.
+"""
+import asyncio
+import contextlib
+import logging
+
+from cachetools import TTLCache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+import async_db as db
+from fanout import retry_after_seconds
+
+JOIN_WINDOW_SECONDS = 15.0
+# Telegram rejects messages over 4096 characters; leave room for the header and footer
+MAX_ROSTER_CHARS = 3500
+ANNOUNCE_NAMES = 3
+# Roster message ids and last texts are kept this long for this many groups; a group that
+# drops out just reads its message id from the database again
+MAX_GROUPS = 10000
+REMEMBER_SECONDS = 60 * 60
+
+
+def roster_markup(count):
+    """Join button, plus the Draw button once there are enough people."""
+    if count >= 2:
+        keyboard = [
+            [InlineKeyboardButton("Join!", callback_data='join_game')],
+            [InlineKeyboardButton("Draw", callback_data='go_draw')]
+        ]
+    else:
+        keyboard = [[InlineKeyboardButton("Join!", callback_data='join_game')]]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def roster_text(participants, joined=()):
+    """The "Secret Santa Members" message body, truncated to fit in one Telegram message.
+
+    `joined`: mentions of the people who joined since the last update, announced at the end.
+    """
+    count = len(participants)
+    lines = []
+    length = 0
+    for _, name in participants:
+        line = f"• @{name}"
+        if length + len(line) + 1 > MAX_ROSTER_CHARS:
+            lines.append(f"...and {count - len(lines)} more")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    names_list = "\n".join(lines)
+    group_status_text = 'Is everyone in? Hit Draw!' if count >= 2 else 'Waiting for more people to join...'
+    announcement = f"{join_announcement(joined)}\n" if joined else ""
+    return (f"Secret Santa Members\n\n"
+            f"Total: {count}\n"
+            f"{names_list}\n\n"
+            f"{announcement}"
+            f"{group_status_text}")
+
+
+def join_announcement(mentions, verb="joined the Secret Santa!"):
+    """'@a, @b and 12 others joined...' for a batch of mentions."""
+    if len(mentions) == 1:
+        return f"{mentions[0]} has {verb}"
+    if len(mentions) <= ANNOUNCE_NAMES + 1:
+        return f"{', '.join(mentions[:-1])} and {mentions[-1]} {verb}"
+    shown = ", ".join(mentions[:ANNOUNCE_NAMES])
+    return f"{shown} and {len(mentions) - ANNOUNCE_NAMES} others {verb}"
+
+
+class _PendingJoins:
+    def __init__(self):
+        self.joined = []
+        self.dm_failed = []
+
+    def merge(self, newer):
+        self.joined.extend(newer.joined)
+        self.dm_failed.extend(newer.dm_failed)
+
+
+class RosterPublisher:
+    """Per-group debouncer that owns each group's pinned roster message."""
+
+    def __init__(self, window=JOIN_WINDOW_SECONDS):
+        self.window = window
+        self._pending = {}
+        self._tasks = {}
+        # group_id -> (lock, how many hold or wait for it); dropped when that reaches 0
+        self._locks = {}
+        self._message_ids = TTLCache(maxsize=MAX_GROUPS, ttl=REMEMBER_SECONDS)
+        self._candidates = {}
+        self._last_text = TTLCache(maxsize=MAX_GROUPS, ttl=REMEMBER_SECONDS)
+
+    def note_join(self, bot, group_id, mention, dm_failed=False, message_id=None):
+        """Queues a join for the group's next batched update.
+
+        `message_id` is the inline message the user clicked, if any; it is adopted as the
+        roster message when the group doesn't have one yet.
+        """
+        pending = self._pending.setdefault(group_id, _PendingJoins())
+        pending.joined.append(mention)
+        if dm_failed:
+            pending.dm_failed.append(mention)
+        if message_id is not None:
+            self._candidates.setdefault(group_id, message_id)
+        if group_id not in self._tasks:
+            self._tasks[group_id] = asyncio.create_task(self._publish_later(bot, group_id, self.window))
+
+    def forget(self, group_id):
+        """Drops what we know about the group's roster message (e.g. after a full reset)."""
+        self._message_ids.pop(group_id, None)
+        self._candidates.pop(group_id, None)
+        self._last_text.pop(group_id, None)
+
+    async def _publish_later(self, bot, group_id, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            if self._tasks.get(group_id) is asyncio.current_task():
+                del self._tasks[group_id]
+        await self.publish(bot, group_id)
+
+    def _retry_later(self, bot, group_id, pending, delay):
+        """Puts a batch that hit flood control back, ahead of any newer joins, and
+        publishes it again after `delay` seconds."""
+        newer = self._pending.get(group_id)
+        if newer is not None:
+            pending.merge(newer)
+        self._pending[group_id] = pending
+        task = self._tasks.get(group_id)
+        if task is not None:
+            task.cancel()
+        self._tasks[group_id] = asyncio.create_task(self._publish_later(bot, group_id, delay))
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, group_id):
+        """Holds the group's lock, which only exists while someone holds or waits for it."""
+        lock, users = self._locks.get(group_id) or (asyncio.Lock(), 0)
+        self._locks[group_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[group_id]
+            if users == 1:
+                del self._locks[group_id]
+            else:
+                self._locks[group_id] = (lock, users - 1)
+
+    async def publish(self, bot, group_id):
+        """Publishes any pending joins for the group now."""
+        async with self._locked(group_id):
+            pending = self._pending.pop(group_id, None)
+            if pending is None:
+                return
+            try:
+                if pending.dm_failed:
+                    await self._warn_dm_failed(bot, group_id, pending.dm_failed)
+                    pending.dm_failed = []
+                await self._update_roster_message(bot, group_id, pending.joined)
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logging.info(f"Roster update for {group_id} hit flood control; retrying in {delay:.0f}s")
+                self._retry_later(bot, group_id, pending, delay)
+
+    @staticmethod
+    async def _warn_dm_failed(bot, group_id, mentions):
+        try:
+            await bot.send_message(
+                chat_id=group_id,
+                text=f"{', '.join(mentions)}: I couldn't DM you! Please start a private chat "
+                     f"with me first (by searching for me or clicking my name).",
+            )
+        except RetryAfter:
+            raise
+        except Exception as e:
+            logging.warning(f"Failed to warn {group_id} about DM failures: {e}")
+
+    async def refresh(self, bot, group_id):
+        """Brings the group's roster message up to date without announcing anyone (e.g. after a bulk import)."""
+        async with self._locked(group_id):
+            try:
+                await self._update_roster_message(bot, group_id)
+            except RetryAfter as e:
+                # An empty batch still brings the roster up to date when it's published
+                self._retry_later(bot, group_id, self._pending.pop(group_id, None) or _PendingJoins(),
+                                  retry_after_seconds(e))
+
+    async def flush_all(self, bot):
+        """Publishes every pending batch immediately (used on shutdown)."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        for group_id in list(self._pending):
+            await self.publish(bot, group_id)
+
+    async def _update_roster_message(self, bot, group_id, joined=()):
+        """Edits (or posts) the roster message. Raises RetryAfter so the caller can retry."""
+        participants = await db.get_participants_data(group_id)
+        text = roster_text(participants, joined)
+        markup = roster_markup(len(participants))
+
+        if group_id not in self._message_ids:
+            self._message_ids[group_id] = await db.get_roster_message_id(group_id)
+        message_id = self._message_ids[group_id]
+        candidate = self._candidates.pop(group_id, None)
+        if message_id is None and candidate is not None:
+            # Turn the message people are clicking Join on into the roster
+            message_id = await self._remember(bot, group_id, candidate)
+
+        if message_id is not None:
+            if self._last_text.get(group_id) == text:
+                return
+            try:
+                await bot.edit_message_text(chat_id=group_id, message_id=message_id, text=text, reply_markup=markup)
+                self._last_text[group_id] = text
+                return
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    self._last_text[group_id] = text
+                    return
+                # The message was deleted or is too old to edit; post a new one below
+                logging.info(f"Could not edit roster message {message_id} in {group_id}, posting a new one: {e}")
+            except RetryAfter:
+                raise
+            except Exception as e:
+                logging.warning(f"Could not edit roster message {message_id} in {group_id}: {e}")
+                return
+
+        try:
+            message = await bot.send_message(chat_id=group_id, text=text, reply_markup=markup)
+        except RetryAfter:
+            raise
+        except Exception as e:
+            logging.warning(f"Could not send roster message to {group_id}: {e}")
+            return
+        self._last_text[group_id] = text
+        await self._remember(bot, group_id, message.message_id)
+
+    async def _remember(self, bot, group_id, message_id):
+        self._message_ids[group_id] = message_id
+        await db.set_roster_message_id(group_id, message_id)
+        try:
+            await bot.pin_chat_message(chat_id=group_id, message_id=message_id, disable_notification=True)
+        except Exception as e:
+            # Pinning needs admin rights; the roster still works unpinned
+            logging.debug(f"Could not pin roster message in {group_id}: {e}")
+        return message_id
+
+
+publisher = RosterPublisher()
@@ -0,0 +1,538 @@
+"""Operator CLI for the bot's SQLite database (replaces inspect_db.py, list_games.py and inspect_schema.py).
+
+    python santactl.py games --status completed --format csv > games.csv
+    python santactl.py participants --group -1001234567890
+    python santactl.py assignments --group -1001234567890 --all-seasons
+    python santactl.py assignments --exchange-from 2026-12-01 --format columnar -o assignments.jsonl
+    python santactl.py show -1001234567890
+    python santactl.py archived -1001234567890 --table assignments
+    python santactl.py stats
+    python santactl.py schema
+
+The database is opened read-only through a URI (mode=ro, query_only), so it is safe to run
+against the live database: it never takes a write lock, and in WAL mode the bot's writes
+carry on while an export runs. Rows are streamed from the cursor to the output, so memory
+use doesn't grow with the table.
+
+Each group plays one season at a time; cancelling a drawn game keeps it as a past season.
+The export and stats commands look at active seasons only unless given --season N or
+--all-seasons. Seasons moved to cold storage (see archive.py) are no longer in the database;
+`archived` exports them from the archive instead.
+
+A sharded database (see sharded_backend.py) is opened as a whole: with --shards N, with
+SQLITE_SHARDS set, or when only shard files (santa.0-of-4.db ...) sit next to --db. Each
+table is then a view over all shards, with game and outbox ids made unique the way the
+sharded backend does (local id * shard count + shard).
+
+Output formats:
+    jsonl     one JSON object per row (default)
+    csv       a header row, then one row per line
+    columnar  JSON lines of column chunks, {"rows": n, "columns": {"group_id": [...], ...}},
+              CHUNK_ROWS rows at a time; cheap to load into dataframe/columnar tools
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+import urllib.parse
+
+import click
+
+import archive
+import database
+from sharded_backend import shard_counts, shard_paths
+
+CHUNK_ROWS = 10000
+STATUSES = ('JOINING', 'DRAWING', 'COMPLETED')
+ROSTER_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 500, 1000)
+
+
+# Columns holding shard-local ids, per table
+SHARD_LOCAL_IDS = {'games': 'game_id', 'participants': 'game_id', 'assignments': 'game_id',
+                   'draw_jobs': 'game_id', 'outbox': 'id'}
+
+
+def _read_only_uri(path):
+    if not os.path.exists(path):
+        raise click.ClickException(f"No database at {path}")
+    return f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro"
+
+
+def _lock_down(conn):
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def connect_read_only(path):
+    """Opens the database read-only; fails instead of creating a new file if `path` doesn't exist."""
+    return _lock_down(sqlite3.connect(_read_only_uri(path), uri=True, isolation_level=None))
+
+
+def connect_shards(paths):
+    """Opens the shard files read-only as one database: a TEMP view per table over every shard."""
+    conn = sqlite3.connect(_read_only_uri(paths[0]), uri=True, isolation_level=None)
+    schemas = ['main']
+    for index, path in enumerate(paths[1:], start=1):
+        conn.execute(f"ATTACH DATABASE ? AS shard{index}", (_read_only_uri(path),))
+        schemas.append(f"shard{index}")
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+        selects = []
+        for index, schema in enumerate(schemas):
+            select = [f"{column} * {len(paths)} + {index} AS {column}" if column == SHARD_LOCAL_IDS.get(table)
+                      else column for column in columns]
+            selects.append(f"SELECT {', '.join(select)} FROM {schema}.{table}")
+        conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+    return _lock_down(conn)
+
+
+def database_files(db_path, shards):
+    """The files holding the data: `db_path`, or its shard files if the data is sharded."""
+    if shards is None:
+        shards = database.SQLITE_SHARDS
+        if shards == 1 and not os.path.exists(db_path):
+            counts = shard_counts(db_path)
+            if len(counts) > 1:
+                raise click.ClickException(f"There are shard files for {', '.join(map(str, counts))} shards "
+                                           f"next to {db_path}; pick the layout with --shards")
+            if counts:
+                shards = counts[0]
+    return [db_path] if shards == 1 else shard_paths(db_path, shards)
+
+
+def has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+# --- Output ---
+
+class JSONLWriter:
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+
+    def write(self, row):
+        self.out.write(json.dumps(dict(zip(self.columns, row))) + "\n")
+
+    def close(self):
+        pass
+
+
+class CSVWriter:
+    def __init__(self, out, columns):
+        self.writer = csv.writer(out)
+        self.writer.writerow(columns)
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        pass
+
+
+class ColumnarWriter:
+    """Buffers up to CHUNK_ROWS rows and writes them out column by column."""
+
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+        self._chunk = [[] for _ in columns]
+        self._rows = 0
+
+    def write(self, row):
+        for values, value in zip(self._chunk, row):
+            values.append(value)
+        self._rows += 1
+        if self._rows >= CHUNK_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self.out.write(json.dumps({'rows': self._rows, 'columns': dict(zip(self.columns, self._chunk))}) + "\n")
+            self._chunk = [[] for _ in self.columns]
+            self._rows = 0
+
+    def close(self):
+        self._flush()
+
+
+WRITERS = {'jsonl': JSONLWriter, 'csv': CSVWriter, 'columnar': ColumnarWriter}
+
+
+def export(cursor, out, fmt):
+    """Streams every row of an executed cursor to `out`. Returns the row count."""
+    return export_rows(cursor, [d[0] for d in cursor.description], out, fmt)
+
+
+def export_rows(rows, columns, out, fmt):
+    """Streams rows (tuples in `columns` order) to `out`. Returns the row count."""
+    writer = WRITERS[fmt](out, columns)
+    count = 0
+    for row in rows:
+        writer.write(row)
+        count += 1
+    writer.close()
+    return count
+
+
+# --- Filters ---
+
+def game_filter(groups, statuses, started_from, started_to, exchange_from, exchange_to,
+                season=None, all_seasons=False, alias='g'):
+    """SQL conditions on the games table (as `alias`) and their parameters."""
+    where, params = [], []
+    if season is not None:
+        where.append(f"{alias}.season = ?")
+        params.append(season)
+    elif not all_seasons:
+        where.append(f"{alias}.active = 1")
+    if groups:
+        where.append(f"{alias}.group_id IN ({','.join('?' * len(groups))})")
+        params += groups
+    if statuses:
+        where.append(f"COALESCE(UPPER(TRIM({alias}.status)), '') IN ({','.join('?' * len(statuses))})")
+        params += [s.upper() for s in statuses]
+    # date_started is an ISO timestamp; compare by its date part
+    if started_from:
+        where.append(f"substr({alias}.date_started, 1, 10) >= ?")
+        params.append(started_from.date().isoformat())
+    if started_to:
+        where.append(f"substr({alias}.date_started, 1, 10) <= ?")
+        params.append(started_to.date().isoformat())
+    if exchange_from:
+        where.append(f"{alias}.exchange_on >= ?")
+        params.append(exchange_from.date().isoformat())
+    if exchange_to:
+        where.append(f"{alias}.exchange_on <= ?")
+        params.append(exchange_to.date().isoformat())
+    return where, params
+
+
+def filter_options(func):
+    """The game filters shared by the export and stats commands."""
+    date = click.DateTime(formats=['%Y-%m-%d'])
+    options = [
+        click.option('--group', 'groups', type=int, multiple=True, help="Only this group (repeatable)."),
+        click.option('--status', 'statuses', type=click.Choice(STATUSES, case_sensitive=False), multiple=True,
+                     help="Only games in this status (repeatable)."),
+        click.option('--started-from', type=date, help="Games started on or after this day (YYYY-MM-DD)."),
+        click.option('--started-to', type=date, help="Games started on or before this day."),
+        click.option('--exchange-from', type=date, help="Exchange date on or after this day."),
+        click.option('--exchange-to', type=date, help="Exchange date on or before this day."),
+        click.option('--season', type=int, help="Only this season of each group (1 is the first)."),
+        click.option('--all-seasons', is_flag=True, help="Past seasons too, not just the active one."),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def output_options(func):
+    func = click.option('--format', 'fmt', type=click.Choice(sorted(WRITERS)), default='jsonl', show_default=True)(func)
+    func = click.option('-o', '--output', type=click.File('w'), default='-', help="Output file (default: stdout).")(func)
+    return func
+
+
+def _filters(kwargs):
+    return game_filter(kwargs['groups'], kwargs['statuses'], kwargs['started_from'], kwargs['started_to'],
+                       kwargs['exchange_from'], kwargs['exchange_to'], kwargs['season'], kwargs['all_seasons'])
+
+
+def _where(conditions):
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+
+# --- Commands ---
+
+@click.group()
+@click.option('--db', 'db_path', default=database.DATABASE_NAME, show_default=True, help="SQLite database file.")
+@click.option('--shards', type=click.IntRange(min=1),
+              help="How many shards the data is in (default: SQLITE_SHARDS, or what's found next to --db).")
+@click.pass_context
+def cli(ctx, db_path, shards):
+    """Read-only inspection and export of the Secret Santa database."""
+    paths = database_files(db_path, shards)
+    ctx.obj = connect_shards(paths) if len(paths) > 1 else connect_read_only(paths[0])
+    ctx.call_on_close(ctx.obj.close)
+    ctx.meta['archive_dir'] = os.getenv('ARCHIVE_DIR') or archive.default_dir(db_path)
+
+
+def open_archive_index():
+    """The archive's index, read-only, or None if nothing was archived."""
+    path = archive.index_path(click.get_current_context().meta['archive_dir'])
+    return connect_read_only(path) if os.path.exists(path) else None
+
+
+@cli.command()
+@filter_options
+@output_options
+@click.pass_obj
+def games(conn, fmt, output, **filters):
+    """Exports games."""
+    conditions, params = _filters(filters)
+    columns = ("g.game_id, g.group_id, g.season, g.active, g.status, g.date_started, g.ended_at, "
+               "g.exchange_date, g.exchange_on, g.roster_message_id")
+    cursor = conn.execute(f"SELECT {columns} FROM games g {_where(conditions)} ORDER BY g.group_id, g.season",
+                          params)
+    count = export(cursor, output, fmt)
+    click.echo(f"{count} games", err=True)
+
+
+@cli.command()
+@filter_options
+@output_options
+@click.pass_obj
+def participants(conn, fmt, output, **filters):
+    """Exports participants of the matching games, in join order."""
+    conditions, params = _filters(filters)
+    cursor = conn.execute(
+        f"SELECT g.group_id, g.season, p.user_id, p.username, p.first_name "
+        f"FROM games g JOIN participants p ON p.game_id = g.game_id {_where(conditions)} "
+        f"ORDER BY g.group_id, g.season, p.seq", params)
+    count = export(cursor, output, fmt)
+    click.echo(f"{count} participants", err=True)
+
+
+@cli.command()
+@filter_options
+@output_options
+@click.pass_obj
+def assignments(conn, fmt, output, **filters):
+    """Exports draw results (santa -> target, with usernames) of the matching games."""
+    conditions, params = _filters(filters)
+    cursor = conn.execute(f"""
+        SELECT g.group_id, g.season, a.santa_id, s.username AS santa_username,
+               a.target_id, t.username AS target_username
+        FROM games g
+        JOIN assignments a ON a.game_id = g.game_id
+        LEFT JOIN participants s ON s.game_id = a.game_id AND s.user_id = a.santa_id
+        LEFT JOIN participants t ON t.game_id = a.game_id AND t.user_id = a.target_id
+        {_where(conditions)}
+        ORDER BY g.group_id, g.season
+    """, params)
+    count = export(cursor, output, fmt)
+    click.echo(f"{count} assignments", err=True)
+
+
+@cli.command(context_settings={'ignore_unknown_options': True})
+@click.argument('group_id', type=int)
+@click.pass_obj
+def show(conn, group_id):
+    """Prints one group's game, participants and assignments, and lists its past seasons."""
+    game = conn.execute("SELECT game_id, season, status, date_started, exchange_date, exchange_on FROM games "
+                        "WHERE group_id = ? AND active = 1", (group_id,)).fetchone()
+    if game is None:
+        raise click.ClickException(f"No game for group {group_id}")
+    game_id, season, status, date_started, exchange_date, exchange_on = game
+    click.echo(f"Group {group_id}, season {season}: {status}, started {date_started}")
+    click.echo(f"Exchange: {exchange_date or '-'} (parsed: {exchange_on or '-'})")
+
+    names = {}
+    click.echo("\nParticipants:")
+    for user_id, username in conn.execute(
+            "SELECT user_id, username FROM participants WHERE game_id = ? ORDER BY seq", (game_id,)):
+        names[user_id] = username
+        click.echo(f"  {user_id}  @{username}")
+    click.echo(f"  ({len(names)} total)")
+
+    click.echo("\nAssignments:")
+    count = 0
+    for santa_id, target_id in conn.execute("SELECT santa_id, target_id FROM assignments WHERE game_id = ?", (game_id,)):
+        click.echo(f"  @{names.get(santa_id, santa_id)} -> @{names.get(target_id, target_id)}")
+        count += 1
+    if not count:
+        click.echo("  (no draw yet)")
+
+    past = conn.execute(
+        "SELECT g.season, g.date_started, g.ended_at, g.exchange_date, "
+        "(SELECT COUNT(*) FROM participants p WHERE p.game_id = g.game_id) "
+        "FROM games g WHERE g.group_id = ? AND g.active = 0 AND g.status != 'ARCHIVED' ORDER BY g.season DESC", (group_id,)).fetchall()
+    if past:
+        click.echo("\nPast seasons (export them with --season N or --all-seasons):")
+        for season, started, ended, exchange_date, size in past:
+            click.echo(f"  {season}: {started or '-'} to {ended or '-'}, exchange {exchange_date or '-'}, "
+                       f"{size} participants")
+
+    index = open_archive_index()
+    if index is not None:
+        try:
+            archived_seasons = index.execute("SELECT season, ended_at, participants FROM games WHERE group_id = ? "
+                                             "ORDER BY season DESC", (group_id,)).fetchall()
+        finally:
+            index.close()
+        if archived_seasons:
+            click.echo(f"\nArchived seasons (export them with `archived {group_id}`):")
+            for season, ended, size in archived_seasons:
+                click.echo(f"  {season}: ended {ended or '-'}, {size} participants")
+
+
+ARCHIVED_COLUMNS = {
+    'games': ('group_id', 'season', 'status', 'date_started', 'ended_at', 'exchange_date', 'exchange_on'),
+    'participants': ('group_id', 'season', 'user_id', 'username', 'first_name'),
+    'assignments': ('group_id', 'season', 'santa_id', 'santa_username', 'target_id', 'target_username'),
+}
+
+
+def archived_rows(directory, locations, table):
+    """Reads each archived game and flattens it into `table`'s rows, like the live exports."""
+    for segment, position, length in locations:
+        record = archive.read_record(directory, segment, position, length)
+        game = record['game']
+        key = (game['group_id'], game['season'])
+        if table == 'games':
+            yield tuple(game.get(column) for column in ARCHIVED_COLUMNS['games'])
+        elif table == 'participants':
+            for p in record['participants']:
+                yield key + (p['user_id'], p['username'], p['first_name'])
+        else:
+            names = {p['user_id']: p['username'] for p in record['participants']}
+            for a in record['assignments']:
+                yield key + (a['santa_id'], names.get(a['santa_id']), a['target_id'], names.get(a['target_id']))
+
+
+@cli.command(context_settings={'ignore_unknown_options': True})
+@click.argument('group_id', type=int, required=False)
+@click.option('--season', type=int, help="Only this season.")
+@click.option('--table', type=click.Choice(sorted(ARCHIVED_COLUMNS)), default='games', show_default=True,
+              help="What to export from each archived season.")
+@output_options
+@click.pass_context
+def archived(ctx, group_id, season, table, fmt, output):
+    """Exports archived seasons (all of them, or GROUP_ID's) from cold storage."""
+    index = open_archive_index()
+    if index is None:
+        raise click.ClickException(f"Nothing has been archived to {ctx.meta['archive_dir']}")
+    where, params = [], []
+    if group_id is not None:
+        where.append("group_id = ?")
+        params.append(group_id)
+    if season is not None:
+        where.append("season = ?")
+        params.append(season)
+    try:
+        locations = index.execute(f"SELECT segment, position, length FROM games {_where(where)} "
+                                  f"ORDER BY group_id, season", params).fetchall()
+    finally:
+        index.close()
+    count = export_rows(archived_rows(ctx.meta['archive_dir'], locations, table), ARCHIVED_COLUMNS[table], output, fmt)
+    click.echo(f"{count} archived {table} rows", err=True)
+
+
+@cli.command()
+@click.argument('table', required=False)
+@click.pass_obj
+def schema(conn, table):
+    """Prints the schema version and each table's columns and indexes."""
+    click.echo(f"Schema version: {conn.execute('PRAGMA user_version').fetchone()[0]}")
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    if table:
+        if table not in tables:
+            raise click.ClickException(f"No table {table!r}")
+        tables = [table]
+    for name in tables:
+        click.echo(f"\n{name}")
+        # main: with shards, the unqualified name is the view over all of them
+        for _, column, type_, notnull, default, pk in conn.execute(f"PRAGMA main.table_info({name})"):
+            flags = " ".join(flag for flag, on in (("PRIMARY KEY", pk), ("NOT NULL", notnull)) if on)
+            default = f" DEFAULT {default}" if default is not None else ""
+            click.echo(f"  {column} {type_ or ''}{default} {flags}".rstrip())
+        for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                   "AND sql IS NOT NULL ORDER BY name", (name,)):
+            click.echo(f"  {sql}")
+
+
+def roster_size_stats(conn, conditions, params):
+    """Distribution of roster sizes, reading the sizes in order so percentiles need no list in memory."""
+    games_with_participants = f"FROM games g JOIN participants p ON p.game_id = g.game_id {_where(conditions)}"
+    groups = conn.execute(f"SELECT COUNT(DISTINCT g.game_id) {games_with_participants}", params).fetchone()[0]
+    stats = {'groups': groups, 'buckets': {}}
+    if not groups:
+        return stats
+    ranks = {'min': 0, 'p50': (groups - 1) // 2, 'p90': int((groups - 1) * 0.9), 'max': groups - 1}
+    total = 0
+    cursor = conn.execute(
+        f"SELECT COUNT(*) AS size {games_with_participants} GROUP BY g.game_id ORDER BY size", params)
+    for index, (size,) in enumerate(cursor):
+        total += size
+        for name, rank in ranks.items():
+            if index == rank:
+                stats[name] = size
+        bucket = next((f"<={limit}" for limit in ROSTER_BUCKETS if size <= limit), f">{ROSTER_BUCKETS[-1]}")
+        stats['buckets'][bucket] = stats['buckets'].get(bucket, 0) + 1
+    stats['mean'] = round(total / groups, 1)
+    return stats
+
+
+def dm_stats(conn, conditions, params):
+    """Assignment DMs that failed on the first try against all draw DMs.
+
+    Every draw DM is stored in the outbox before it is sent (see draw_jobs.py); attempts counts
+    the failed sends, so rows still at 0 went out on the first try.
+    """
+    sent = conn.execute(f"SELECT COUNT(*) FROM games g JOIN assignments a ON a.game_id = g.game_id "
+                        f"{_where(conditions)}", params).fetchone()[0]
+    stats = {'assignment_dms': sent}
+    if not has_table(conn, 'outbox'):
+        return stats
+    # Outbox rows belong to a group, not a season
+    outbox_condition = f"AND o.group_id IN (SELECT g.group_id FROM games g {_where(conditions)})" if conditions else ""
+    failed = dict(conn.execute(
+        f"SELECT o.status, COUNT(*) FROM outbox o WHERE o.kind = 'assignment' AND o.attempts > 0 {outbox_condition} "
+        f"GROUP BY o.status",
+        params).fetchall())
+    total_failed = sum(failed.values())
+    stats.update(failed_first_try=total_failed, outbox=failed,
+                 failure_rate=round(total_failed / sent, 4) if sent else None)
+    return stats
+
+
+@cli.command()
+@filter_options
+@click.option('--json', 'as_json', is_flag=True, help="Print the stats as one JSON object.")
+@click.pass_obj
+def stats(conn, as_json, **filters):
+    """Aggregate stats: games per status, roster sizes and DM failures."""
+    conditions, params = _filters(filters)
+    per_status = dict(conn.execute(
+        f"SELECT COALESCE(NULLIF(UPPER(TRIM(g.status)), ''), '(none)'), COUNT(*) FROM games g {_where(conditions)} "
+        f"GROUP BY 1 ORDER BY 2 DESC", params).fetchall())
+    result = {
+        'games': sum(per_status.values()),
+        'games_per_status': per_status,
+        'roster_sizes': roster_size_stats(conn, conditions, params),
+        'dms': dm_stats(conn, conditions, params),
+    }
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+
+    click.echo(f"Games: {result['games']}")
+    for status, count in per_status.items():
+        click.echo(f"  {status}: {count}")
+    sizes = result['roster_sizes']
+    click.echo(f"\nRoster sizes ({sizes['groups']} groups with participants)")
+    if sizes['groups']:
+        click.echo(f"  min {sizes['min']}, median {sizes['p50']}, p90 {sizes['p90']}, max {sizes['max']}, "
+                   f"mean {sizes['mean']}")
+        for bucket, count in sizes['buckets'].items():
+            click.echo(f"  {bucket:>6}: {count}")
+    dms = result['dms']
+    click.echo(f"\nAssignment DMs: {dms['assignment_dms']}")
+    if 'failed_first_try' in dms:
+        rate = f"{dms['failure_rate']:.1%}" if dms['failure_rate'] is not None else "-"
+        outcome = ", ".join(f"{count} {status}" for status, count in sorted(dms['outbox'].items()))
+        click.echo(f"  failed first try: {dms['failed_first_try']} ({rate}){': ' + outcome if outcome else ''}")
+        click.echo("  (finished outbox rows are pruned after a week, so older failures aren't counted)")
+
+
+if __name__ == '__main__':
+    try:
+        cli()
+    except BrokenPipeError:
+        # e.g. piped into head
+        sys.stderr.close()
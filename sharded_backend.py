@@ -0,0 +1,250 @@
+"""SQLite storage split across several database files, so writes for different groups don't
+queue behind one write lock.
+
+Each group lives in one of the shards, picked by a hash of its group_id, and every shard
+is a full SQLiteBackend with its own connection pool and writer. async_db gives each shard
+its own writer thread too, so a long transaction (drawing a big group) only holds up the
+groups in the same shard.
+
+Queries that span groups (a user's assignments, reminders due on a date, due outbox
+messages, expired draw jobs) run on every shard in parallel and the results are merged.
+Outbox ids carry their shard: id = shard-local id * shard count + shard.
+
+The shard files sit next to DATABASE_NAME: santa.db with 4 shards is santa.0-of-4.db to
+santa.3-of-4.db. Moving data between layouts is done offline with reshard.py.
+"""
+import glob
+import math
+import os
+import re
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_backend import SQLiteBackend
+
+
+def shard_paths(path, count):
+    """The database files for `count` shards of `path`."""
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}-of-{count}{ext}" for i in range(count)]
+
+
+def shard_counts(path):
+    """The shard counts that have files next to `path`, e.g. [4] when santa.0-of-4.db exists."""
+    root, ext = os.path.splitext(path)
+    name = re.compile(re.escape(root) + r'\.\d+-of-(\d+)' + re.escape(ext) + '$')
+    found = glob.glob(f"{glob.escape(root)}.*-of-*{ext}")
+    return sorted({int(m.group(1)) for m in map(name.match, found) if m})
+
+
+def has_games(path):
+    """Whether the database file at `path` exists and holds any games."""
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT 1 FROM games LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False    # No schema yet
+    finally:
+        conn.close()
+
+
+def shard_index(group_id, count):
+    """Which of `count` shards holds the group. Stable across processes and Python versions."""
+    return zlib.crc32(str(group_id).encode()) % count
+
+
+class ShardedSQLiteBackend:
+    # Like SQLiteBackend: the files belong to this process
+    cacheable = True
+
+    def __init__(self, path, count, readers=4):
+        self.path = path
+        self.shard_count = count
+        self.paths = shard_paths(path, count)
+        self.shards = [SQLiteBackend(shard_path, readers=readers) for shard_path in self.paths]
+        self._fanout = ThreadPoolExecutor(max_workers=count, thread_name_prefix='db-shard')
+
+    def shard_for(self, group_id):
+        return shard_index(group_id, self.shard_count)
+
+    def _shard(self, group_id):
+        return self.shards[self.shard_for(group_id)]
+
+    def _each(self, func):
+        """Runs func(shard) on every shard in parallel; returns the results in shard order."""
+        return list(self._fanout.map(func, self.shards))
+
+    def init(self):
+        missing = [p for p in self.paths if not os.path.exists(p)]
+        if missing and len(missing) < len(self.paths):
+            # Starting would create an empty shard in place of one that was lost or never copied
+            raise RuntimeError(f"{missing[0]} is missing but other shard files exist; restore it, "
+                               f"or run reshard.py again from the layout that has all its files")
+        if not any(has_games(p) for p in self.paths):
+            # Refuse to start on empty shards while the data sits in another layout
+            others = [self.path] + [path for count in shard_counts(self.path) if count != self.shard_count
+                                    for path in shard_paths(self.path, count)]
+            found = next((path for path in others if has_games(path)), None)
+            if found:
+                raise RuntimeError(f"The data is in {found}, not in {self.shard_count} shards; "
+                                   f"run `python reshard.py {self.shard_count}` first")
+        self._each(lambda shard: shard.init())
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self._fanout.shutdown(wait=True)
+
+    # --- One group: its shard ---
+
+    def load_group_state(self, group_id):
+        return self._shard(group_id).load_group_state(group_id)
+
+    def ensure_game_exists(self, group_id):
+        self._shard(group_id).ensure_game_exists(group_id)
+
+    def update_game_status(self, group_id, status):
+        return self._shard(group_id).update_game_status(group_id, status)
+
+    def add_participant(self, user_id, group_id, username):
+        return self._shard(group_id).add_participant(user_id, group_id, username)
+
+    def add_participants_bulk(self, group_id, members):
+        return self._shard(group_id).add_participants_bulk(group_id, members)
+
+    def update_assignments_and_status(self, group_id, pairs):
+        self._shard(group_id).update_assignments_and_status(group_id, pairs)
+
+    def transition_game(self, group_id, event):
+        return self._shard(group_id).transition_game(group_id, event)
+
+    def start_draw_job(self, group_id, owner, lease_until):
+        return self._shard(group_id).start_draw_job(group_id, owner, lease_until)
+
+    def save_draw_job(self, group_id, owner, pairs, lease_until):
+        self._shard(group_id).save_draw_job(group_id, owner, pairs, lease_until)
+
+    def queue_draw_dms(self, group_id, owner, entries):
+        index = self.shard_for(group_id)
+        return [self._global_id(index, message_id)
+                for message_id in self.shards[index].queue_draw_dms(group_id, owner, entries)]
+
+    def abort_draw_job(self, group_id, owner):
+        self._shard(group_id).abort_draw_job(group_id, owner)
+
+    def update_exchange_date(self, group_id, date_text, exchange_on):
+        self._shard(group_id).update_exchange_date(group_id, date_text, exchange_on)
+
+    def cancel_game(self, group_id):
+        self._shard(group_id).cancel_game(group_id)
+
+    def cancel_game_full(self, group_id):
+        return self._shard(group_id).cancel_game_full(group_id)
+
+    def get_assignments(self, group_id):
+        return self._shard(group_id).get_assignments(group_id)
+
+    def get_draw_rules(self, group_id):
+        return self._shard(group_id).get_draw_rules(group_id)
+
+    def supersede_outbox(self, group_id, kind):
+        self._shard(group_id).supersede_outbox(group_id, kind)
+
+    def get_roster_message_id(self, group_id):
+        return self._shard(group_id).get_roster_message_id(group_id)
+
+    def set_roster_message_id(self, group_id, message_id):
+        self._shard(group_id).set_roster_message_id(group_id, message_id)
+
+    # --- Across groups: every shard ---
+
+    def get_all_assignments_for_user(self, user_id):
+        rows = self._each(lambda shard: shard.get_all_assignments_for_user(user_id))
+        return sorted((row for shard_rows in rows for row in shard_rows), key=lambda row: row[0])
+
+    def get_draw_history(self, user_id, seasons):
+        rows = self._each(lambda shard: shard.get_draw_history(user_id, seasons))
+        # A group's seasons all come from one shard, so the stable sort keeps them newest first
+        return sorted((row for shard_rows in rows for row in shard_rows), key=lambda row: row[0])
+
+    def games_on_dates(self, dates):
+        dates = list(dates)
+        return [game for games in self._each(lambda shard: shard.games_on_dates(dates)) for game in games]
+
+    def get_assignments_for_groups(self, group_ids):
+        by_shard = self._partition(group_ids, lambda group_id: group_id)
+        result = {}
+        for shard_result in self._fanout.map(lambda item: self.shards[item[0]].get_assignments_for_groups(item[1]),
+                                             by_shard.items()):
+            result.update(shard_result)
+        return result
+
+    def claim_draw_jobs(self, now, owner, lease_until, limit):
+        per_shard = math.ceil(limit / self.shard_count)
+        jobs = self._each(lambda shard: shard.claim_draw_jobs(now, owner, lease_until, per_shard))
+        return [job for shard_jobs in jobs for job in shard_jobs]
+
+    def sent_reminders(self, dates):
+        dates = list(dates)
+        return set().union(*self._each(lambda shard: shard.sent_reminders(dates)))
+
+    def record_reminders(self, reminders):
+        for index, shard_reminders in self._partition(reminders, lambda reminder: reminder[0]).items():
+            self.shards[index].record_reminders(shard_reminders)
+
+    def prune_reminders(self, before):
+        self._each(lambda shard: shard.prune_reminders(before))
+
+    # --- Outbox: messages about a group live in its shard, others in their chat's ---
+
+    def _global_id(self, index, message_id):
+        return message_id * self.shard_count + index
+
+    def _local(self, message_id):
+        """(shard, shard-local id) of an outbox id."""
+        return self.shards[message_id % self.shard_count], message_id // self.shard_count
+
+    def _partition(self, items, group_of):
+        by_shard = {}
+        for item in items:
+            by_shard.setdefault(self.shard_for(group_of(item)), []).append(item)
+        return by_shard
+
+    def enqueue_outbox(self, entries):
+        # entry: (chat_id, group_id, ...)
+        for index, shard_entries in self._partition(entries, lambda entry: entry[0] if entry[1] is None else entry[1]).items():
+            self.shards[index].enqueue_outbox(shard_entries)
+
+    def _claimed(self, messages_per_shard):
+        return [message._replace(id=self._global_id(index, message.id))
+                for index, messages in enumerate(messages_per_shard) for message in messages]
+
+    def claim_outbox(self, now, lease_until, limit):
+        per_shard = math.ceil(limit / self.shard_count)
+        return self._claimed(self._each(lambda shard: shard.claim_outbox(now, lease_until, per_shard)))
+
+    def claim_outbox_for_chat(self, chat_id, now, lease_until):
+        messages = self._claimed(self._each(lambda shard: shard.claim_outbox_for_chat(chat_id, now, lease_until)))
+        return sorted(messages, key=lambda message: message.created_at)
+
+    def retry_outbox(self, retries):
+        by_shard = {}
+        for message_id, *retry in retries:
+            shard, local_id = self._local(message_id)
+            by_shard.setdefault(shard, []).append((local_id, *retry))
+        for shard, shard_retries in by_shard.items():
+            shard.retry_outbox(shard_retries)
+
+    def finish_outbox(self, message_ids, status):
+        by_shard = {}
+        for message_id in message_ids:
+            shard, local_id = self._local(message_id)
+            by_shard.setdefault(shard, []).append(local_id)
+        for shard, local_ids in by_shard.items():
+            shard.finish_outbox(local_ids, status)
+
+    def prune_outbox(self, before):
+        self._each(lambda shard: shard.prune_outbox(before))
@@ -0,0 +1,428 @@
+"""SQLite storage backend: the schema in migrations.py, accessed through a ConnectionPool.
+
+Each state transition is a single conditional UPDATE inside a BEGIN IMMEDIATE transaction,
+so when several callers (or worker processes) race, exactly one of them wins.
+
+Games are per (group_id, season); the bot works on each group's active season, found via
+the partial unique index idx_games_active. Participants and assignments are keyed by
+game_id, so past seasons stay out of the way of the active one (see migrations._seasons).
+"""
+import datetime
+import time
+
+import migrations
+from connection_pool import ConnectionPool
+from state_cache import GroupState
+from storage import (GAME_TRANSITIONS, DrawJob, DrawRules, GameStateError, OutboxMessage, TransitionResult,
+                     normalize_status)
+
+_OUTBOX_COLUMNS = "id, chat_id, group_id, kind, text, options, attempts, created_at"
+_INSERT_OUTBOX = ("INSERT INTO outbox (chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error, "
+                  "leased_until, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+class SQLiteBackend:
+    # Other processes writing the same file are only seen once cache entries expire
+    cacheable = True
+
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.pool = ConnectionPool(path, readers=readers)
+
+    def init(self):
+        """Brings the schema up to date (see migrations.py). A no-op pragma read when current."""
+        migrations.migrate(self.pool)
+
+    def close(self):
+        self.pool.close()
+
+    def load_group_state(self, group_id):
+        with self.pool.reader() as conn:
+            # Read the game row and roster from one snapshot
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute(
+                    "SELECT game_id, status, exchange_date, exchange_on FROM games WHERE group_id = ? AND active = 1",
+                    (group_id,)
+                ).fetchone()
+                roster = conn.execute(
+                    "SELECT user_id, username FROM participants WHERE game_id = ? ORDER BY seq", (row[0],)
+                ).fetchall() if row else []
+            finally:
+                conn.execute("COMMIT")
+
+        return GroupState(
+            status=row[1] if row and row[1] else None,
+            exchange_date=row[2] if row and row[2] else None,
+            exchange_on=datetime.date.fromisoformat(row[3]) if row and row[3] else None,
+            roster=tuple(roster),
+        )
+
+    @staticmethod
+    def _active_game(conn, group_id):
+        """The game_id of the group's active season, or None."""
+        row = conn.execute("SELECT game_id FROM games WHERE group_id = ? AND active = 1", (group_id,)).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def _ensure_game(cls, conn, group_id):
+        """Creates the group's first season if it has none. Returns the active game_id."""
+        # Ignored when there already is an active season (idx_games_active is unique)
+        conn.execute("INSERT OR IGNORE INTO games (group_id, season, status, date_started) "
+                     "SELECT ?, COALESCE(MAX(season), 0) + 1, ?, ? FROM games WHERE group_id = ?",
+                     (group_id, 'JOINING', datetime.datetime.now().isoformat(), group_id))
+        # Ensure that older rows (created before 'status' existed) get a default status
+        conn.execute(
+            "UPDATE games SET status = ? WHERE group_id = ? AND active = 1 AND (status IS NULL OR status = '')",
+            ('JOINING', group_id)
+        )
+        return cls._active_game(conn, group_id)
+
+    def ensure_game_exists(self, group_id):
+        with self.pool.writer() as conn:
+            self._ensure_game(conn, group_id)
+
+    def update_game_status(self, group_id, status):
+        with self.pool.writer() as conn:
+            return conn.execute("UPDATE games SET status = ? WHERE group_id = ? AND active = 1",
+                                (status, group_id)).rowcount > 0
+
+    def add_participant(self, user_id, group_id, username):
+        with self.pool.writer() as conn:
+            game_id = self._ensure_game(conn, group_id)
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO participants (game_id, user_id, username, first_name, seq) "
+                "SELECT ?, ?, ?, ?, COALESCE(MAX(seq), 0) + 1 FROM participants WHERE game_id = ?",
+                (game_id, user_id, username, username, game_id)  # Using username for first_name too, for simplicity
+            )
+            return cursor.rowcount > 0  # 0 if already in
+
+    def add_participants_bulk(self, group_id, members):
+        user_ids = [user_id for user_id, _, _ in members]
+        with self.pool.writer() as conn:
+            game_id = self._ensure_game(conn, group_id)
+            status = conn.execute("SELECT status FROM games WHERE game_id = ?", (game_id,)).fetchone()[0]
+            if normalize_status(status) != 'JOINING':
+                raise GameStateError(f"Cannot add participants to {group_id}: status is {status}")
+            # Look up who is already in (to report who's new), then insert everyone else in one go
+            existing = set()
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                existing.update(row[0] for row in conn.execute(
+                    f"SELECT user_id FROM participants WHERE game_id = ? AND user_id IN ({','.join('?' * len(chunk))})",
+                    (game_id, *chunk)
+                ))
+            added = []
+            for user_id in user_ids:
+                if user_id not in existing:
+                    existing.add(user_id)
+                    added.append(user_id)
+            # First name given for each user
+            names = {user_id: username for user_id, username, _ in reversed(members)}
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM participants WHERE game_id = ?", (game_id,)).fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO participants (game_id, user_id, username, first_name, seq) VALUES (?, ?, ?, ?, ?)",
+                [(game_id, user_id, names[user_id], names[user_id], seq + i) for i, user_id in enumerate(added, 1)]
+            )
+            conn.executemany("UPDATE participants SET team = ? WHERE game_id = ? AND user_id = ?",
+                             [(team, game_id, user_id) for user_id, _, team in members if team is not None])
+        return added
+
+    @classmethod
+    def _complete_draw(cls, conn, group_id, pairs):
+        # Ensure the game row exists so the status update will apply
+        game_id = cls._ensure_game(conn, group_id)
+
+        # 1. Update game status; this is the compare-and-set that decides whether the draw still counts
+        result = cls._apply_transition(conn, group_id, 'complete_draw')
+        if not result.won:
+            raise GameStateError(f"Cannot complete draw for {group_id}: status is {result.status}")
+
+        # 2. Clear any previous assignments for this season
+        conn.execute("DELETE FROM assignments WHERE game_id = ?", (game_id,))
+
+        # 3. Insert new assignments
+        assignment_data = [(game_id, santa_id, target_id) for santa_id, target_id in pairs]
+        conn.executemany("INSERT INTO assignments (game_id, santa_id, target_id) VALUES (?, ?, ?)", assignment_data)
+        return game_id
+
+    def update_assignments_and_status(self, group_id, pairs):
+        with self.pool.writer() as conn:
+            self._complete_draw(conn, group_id, pairs)
+
+    @staticmethod
+    def _apply_transition(conn, group_id, event):
+        """Runs one transition on a connection that is already inside a write transaction."""
+        from_states, to_state = GAME_TRANSITIONS[event]
+        placeholders = ",".join("?" * len(from_states))
+        cursor = conn.execute(
+            f"UPDATE games SET status = ? WHERE group_id = ? AND active = 1 "
+            f"AND COALESCE(UPPER(TRIM(status)), '') IN ({placeholders})",
+            (to_state, group_id, *from_states)
+        )
+        if cursor.rowcount:
+            return TransitionResult(True, to_state)
+        row = conn.execute("SELECT status FROM games WHERE group_id = ? AND active = 1", (group_id,)).fetchone()
+        return TransitionResult(False, row[0] if row and row[0] else None)
+
+    def transition_game(self, group_id, event):
+        with self.pool.writer() as conn:
+            return self._apply_transition(conn, group_id, event)
+
+    def start_draw_job(self, group_id, owner, lease_until):
+        with self.pool.writer() as conn:
+            result = self._apply_transition(conn, group_id, 'start_draw')
+            if result.won:
+                conn.execute(
+                    "INSERT OR REPLACE INTO draw_jobs (game_id, group_id, phase, owner, lease_until, attempts, updated_at) "
+                    "VALUES (?, ?, 'leased', ?, ?, 0, ?)",
+                    (self._active_game(conn, group_id), group_id, owner, lease_until, time.time()))
+            return result
+
+    @classmethod
+    def _held_job(cls, conn, group_id, owner, phase):
+        """The game_id of the group's `phase` job if `owner` holds it; raises GameStateError otherwise."""
+        game_id = cls._active_game(conn, group_id)
+        if not conn.execute("SELECT 1 FROM draw_jobs WHERE game_id = ? AND owner = ? AND phase = ?",
+                            (game_id, owner, phase)).fetchone():
+            raise GameStateError(f"Draw job for {group_id} is no longer {phase} by {owner}")
+        return game_id
+
+    def save_draw_job(self, group_id, owner, pairs, lease_until):
+        with self.pool.writer() as conn:
+            self._held_job(conn, group_id, owner, 'leased')
+            game_id = self._complete_draw(conn, group_id, pairs)
+            conn.execute("UPDATE draw_jobs SET phase = 'assigned', lease_until = ?, updated_at = ? WHERE game_id = ?",
+                         (lease_until, time.time(), game_id))
+
+    def queue_draw_dms(self, group_id, owner, entries):
+        now = time.time()
+        with self.pool.writer() as conn:
+            game_id = self._held_job(conn, group_id, owner, 'assigned')
+            ids = [self._enqueue(conn, entry, now) for entry in entries]
+            conn.execute("UPDATE draw_jobs SET phase = 'delivered', lease_until = NULL, updated_at = ? WHERE game_id = ?",
+                         (now, game_id))
+        return ids
+
+    def claim_draw_jobs(self, now, owner, lease_until, limit):
+        with self.pool.writer() as conn:
+            rows = conn.execute(
+                "SELECT game_id, group_id, phase, attempts FROM draw_jobs "
+                "WHERE phase IN ('leased', 'assigned') AND lease_until <= ? ORDER BY lease_until LIMIT ?",
+                (now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE draw_jobs SET owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE game_id = ?",
+                [(owner, lease_until, now, row[0]) for row in rows])
+        return [DrawJob(group_id, phase, attempts + 1) for _, group_id, phase, attempts in rows]
+
+    def abort_draw_job(self, group_id, owner):
+        with self.pool.writer() as conn:
+            conn.execute("UPDATE draw_jobs SET phase = 'aborted', lease_until = NULL, updated_at = ? "
+                         "WHERE game_id = ? AND owner = ? AND phase IN ('leased', 'assigned')",
+                         (time.time(), self._active_game(conn, group_id), owner))
+
+    @staticmethod
+    def _abort_unfinished_job(conn, game_id):
+        conn.execute("UPDATE draw_jobs SET phase = 'aborted', lease_until = NULL, updated_at = ? "
+                     "WHERE game_id = ? AND phase IN ('leased', 'assigned')", (time.time(), game_id))
+
+    def update_exchange_date(self, group_id, date_text, exchange_on):
+        with self.pool.writer() as conn:
+            # Ensure a game row exists so the exchange_date update will apply
+            game_id = self._ensure_game(conn, group_id)
+            conn.execute("UPDATE games SET exchange_date = ?, exchange_on = ? WHERE game_id = ?",
+                         (date_text, exchange_on.isoformat() if exchange_on else None, game_id))
+
+    def get_all_assignments_for_user(self, user_id):
+        with self.pool.reader() as conn:
+            # We join assignments (santa_id -> target_id), participants (target_id -> target_name),
+            # and games (group_id -> exchange_date). The santa lookup uses idx_assignments_santa;
+            # games are matched by primary key, keeping only active seasons, and the target
+            # within the same game via the participants primary key.
+            cursor = conn.execute("""
+                SELECT
+                    t3.group_id,
+                    t2.username,
+                    t3.exchange_date
+                FROM assignments t1
+                JOIN games t3 ON t3.game_id = t1.game_id AND t3.active = 1
+                JOIN participants t2 ON t2.game_id = t1.game_id AND t2.user_id = t1.target_id
+                WHERE t1.santa_id = ?
+                ORDER BY t3.group_id
+            """, (user_id,))
+            return cursor.fetchall()
+
+    def get_draw_history(self, user_id, seasons):
+        with self.pool.reader() as conn:
+            # Same index path as /mysanta, without the active filter
+            rows = conn.execute("""
+                SELECT g.group_id, g.season, COALESCE(substr(g.exchange_on, 1, 4), substr(g.date_started, 1, 4)), p.username
+                FROM assignments a
+                JOIN games g ON g.game_id = a.game_id
+                JOIN participants p ON p.game_id = a.game_id AND p.user_id = a.target_id
+                WHERE a.santa_id = ?
+                ORDER BY g.group_id, g.season DESC
+            """, (user_id,)).fetchall()
+        history = []
+        per_group = {}
+        for group_id, season, year, target_name in rows:
+            per_group[group_id] = per_group.get(group_id, 0) + 1
+            if per_group[group_id] <= seasons:
+                history.append((group_id, season, int(year) if year else None, target_name))
+        return history
+
+    def cancel_game(self, group_id):
+        with self.pool.writer() as conn:
+            game_id = self._ensure_game(conn, group_id)
+            # Remove this season's assignments for a reset and set status back to JOINING
+            conn.execute("DELETE FROM assignments WHERE game_id = ?", (game_id,))
+            self._apply_transition(conn, group_id, 'cancel')
+            self._abort_unfinished_job(conn, game_id)
+
+    def cancel_game_full(self, group_id):
+        with self.pool.writer() as conn:
+            game_id = self._ensure_game(conn, group_id)
+            self._abort_unfinished_job(conn, game_id)
+            if conn.execute("SELECT 1 FROM assignments WHERE game_id = ? LIMIT 1", (game_id,)).fetchone():
+                # Names were drawn: keep the season as history and start the next one
+                conn.execute("UPDATE games SET active = 0, ended_at = ? WHERE game_id = ?",
+                             (datetime.datetime.now().isoformat(), game_id))
+                self._ensure_game(conn, group_id)
+                return True
+            conn.execute("DELETE FROM participants WHERE game_id = ?", (game_id,))
+            self._apply_transition(conn, group_id, 'cancel')
+            conn.execute("UPDATE games SET exchange_date = ?, exchange_on = ?, roster_message_id = ? WHERE game_id = ?",
+                         (None, None, None, game_id))
+            return False
+
+    def games_on_dates(self, dates):
+        days = [d.isoformat() for d in dates]
+        with self.pool.reader() as conn:
+            rows = conn.execute(
+                f"SELECT group_id, exchange_on, status FROM games "
+                f"WHERE active = 1 AND exchange_on IN ({','.join('?' * len(days))})",
+                days
+            ).fetchall()
+        return [(group_id, datetime.date.fromisoformat(day), status) for group_id, day, status in rows]
+
+    def get_assignments(self, group_id):
+        with self.pool.reader() as conn:
+            return conn.execute("""
+                SELECT a.santa_id, a.target_id, p.username
+                FROM games g
+                JOIN assignments a ON a.game_id = g.game_id
+                JOIN participants p ON p.game_id = a.game_id AND p.user_id = a.target_id
+                WHERE g.group_id = ? AND g.active = 1
+            """, (group_id,)).fetchall()
+
+    def get_assignments_for_groups(self, group_ids):
+        group_ids = list(group_ids)
+        result = {}
+        with self.pool.reader() as conn:
+            for start in range(0, len(group_ids), 500):
+                chunk = group_ids[start:start + 500]
+                for group_id, santa_id, target_id, username in conn.execute(f"""
+                    SELECT g.group_id, a.santa_id, a.target_id, p.username
+                    FROM games g
+                    JOIN assignments a ON a.game_id = g.game_id
+                    JOIN participants p ON p.game_id = a.game_id AND p.user_id = a.target_id
+                    WHERE g.group_id IN ({','.join('?' * len(chunk))}) AND g.active = 1
+                """, chunk):
+                    result.setdefault(group_id, []).append((santa_id, target_id, username))
+        return result
+
+    def get_draw_rules(self, group_id):
+        with self.pool.reader() as conn:
+            previous = conn.execute("""
+                SELECT santa_id, target_id FROM assignments WHERE game_id = (
+                    SELECT game_id FROM games WHERE group_id = ? AND active = 0 AND status != 'ARCHIVED'
+                    ORDER BY season DESC LIMIT 1
+                )
+            """, (group_id,)).fetchall()
+            teams = conn.execute("""
+                SELECT p.user_id, p.team FROM games g JOIN participants p ON p.game_id = g.game_id
+                WHERE g.group_id = ? AND g.active = 1 AND p.team IS NOT NULL
+            """, (group_id,)).fetchall()
+        return DrawRules(previous, dict(teams))
+
+    def sent_reminders(self, dates):
+        days = [d.isoformat() for d in dates]
+        with self.pool.reader() as conn:
+            rows = conn.execute(
+                f"SELECT group_id, exchange_on, days_before, recipient_id FROM reminders_sent "
+                f"WHERE exchange_on IN ({','.join('?' * len(days))})",
+                days
+            ).fetchall()
+        return {(group_id, datetime.date.fromisoformat(day), days_before, recipient_id)
+                for group_id, day, days_before, recipient_id in rows}
+
+    def record_reminders(self, reminders):
+        now = datetime.datetime.now().isoformat()
+        with self.pool.writer() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO reminders_sent (exchange_on, group_id, days_before, recipient_id, sent_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(day.isoformat(), group_id, days_before, recipient_id, now)
+                 for group_id, day, days_before, recipient_id in reminders]
+            )
+
+    def prune_reminders(self, before):
+        with self.pool.writer() as conn:
+            conn.execute("DELETE FROM reminders_sent WHERE exchange_on < ?", (before.isoformat(),))
+
+    @staticmethod
+    def _enqueue(conn, entry, now):
+        return conn.execute(_INSERT_OUTBOX, (*entry, now)).lastrowid
+
+    def enqueue_outbox(self, entries):
+        now = time.time()
+        with self.pool.writer() as conn:
+            conn.executemany(_INSERT_OUTBOX, [(*entry, now) for entry in entries])
+
+    def _claim(self, conn, where, params, lease_until):
+        rows = conn.execute(f"SELECT {_OUTBOX_COLUMNS} FROM outbox WHERE status = 'pending' AND {where}", params).fetchall()
+        conn.executemany("UPDATE outbox SET next_attempt_at = ?, leased_until = ? WHERE id = ?",
+                         [(lease_until, lease_until, row[0]) for row in rows])
+        return [OutboxMessage(*row) for row in rows]
+
+    def claim_outbox(self, now, lease_until, limit):
+        with self.pool.writer() as conn:
+            return self._claim(conn, "next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?", (now, limit), lease_until)
+
+    def claim_outbox_for_chat(self, chat_id, now, lease_until):
+        with self.pool.writer() as conn:
+            return self._claim(conn, "chat_id = ? AND (leased_until IS NULL OR leased_until <= ?) ORDER BY id",
+                               (chat_id, now), lease_until)
+
+    def retry_outbox(self, retries):
+        with self.pool.writer() as conn:
+            conn.executemany("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, leased_until = NULL "
+                             "WHERE id = ? AND status = 'pending'",
+                             [(attempts, next_attempt_at, error, message_id)
+                              for message_id, attempts, next_attempt_at, error in retries])
+
+    def finish_outbox(self, message_ids, status):
+        now = time.time()
+        with self.pool.writer() as conn:
+            conn.executemany("UPDATE outbox SET status = ?, finished_at = ? WHERE id = ? AND status = 'pending'",
+                             [(status, now, message_id) for message_id in message_ids])
+
+    def supersede_outbox(self, group_id, kind):
+        with self.pool.writer() as conn:
+            conn.execute("UPDATE outbox SET status = 'superseded', finished_at = ? "
+                         "WHERE status = 'pending' AND group_id = ? AND kind = ?", (time.time(), group_id, kind))
+
+    def prune_outbox(self, before):
+        with self.pool.writer() as conn:
+            conn.execute("DELETE FROM outbox WHERE status != 'pending' AND finished_at < ?", (before,))
+
+    def get_roster_message_id(self, group_id):
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT roster_message_id FROM games WHERE group_id = ? AND active = 1",
+                               (group_id,)).fetchone()
+            return row[0] if row else None
+
+    def set_roster_message_id(self, group_id, message_id):
+        with self.pool.writer() as conn:
+            game_id = self._ensure_game(conn, group_id)
+            conn.execute("UPDATE games SET roster_message_id = ? WHERE game_id = ?", (message_id, game_id))
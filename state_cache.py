@@ -0,0 +1,127 @@
+"""In-process cache of per-group game state (status, exchange date, roster).
+
+database.py reads through this cache and its mutators write through to it, so repeated
+reads within and across handlers don't go back to SQLite. Entries are evicted LRU once
+MAX_GROUPS is reached and expire after TTL_SECONDS, which also bounds how stale a
+worker can be if another process writes to the same database.
+
+Alongside the states it keeps the set of user ids known to be in each group's game, so a
+repeated Join is answered without a query even when the group's state isn't cached. A set
+only ever holds confirmed members, and any write that could remove someone drops it.
+"""
+import threading
+from dataclasses import dataclass, replace
+
+from cachetools import TTLCache
+
+MAX_GROUPS = 10000
+TTL_SECONDS = 300
+
+
+@dataclass(frozen=True)
+class GroupState:
+    status: object = None
+    exchange_date: object = None
+    # The parsed exchange date (datetime.date), None if unset or unparseable
+    exchange_on: object = None
+    # Ordered (user_id, username) tuples, in join order
+    roster: tuple = ()
+
+
+_cache = TTLCache(maxsize=MAX_GROUPS, ttl=TTL_SECONDS)
+_members = TTLCache(maxsize=MAX_GROUPS, ttl=TTL_SECONDS)
+_lock = threading.Lock()
+# Bumped on every write so a slow loader can't overwrite fresher state with what it read
+_epoch = 0
+_hits = 0
+_misses = 0
+
+
+def get(group_id):
+    """Returns the cached GroupState for the group, or None on a miss."""
+    global _hits, _misses
+    with _lock:
+        state = _cache.get(group_id)
+        if state is None:
+            _misses += 1
+        else:
+            _hits += 1
+        return state
+
+
+def epoch():
+    """Returns the current write epoch; pass it to put() after loading from the DB."""
+    return _epoch
+
+
+def put(group_id, state, loaded_at_epoch):
+    """Caches state loaded from the DB, unless a write happened while it was being read."""
+    with _lock:
+        if loaded_at_epoch == _epoch:
+            _cache[group_id] = state
+            _members[group_id] = {user_id for user_id, _ in state.roster}
+
+
+def update(group_id, **changes):
+    """Writes committed changes through to the cached state, if the group is cached."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        state = _cache.get(group_id)
+        if state is not None:
+            _cache[group_id] = replace(state, **changes)
+        if 'roster' in changes:
+            _members[group_id] = {user_id for user_id, _ in changes['roster']}
+
+
+def add_to_roster(group_id, user_id, username):
+    """Appends a newly joined participant to the cached roster, if the group is cached."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        state = _cache.get(group_id)
+        if state is not None:
+            _cache[group_id] = replace(state, roster=state.roster + ((user_id, username),))
+        _members.setdefault(group_id, set()).add(user_id)
+
+
+def add_member(group_id, user_id):
+    """Records that the user is in the group's game (e.g. a join found them already there)."""
+    with _lock:
+        _members.setdefault(group_id, set()).add(user_id)
+
+
+def is_member(group_id, user_id):
+    """Whether the user is known to be in the group's game. False may just mean not known."""
+    with _lock:
+        return user_id in _members.get(group_id, ())
+
+
+def invalidate(group_id):
+    """Drops the group's cached state."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _cache.pop(group_id, None)
+        _members.pop(group_id, None)
+
+
+def clear():
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _cache.clear()
+        _members.clear()
+
+
+def stats():
+    """Returns hit/miss counters and the current cache size."""
+    with _lock:
+        total = _hits + _misses
+        return {
+            'hits': _hits,
+            'misses': _misses,
+            'hit_ratio': (_hits / total) if total else 0.0,
+            'size': len(_cache),
+            'max_size': _cache.maxsize,
+        }
@@ -0,0 +1,210 @@
+"""The storage backend interface behind database.py, and the types all backends share.
+
+database.py keeps the functions the bot calls (and the per-process state cache); the data
+itself lives in one of:
+
+    sqlite_backend.SQLiteBackend   one SQLite file (the default)
+    redis_backend.RedisBackend     a Redis server, so several bot workers can share state
+    memory_backend.MemoryBackend   plain dicts, for tests and benchmarks
+
+Every backend must make transition_game and update_assignments_and_status atomic: when
+several callers race on the same group, exactly one wins each transition.
+
+A group plays one season at a time. Everything below works on the group's active season,
+except get_draw_history, which also reads the seasons cancel_game_full put behind it.
+"""
+from typing import NamedTuple, Protocol
+
+
+class GameStateError(Exception):
+    """Raised when an operation requires a game state the game is no longer in."""
+
+
+class TransitionResult(NamedTuple):
+    won: bool           # True if this caller performed the transition
+    status: object      # The game's status after the attempt
+
+
+class OutboxMessage(NamedTuple):
+    """A message that couldn't be delivered yet (see outbox.py)."""
+    id: object
+    chat_id: int
+    group_id: object    # The group it's about, if any
+    kind: str           # e.g. 'assignment'; a newer draw supersedes older pending ones
+    text: str
+    options: object     # JSON of extra send_message arguments (reply_markup), or None
+    attempts: int
+    created_at: float   # Unix time
+
+
+class DrawRules(NamedTuple):
+    """What the group's draw must avoid (see draw_jobs.draw)."""
+    previous_pairs: list    # (santa_id, target_id) of the group's last drawn season
+    teams: dict             # user_id -> team label; nobody draws someone on their own team
+
+
+class DrawJob(NamedTuple):
+    """A draw in progress (see draw_jobs.py)."""
+    group_id: int
+    phase: str          # 'leased', 'assigned', 'delivered' or 'aborted'
+    attempts: int       # How many times a sweeper has taken it over
+
+
+# --- Game state machine ---
+#
+#   JOINING --start_draw--> DRAWING --complete_draw--> COMPLETED
+#                           DRAWING --abort_draw-----> JOINING
+#   any state --cancel--> JOINING
+#
+# event -> (allowed current statuses, new status). '' stands for legacy NULL/empty statuses.
+GAME_TRANSITIONS = {
+    'start_draw': (('JOINING', ''), 'DRAWING'),
+    'complete_draw': (('DRAWING',), 'COMPLETED'),
+    'abort_draw': (('DRAWING',), 'JOINING'),
+    'cancel': (('JOINING', 'DRAWING', 'COMPLETED', ''), 'JOINING'),
+}
+
+
+def normalize_status(status):
+    """The form statuses are compared in: legacy NULL/blank/lowercase values still match."""
+    return (status or '').strip().upper()
+
+
+class StorageBackend(Protocol):
+    # Whether this process may cache group state (False when other workers write the same data)
+    cacheable: bool
+
+    def init(self):
+        """Creates or upgrades whatever the backend needs (schema, scripts)."""
+
+    def close(self):
+        """Releases connections. The backend is not used again afterwards."""
+
+    def load_group_state(self, group_id):
+        """Returns the group's state_cache.GroupState, read from one consistent snapshot."""
+
+    def ensure_game_exists(self, group_id):
+        """Creates the game in JOINING if missing; gives legacy games without a status JOINING."""
+
+    def update_game_status(self, group_id, status):
+        """Sets the status unconditionally. Returns False if the game doesn't exist."""
+
+    def add_participant(self, user_id, group_id, username):
+        """Returns True if added, False if the user was already in the group."""
+
+    def add_participants_bulk(self, group_id, members):
+        """Adds (user_id, username, team) members in one atomic step, skipping users already in the
+        group. A team label (team may be None) is saved for everyone listed, including those already in.
+
+        Returns the user ids that were newly added, in input order. Raises GameStateError (and adds
+        nothing) if the season is past JOINING, checked in the same step.
+        """
+
+    def update_assignments_and_status(self, group_id, pairs):
+        """Applies complete_draw and replaces the group's assignments in one atomic step.
+
+        Raises GameStateError (and saves nothing) if the game is not DRAWING.
+        """
+
+    def transition_game(self, group_id, event):
+        """Atomically applies a GAME_TRANSITIONS event. Returns a TransitionResult."""
+
+    def start_draw_job(self, group_id, owner, lease_until):
+        """Applies start_draw and, if it won, records a 'leased' draw job held by `owner` until
+        `lease_until` (Unix time), in one atomic step. Returns a TransitionResult."""
+
+    def save_draw_job(self, group_id, owner, pairs, lease_until):
+        """update_assignments_and_status for the owner of a 'leased' job, which moves to
+        'assigned' with its lease renewed. Raises GameStateError if the game is not DRAWING
+        or `owner` no longer holds the lease."""
+
+    def queue_draw_dms(self, group_id, owner, entries):
+        """enqueue_outbox(entries) for the owner of an 'assigned' job, which moves to 'delivered',
+        in one atomic step. Returns the new outbox ids in order; raises GameStateError if `owner`
+        no longer holds the lease."""
+
+    def claim_draw_jobs(self, now, owner, lease_until, limit):
+        """Takes over up to `limit` 'leased' or 'assigned' jobs whose lease ran out before `now`:
+        `owner` holds them until `lease_until` and their attempts go up by one. Returns [DrawJob]."""
+
+    def abort_draw_job(self, group_id, owner):
+        """Marks the job 'aborted' if `owner` holds it. cancel_game and cancel_game_full abort
+        the group's unfinished job whoever holds it."""
+
+    def update_exchange_date(self, group_id, date_text, exchange_on):
+        """Saves the typed exchange date and its parsed datetime.date, creating the game if needed."""
+
+    def get_all_assignments_for_user(self, user_id):
+        """Returns [(group_id, target_name, exchange_date), ...] ordered by group_id."""
+
+    def cancel_game(self, group_id):
+        """Deletes the group's assignments and applies cancel."""
+
+    def cancel_game_full(self, group_id):
+        """Starts the group over. Returns True if the active season was kept as history.
+
+        A season whose names were drawn is kept (with its participants and assignments) and a
+        new JOINING season replaces it. Otherwise there is nothing worth keeping: it is
+        cancel_game, plus deletes participants and clears the exchange dates and roster message.
+        """
+
+    def get_draw_history(self, user_id, seasons):
+        """Returns [(group_id, season, year, target_name), ...]: who the user drew in each group's
+        `seasons` most recent drawn seasons, newest first within each group (ordered by group_id).
+
+        year is the exchange date's year, or the year the season started if it had none.
+        """
+
+    def games_on_dates(self, dates):
+        """Returns [(group_id, exchange_on, status), ...] for games whose exchange_on is in `dates`."""
+
+    def get_assignments(self, group_id):
+        """Returns [(santa_id, target_id, target_username), ...] for the group's draw."""
+
+    def get_assignments_for_groups(self, group_ids):
+        """Like get_assignments for many groups at once: {group_id: [(santa_id, target_id, target_username), ...]}.
+        Groups without a draw are left out."""
+
+    def get_draw_rules(self, group_id):
+        """Returns the DrawRules for the active season: its members' teams, and the pairs of the
+        newest past season still in this backend (empty if there is none)."""
+
+    def sent_reminders(self, dates):
+        """Returns the set of (group_id, exchange_on, days_before, recipient_id) already delivered."""
+
+    def record_reminders(self, reminders):
+        """Records delivered (group_id, exchange_on, days_before, recipient_id) reminders."""
+
+    def prune_reminders(self, before):
+        """Forgets delivery records for exchange dates before `before`."""
+
+    def enqueue_outbox(self, entries):
+        """Stores pending messages: (chat_id, group_id, kind, text, options, attempts, next_attempt_at, last_error,
+        leased_until). leased_until is None, or when the lease of a message already being sent runs out."""
+
+    def claim_outbox(self, now, lease_until, limit):
+        """Returns up to `limit` pending OutboxMessages due at `now`, leasing them until `lease_until`
+        (so two drainers don't send the same message; after a crash they're due again then)."""
+
+    def claim_outbox_for_chat(self, chat_id, now, lease_until):
+        """Like claim_outbox, for every pending message to one chat whether due or not, except
+        those leased by someone else at `now` (they're being sent already)."""
+
+    def retry_outbox(self, retries):
+        """Reschedules claimed messages after a failed attempt and ends their leases, all in one write.
+        retries: [(message_id, attempts, next_attempt_at, error), ...]"""
+
+    def finish_outbox(self, message_ids, status):
+        """Marks messages done ('delivered', 'expired' or 'superseded'); they are never sent again."""
+
+    def supersede_outbox(self, group_id, kind):
+        """Finishes the group's pending messages of `kind` as 'superseded' (e.g. after a redraw)."""
+
+    def prune_outbox(self, before):
+        """Deletes finished messages that finished before `before` (Unix time)."""
+
+    def get_roster_message_id(self, group_id):
+        """Returns the pinned roster message id, or None."""
+
+    def set_roster_message_id(self, group_id, message_id):
+        """Saves the pinned roster message id, creating the game if needed."""
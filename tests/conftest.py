@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:TEST')
+
+import async_db  # noqa: E402
+import database  # noqa: E402
+from sqlite_backend import SQLiteBackend  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """A fresh SQLite database as the storage backend; yields its path."""
+    path = str(tmp_path / 'santa.db')
+    database.set_backend(SQLiteBackend(path))
+    database.init_db()
+    yield path
+    async_db.shutdown()
+    database.close_db()
+
+
+class FakeBot:
+    """Records send_message calls; chats in `blocked` fail like users who never started the bot."""
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        from telegram.error import Forbidden
+        if chat_id in self.blocked:
+            raise Forbidden("bot was blocked by the user")
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def fake_bot():
+    return FakeBot()
@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import NetworkError
+
+import admins
+
+
+class AdminsBot:
+    def __init__(self, admin_ids):
+        self.admin_ids = admin_ids
+        self.calls = 0
+        self.down = False
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls += 1
+        if self.down:
+            raise NetworkError("Bot API unreachable")
+        return [SimpleNamespace(user=SimpleNamespace(id=user_id)) for user_id in self.admin_ids]
+
+
+def _member_update(old, new):
+    change = SimpleNamespace(old_chat_member=SimpleNamespace(status=old),
+                             new_chat_member=SimpleNamespace(status=new))
+    return SimpleNamespace(my_chat_member=None, chat_member=change)
+
+
+def test_only_admin_changes_invalidate():
+    assert not admins.changes_admins(_member_update('left', 'member'))
+    assert not admins.changes_admins(_member_update('member', 'kicked'))
+    assert admins.changes_admins(_member_update('member', 'administrator'))
+    assert admins.changes_admins(_member_update('creator', 'left'))
+    assert admins.changes_admins(SimpleNamespace(my_chat_member=object(), chat_member=None))
+
+
+def test_invalidated_entry_refetches_but_stays_as_fallback():
+    async def scenario():
+        cache = admins.AdminCache()
+        bot = AdminsBot({1, 2})
+        assert await cache.is_admin(bot, -100, 1)
+        assert await cache.is_admin(bot, -100, 2)
+        assert bot.calls == 1
+
+        cache.invalidate(-100)
+        bot.down = True
+        # The refetch fails, so the expired set is used
+        assert await cache.is_admin(bot, -100, 1)
+        assert bot.calls == 2
+
+        bot.down = False
+        bot.admin_ids = {2}
+        assert not await cache.is_admin(bot, -100, 1)
+        assert bot.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_during_a_fetch_drops_its_result_and_keeps_no_state():
+    async def scenario():
+        cache = admins.AdminCache()
+        bot = AdminsBot({1})
+        release = asyncio.Event()
+        fetch = bot.get_chat_administrators
+
+        async def slow_fetch(chat_id):
+            await release.wait()
+            return await fetch(chat_id)
+        bot.get_chat_administrators = slow_fetch
+
+        check = asyncio.create_task(cache.is_admin(bot, -100, 1))
+        await asyncio.sleep(0)
+        cache.invalidate(-100)
+        release.set()
+        assert await check
+        # The fetch read the admins from before the change, so it wasn't cached
+        assert cache.stats()['size'] == 0
+        assert await cache.is_admin(bot, -100, 1)
+        assert bot.calls == 2
+
+        # Invalidating groups with nothing in flight leaves nothing behind
+        for group_id in range(-1, -1001, -1):
+            cache.invalidate(group_id)
+        assert not cache._outdated and not cache._fetches
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import datetime
+import sqlite3
+
+import archive
+import database
+
+
+def _completed_game(group_id, members, exchange_on):
+    database.ensure_game_exists(group_id)
+    for user_id in members:
+        database.add_participant(user_id, group_id, f"user{user_id}")
+    database.transition_game(group_id, 'start_draw')
+    database.update_assignments_and_status(group_id, [(m, members[(i + 1) % len(members)])
+                                                      for i, m in enumerate(members)])
+    database.update_exchange_date(group_id, exchange_on.isoformat(), exchange_on)
+
+
+def test_active_completed_seasons_are_archived(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_DIR', str(tmp_path / 'archive'))
+    today = datetime.date.today()
+    _completed_game(-1, [1, 2, 3], today - datetime.timedelta(days=400))
+    _completed_game(-2, [4, 5, 6], today - datetime.timedelta(days=10))
+
+    assert archive.run(365) == 1
+
+    with sqlite3.connect(sqlite_db) as conn:
+        assert conn.execute("SELECT season, status, active FROM games WHERE group_id = -1").fetchall() == \
+            [(1, 'ARCHIVED', 0)]
+        assert conn.execute("SELECT status FROM games WHERE group_id = -2 AND active = 1").fetchone() == ('COMPLETED',)
+    assert database.get_game_status(-1) is None
+    # Still in /history, read from the archive
+    assert [(g, s, name) for g, s, _, name in database.get_draw_history(1)] == [(-1, 1, 'user2')]
+
+    # The group's next season continues the numbering
+    database.ensure_game_exists(-1)
+    with sqlite3.connect(sqlite_db) as conn:
+        assert conn.execute("SELECT season FROM games WHERE group_id = -1 AND active = 1").fetchone() == (2,)
+    # A second run finds nothing left to move
+    assert archive.run(365) == 0
+
+
+def test_games_changed_while_their_segment_is_written_stay_live(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_DIR', str(tmp_path / 'archive'))
+    old = datetime.date.today() - datetime.timedelta(days=400)
+    _completed_game(-1, [1, 2, 3], old)
+    _completed_game(-2, [4, 5, 6], old)
+    write = archive.Archive.write
+
+    def write_then_reschedule(self, records):
+        written = write(self, records)
+        # The group moves its exchange while the archiver is compressing it
+        soon = datetime.date.today() + datetime.timedelta(days=10)
+        database.update_exchange_date(-2, soon.isoformat(), soon)
+        return written
+    monkeypatch.setattr(archive.Archive, 'write', write_then_reschedule)
+
+    assert archive.run(365) == 1
+
+    assert database.get_game_status(-1) is None
+    assert database.get_game_status(-2) == 'COMPLETED'
+    assert database.get_archive().indexed([(-1, 1), (-2, 1)]) == {(-1, 1)}
@@ -0,0 +1,74 @@
+import collections
+import random
+
+import draw_engine
+
+# Six people and eleven exclusions leave exactly eight valid assignments
+PEOPLE = list(range(6))
+EXCLUSIONS = {(0, 4), (1, 3), (1, 4), (2, 1), (2, 3), (3, 1), (3, 2), (4, 1), (4, 2), (5, 1), (5, 2)}
+# Chi-square critical value for 7 degrees of freedom at p = 0.001
+CHI2_CRITICAL = 24.32
+SAMPLES = 8000
+
+
+def _chi_square(counts, outcomes):
+    expected = SAMPLES / len(outcomes)
+    return sum((counts[outcome] - expected) ** 2 / expected for outcome in outcomes)
+
+
+def _valid():
+    return draw_engine._enumerate(draw_engine._Rules(PEOPLE, EXCLUSIONS, None))
+
+
+def test_constrained_draw_is_uniform():
+    valid = _valid()
+    assert len(valid) == 8
+    rng = random.Random(7)
+    counts = collections.Counter(tuple(target for _, target in draw_engine.draw(PEOPLE, EXCLUSIONS, rng=rng))
+                                 for _ in range(SAMPLES))
+    assert set(counts) <= set(valid)
+    assert _chi_square(counts, valid) < CHI2_CRITICAL
+
+
+def test_mixing_chain_is_uniform_from_a_fixed_start():
+    valid = _valid()
+    rules = draw_engine._Rules(PEOPLE, EXCLUSIONS, None)
+    rng = random.Random(11)
+    counts = collections.Counter()
+    for _ in range(SAMPLES):
+        perm = list(valid[0])
+        draw_engine._mix(rules, perm, rng, list(range(len(perm))))
+        counts[tuple(perm)] += 1
+    assert set(counts) <= set(valid)
+    assert _chi_square(counts, valid) < CHI2_CRITICAL
+
+
+def test_three_people_reach_both_derangements():
+    # No swap of two targets leads from one derangement of three to the other
+    rules = draw_engine._Rules([0, 1, 2], (), None)
+    rng = random.Random(3)
+    seen = set()
+    for _ in range(50):
+        perm = [1, 2, 0]
+        draw_engine._mix(rules, perm, rng, list(range(len(perm))))
+        seen.add(tuple(perm))
+    assert seen == {(1, 2, 0), (2, 0, 1)}
+
+
+def test_repair_and_mix_is_uniform():
+    # Two teams of four: 576 valid assignments, past EXACT_MAX and too dense for rejection sampling
+    people = list(range(8))
+    rules = draw_engine._Rules(people, (), {p: p % 2 for p in people})
+    valid = draw_engine._enumerate(rules)
+    assert len(valid) == 576
+    rng = random.Random(5)
+    samples = 15000
+    counts = collections.Counter()
+    for _ in range(samples):
+        perm, touched = draw_engine._repair(rules, people, rng)
+        draw_engine._mix(rules, perm, rng, touched)
+        counts[tuple(perm)] += 1
+    assert set(counts) <= set(valid)
+    expected = samples / len(valid)
+    # Critical value for 575 degrees of freedom at p = 0.001
+    assert sum((counts[v] - expected) ** 2 / expected for v in valid) < 686
@@ -0,0 +1,66 @@
+import asyncio
+import sqlite3
+
+import database
+import draw_engine
+import draw_jobs
+
+
+def test_draw_roster_includes_members_enrolled_by_another_process(sqlite_db):
+    database.ensure_game_exists(-1)
+    database.add_participant(1, -1, 'user1')
+    database.add_participant(2, -1, 'user2')
+    assert len(database.get_participants_data(-1)) == 2
+
+    # What `python enroll.py` does from its own process: this one's cache doesn't hear about it
+    with sqlite3.connect(sqlite_db) as conn:
+        game_id = conn.execute("SELECT game_id FROM games WHERE group_id = -1 AND active = 1").fetchone()[0]
+        conn.execute("INSERT INTO participants (game_id, user_id, username, seq) VALUES (?, 3, 'user3', 3)",
+                     (game_id,))
+    assert len(database.get_participants_data(-1)) == 2
+
+    assert [user_id for user_id, _ in asyncio.run(draw_jobs.roster(-1))] == [1, 2, 3]
+
+
+def test_draw_keeps_teams_apart_and_avoids_last_season(sqlite_db, fake_bot):
+    members = [(user_id, f"user{user_id}", f"household{(user_id + 1) // 2}") for user_id in range(1, 7)]
+
+    async def draw_once():
+        assert (await draw_jobs.start(-1)).won
+        assert await draw_jobs.run(fake_bot, -1, await draw_jobs.roster(-1)) is not None
+        return {santa_id: target_id for santa_id, target_id, _ in database.get_assignments(-1)}
+
+    async def scenario():
+        database.add_participants_bulk(-1, members)
+        last_season = await draw_once()
+        # /cancel after the draw keeps the season as history and starts the next one
+        assert database.cancel_game_full(-1)
+        database.add_participants_bulk(-1, members)
+        draws = []
+        for _ in range(10):
+            draws.append(await draw_once())
+            database.cancel_game(-1)
+        return last_season, draws
+
+    last_season, draws = asyncio.run(scenario())
+    teams = {user_id: team for user_id, _, team in members}
+    for pairs in draws:
+        assert sorted(pairs) == sorted(pairs.values()) == list(range(1, 7))
+        for santa_id, target_id in pairs.items():
+            assert teams[santa_id] != teams[target_id]
+            assert last_season[santa_id] != target_id
+
+
+def test_impossible_teams_leave_the_game_joining(sqlite_db, fake_bot):
+    database.add_participants_bulk(-1, [(1, 'user1', 'a'), (2, 'user2', 'a'), (3, 'user3', None)])
+
+    async def scenario():
+        assert (await draw_jobs.start(-1)).won
+        try:
+            await draw_jobs.run(fake_bot, -1, await draw_jobs.roster(-1))
+        except draw_engine.NoValidAssignment as e:
+            return draw_jobs.no_draw_text(e)
+
+    assert "no group may be more than half" in asyncio.run(scenario())
+    assert database.get_game_status(-1) == 'JOINING'
+    assert database.get_assignments(-1) == []
@@ -0,0 +1,26 @@
+import pytest
+from click.testing import CliRunner
+
+import database
+import enroll
+from storage import GameStateError
+
+
+def test_bulk_add_refuses_once_the_draw_started(sqlite_db):
+    database.add_participants_bulk(-1, [(1, 'user1', None), (2, 'user2', None)])
+    database.transition_game(-1, 'start_draw')
+
+    with pytest.raises(GameStateError):
+        database.add_participants_bulk(-1, [(3, 'user3', None)])
+    assert [user_id for user_id, _ in database.get_participants_data(-1)] == [1, 2]
+
+
+def test_enroll_reports_a_game_past_joining(sqlite_db, tmp_path):
+    database.add_participants_bulk(-1, [(1, 'user1', None), (2, 'user2', None)])
+    database.transition_game(-1, 'start_draw')
+    roster_file = tmp_path / 'roster.csv'
+    roster_file.write_text("user_id,username\n3,user3\n")
+
+    result = CliRunner().invoke(enroll.main, ['-1', str(roster_file), '--db', sqlite_db, '--no-refresh'])
+    assert result.exit_code != 0
+    assert "is DRAWING; participants can only be added before the draw" in result.output
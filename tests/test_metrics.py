@@ -0,0 +1,15 @@
+import types
+
+import metrics
+
+
+def test_only_listed_query_functions_are_instrumented():
+    module = types.ModuleType('fake_database')
+    module.get_assignments = lambda group_id: [(1, 2, 'bob')]
+    module.write_lane = lambda group_id: 0
+    helper = module.write_lane
+
+    metrics.instrument_database(module, ('get_assignments',))
+    assert module.get_assignments(-1) == [(1, 2, 'bob')]
+    assert module.write_lane is helper
+    assert 'query="get_assignments"' in metrics.prometheus_text()
@@ -0,0 +1,65 @@
+import datetime
+import sqlite3
+
+import migrations
+from sqlite_backend import SQLiteBackend
+
+
+def _old_database(path, rows):
+    """A database from before any migration ran: the original games table only."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE games (group_id INTEGER PRIMARY KEY, status TEXT NOT NULL, "
+                 "date_started TEXT, exchange_date TEXT)")
+    conn.executemany("INSERT INTO games VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _migrate(path):
+    backend = SQLiteBackend(path)
+    backend.init()
+    backend.close()
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT group_id, exchange_on FROM games"))
+    finally:
+        conn.close()
+
+
+def test_exchange_on_is_resolved_against_the_games_start_date(tmp_path):
+    path = str(tmp_path / 'old.db')
+    _old_database(path, [
+        (-1, 'COMPLETED', '2025-12-15T10:00:00', 'jan 1st'),
+        (-2, 'JOINING', '2024-11-02T09:30:00.123456', 'Dec 24th'),
+        (-3, 'JOINING', '2024-11-02T09:30:00', 'whenever'),
+    ])
+    exchange_on = _migrate(path)
+    assert exchange_on[-1] == '2026-01-01'
+    assert exchange_on[-2] == '2024-12-24'
+    assert exchange_on[-3] is None
+
+
+def test_exchange_on_without_start_date_is_resolved_against_today(tmp_path):
+    path = str(tmp_path / 'old.db')
+    _old_database(path, [(-1, 'JOINING', None, 'Dec 24th')])
+    parsed = datetime.date.fromisoformat(_migrate(path)[-1])
+    assert (parsed.month, parsed.day) == (12, 24)
+    assert datetime.date.today() <= parsed < datetime.date.today() + datetime.timedelta(days=366)
+
+
+def test_dates_already_backfilled_against_the_migration_day_are_fixed(tmp_path):
+    path = str(tmp_path / 'santa.db')
+    _migrate(path)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO games (group_id, season, status, active, date_started, exchange_date, exchange_on) "
+                     "VALUES (?, 1, 'COMPLETED', 1, ?, ?, ?)", [
+                         (-1, '2024-11-02T09:30:00', 'Dec 24th', '2026-12-24'),   # Resolved against 2026
+                         (-2, '2025-11-20T09:30:00', 'jan 1st', '2026-01-01'),    # Set with /setdate
+                         (-3, '2024-11-02T09:30:00', '2027-01-05', '2027-01-05'),  # Year typed out
+                     ])
+    conn.execute(f"PRAGMA user_version = {migrations.MIGRATIONS.index(migrations._exchange_on_from_start)}")
+    conn.commit()
+    conn.close()
+
+    exchange_on = _migrate(path)
+    assert exchange_on == {-1: '2024-12-24', -2: '2026-01-01', -3: '2027-01-05'}
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import database
+import draw_jobs
+import outbox
+from conftest import FakeBot
+
+
+class StartingBot(FakeBot):
+    """Delivers like FakeBot, but the user sends /start while their first DM is being sent."""
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if not self.sent:
+            self.started = await outbox.deliver_pending(self, chat_id)
+        await super().send_message(chat_id, text, **kwargs)
+
+
+def test_start_during_drain_sends_each_message_once(sqlite_db):
+    now = time.time()
+    database.enqueue_outbox([(5, -100, 'assignment', 'You are the santa of @user6', None, 1, now - 1, 'Forbidden',
+                              None)])
+    bot = StartingBot()
+
+    asyncio.run(outbox.drain(SimpleNamespace(bot=bot)))
+
+    assert bot.started == 0
+    assert bot.sent == [(5, 'You are the santa of @user6')]
+
+
+def test_start_during_draw_sends_each_dm_once(sqlite_db):
+    group_id = -100
+    database.ensure_game_exists(group_id)
+    for user_id in range(1, 4):
+        database.add_participant(user_id, group_id, f"user{user_id}")
+    bot = StartingBot()
+
+    async def run():
+        assert (await draw_jobs.start(group_id)).won
+        return await draw_jobs.run(bot, group_id, database.get_participants_data(group_id))
+    asyncio.run(run())
+
+    assert bot.started == 0
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2, 3]
+
+
+def test_start_claims_messages_once_their_lease_runs_out(sqlite_db):
+    now = time.time()
+    database.enqueue_outbox([(5, -100, 'assignment', 'hi', None, 0, now - 1, None, None)])
+    assert [m.chat_id for m in database.claim_outbox(now, now + 60, 10)] == [5]
+
+    assert database.claim_outbox_for_chat(5, now, now + 60) == []
+    assert [m.chat_id for m in database.claim_outbox_for_chat(5, now + 61, now + 120)] == [5]
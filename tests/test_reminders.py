@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+
+import async_db
+import database
+import reminders
+from sharded_backend import ShardedSQLiteBackend
+from sqlite_backend import SQLiteBackend
+
+
+@pytest.fixture(params=['sqlite', 'sharded'])
+def backend_db(request, tmp_path):
+    path = str(tmp_path / 'santa.db')
+    database.set_backend(SQLiteBackend(path) if request.param == 'sqlite' else ShardedSQLiteBackend(path, 2))
+    database.init_db()
+    yield path
+    async_db.shutdown()
+    database.close_db()
+
+
+def _game(group_id, members, exchange_on, drawn):
+    database.ensure_game_exists(group_id)
+    for user_id in members:
+        database.add_participant(user_id, group_id, f"user{user_id}")
+    if drawn:
+        database.transition_game(group_id, 'start_draw')
+        database.update_assignments_and_status(group_id, [(m, members[(i + 1) % len(members)])
+                                                          for i, m in enumerate(members)])
+    database.update_exchange_date(group_id, exchange_on.isoformat(), exchange_on)
+
+
+def test_due_reminders_fetch_assignments_once(backend_db, monkeypatch):
+    today = datetime.date.today()
+    exchange_on = today + datetime.timedelta(days=7)
+    _game(-1, [1, 2, 3], exchange_on, drawn=True)
+    _game(-2, [4, 5], exchange_on, drawn=True)
+    _game(-3, [6, 7], exchange_on, drawn=False)
+
+    calls = []
+    fetch = database.get_assignments_for_groups
+    monkeypatch.setattr(database, 'get_assignments_for_groups', lambda group_ids: calls.append(group_ids) or fetch(group_ids))
+    monkeypatch.setattr(database, 'get_assignments', None)
+
+    now = datetime.datetime.combine(today, datetime.time(23))
+    due = reminders.due_reminders(now)
+
+    assert len(calls) == 1 and sorted(calls[0]) == [-2, -1]
+    assert sorted((r.group_id, r.recipient_id) for r in due) == \
+        [(-3, -3), (-2, -2), (-2, 4), (-2, 5), (-1, -1), (-1, 1), (-1, 2), (-1, 3)]
+    assert all(r.days_before == 7 for r in due)
+    assert "@user2" in next(r.text for r in due if r.recipient_id == 1)
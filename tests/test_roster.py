@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+import database
+import roster
+
+
+class RosterBot:
+    """Posts and edits messages; the first `floods` calls fail with RetryAfter."""
+
+    def __init__(self, floods=0):
+        self.floods = floods
+        self.calls = []
+
+    def _call(self, name, text):
+        if self.floods:
+            self.floods -= 1
+            raise RetryAfter(0.05)
+        self.calls.append((name, text))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._call('send', text)
+        return SimpleNamespace(message_id=len(self.calls))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self._call('edit', text)
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        pass
+
+
+def _join(publisher, bot, group_id, user_id):
+    database.add_participant(user_id, group_id, f"user{user_id}")
+    publisher.note_join(bot, group_id, f"@user{user_id}")
+
+
+def test_joins_are_folded_into_one_roster_message(sqlite_db):
+    async def scenario():
+        bot = RosterBot()
+        publisher = roster.RosterPublisher(window=0.01)
+        database.ensure_game_exists(-1)
+        for user_id in (1, 2, 3):
+            _join(publisher, bot, -1, user_id)
+        await asyncio.sleep(0.1)
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert len(bot.calls) == 1
+    name, text = bot.calls[0]
+    assert name == 'send'
+    assert "@user1, @user2 and @user3 joined the Secret Santa!" in text
+
+
+def test_flood_control_retries_the_batch(sqlite_db):
+    async def scenario():
+        bot = RosterBot(floods=1)
+        publisher = roster.RosterPublisher(window=0.01)
+        database.ensure_game_exists(-1)
+        _join(publisher, bot, -1, 1)
+        await asyncio.sleep(0.03)
+        # Joins during the wait go out with the batch that hit flood control
+        _join(publisher, bot, -1, 2)
+        await asyncio.sleep(0.2)
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert len(bot.calls) == 1
+    assert "@user1 and @user2 joined the Secret Santa!" in bot.calls[0][1]
+
+
+def test_publisher_keeps_no_locks_for_idle_groups(sqlite_db):
+    async def scenario():
+        bot = RosterBot()
+        publisher = roster.RosterPublisher(window=0.01)
+        for group_id in range(-1, -21, -1):
+            database.ensure_game_exists(group_id)
+            _join(publisher, bot, group_id, 1)
+        await asyncio.gather(*(publisher.refresh(bot, -1) for _ in range(3)))
+        await asyncio.sleep(0.1)
+        return publisher
+
+    publisher = asyncio.run(scenario())
+    assert publisher._locks == {} and publisher._pending == {} and publisher._tasks == {}
+    assert len(publisher._message_ids) == 20
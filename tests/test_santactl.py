@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+from click.testing import CliRunner
+
+import database
+import draw_jobs
+import santactl
+from conftest import FakeBot
+
+
+def _draw(group_id, members, bot):
+    database.ensure_game_exists(group_id)
+    for user_id in range(1, members + 1):
+        database.add_participant(user_id, group_id, f"user{user_id}")
+
+    async def run():
+        assert (await draw_jobs.start(group_id)).won
+        return await draw_jobs.run(bot, group_id, database.get_participants_data(group_id))
+    return asyncio.run(run())
+
+
+def _dm_stats(path):
+    result = CliRunner().invoke(santactl.cli, ['--db', path, 'stats', '--json'])
+    assert result.exit_code == 0, result.output
+    return json.loads(result.output)['dms']
+
+
+def test_dm_stats_when_every_dm_is_delivered(sqlite_db):
+    results = _draw(-100, 10, FakeBot())
+    assert all(r.ok for r in results)
+
+    dms = _dm_stats(sqlite_db)
+    assert dms['assignment_dms'] == 10
+    assert dms['failed_first_try'] == 0
+    assert dms['failure_rate'] == 0
+
+
+def test_dm_stats_counts_failed_first_sends(sqlite_db):
+    _draw(-100, 10, FakeBot(blocked={3, 7}))
+
+    dms = _dm_stats(sqlite_db)
+    assert dms['failed_first_try'] == 2
+    assert dms['outbox'] == {'pending': 2}
+    assert dms['failure_rate'] == 0.2
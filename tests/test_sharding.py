@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+import async_db
+import database
+import reshard
+import santactl
+from sharded_backend import ShardedSQLiteBackend, shard_index, shard_paths
+from sqlite_backend import SQLiteBackend
+
+GROUPS = [-1, -2, -3, -4, -5, -6]
+
+
+@pytest.fixture
+def sharded_db(tmp_path):
+    """Two shards holding a completed game in each of GROUPS; yields the --db path."""
+    path = str(tmp_path / 'santa.db')
+    database.set_backend(ShardedSQLiteBackend(path, 2))
+    database.init_db()
+    for group_id in GROUPS:
+        database.ensure_game_exists(group_id)
+        for user_id in (1, 2, 3):
+            database.add_participant(user_id, group_id, f"user{user_id}")
+        database.transition_game(group_id, 'start_draw')
+        database.update_assignments_and_status(group_id, [(1, 2), (2, 3), (3, 1)])
+    async_db.shutdown()
+    database.close_db()
+    yield path
+
+
+def _santactl(*args):
+    result = CliRunner().invoke(santactl.cli, list(args))
+    assert result.exit_code == 0, result.output
+    return result.stdout
+
+
+def test_santactl_opens_the_shard_set(sharded_db):
+    assert {shard_index(group_id, 2) for group_id in GROUPS} == {0, 1}
+    stats = json.loads(_santactl('--db', sharded_db, 'stats', '--json'))
+    assert stats['games'] == len(GROUPS)
+    assert stats['games_per_status'] == {'COMPLETED': len(GROUPS)}
+
+    rows = [json.loads(line) for line in _santactl('--db', sharded_db, 'assignments').splitlines()]
+    assert len(rows) == 3 * len(GROUPS)
+    # Every group's rows stay joined to its own game, whichever shard it's in
+    assert {row['group_id'] for row in rows} == set(GROUPS)
+    assert "@user1 -> @user2" in _santactl('--db', sharded_db, 'show', '-4')
+
+
+def test_unsharded_backend_refuses_to_start_next_to_shards(sharded_db):
+    database.set_backend(SQLiteBackend(sharded_db))
+    try:
+        with pytest.raises(RuntimeError, match='SQLITE_SHARDS=2'):
+            database.init_db()
+    finally:
+        database.close_db()
+
+
+def test_failed_reshard_leaves_no_shard_files(sharded_db, monkeypatch):
+    monkeypatch.setattr(reshard, '_counts', lambda conns: {'games': len(conns)})
+    result = CliRunner().invoke(reshard.main, ['4', '--db', sharded_db, '--from-shards', '2'])
+    assert result.exit_code != 0
+    assert "Row counts don't match" in result.output
+    assert not [path for path in os.listdir(os.path.dirname(sharded_db)) if '-of-4' in path]
+
+
+def test_sharded_backend_refuses_a_partial_or_empty_layout(sharded_db):
+    os.remove(shard_paths(sharded_db, 2)[1])
+    database.set_backend(ShardedSQLiteBackend(sharded_db, 2))
+    try:
+        with pytest.raises(RuntimeError, match='is missing'):
+            database.init_db()
+    finally:
+        database.close_db()
+
+    # Empty shard files in the new layout don't hide the games still in the old one
+    for path in shard_paths(sharded_db, 3):
+        sqlite3.connect(path).close()
+    database.set_backend(ShardedSQLiteBackend(sharded_db, 3))
+    try:
+        with pytest.raises(RuntimeError, match='reshard.py 3'):
+            database.init_db()
+    finally:
+        database.close_db()
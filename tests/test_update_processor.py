@@ -0,0 +1,69 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+import admission
+import update_processor
+
+
+def test_backlog_queue_counts_updates_until_task_done():
+    async def scenario():
+        queue = update_processor.BacklogQueue(2)
+        await queue.put('a')
+        await queue.put('b')
+        # Taken off the queue but not finished: still holds its capacity
+        assert await queue.get() == 'a'
+        third = asyncio.create_task(queue.put('c'))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        assert queue.outstanding == 2
+
+        queue.task_done()
+        await asyncio.wait_for(third, 1)
+        assert queue.outstanding == 2
+        assert [queue.get_nowait(), queue.get_nowait()] == ['b', 'c']
+
+    asyncio.run(scenario())
+
+
+def _command(update_id, chat_id, user_id, text):
+    user = User(user_id, f'user{user_id}', is_bot=False)
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), Chat(chat_id, Chat.SUPERGROUP),
+                      from_user=user, text=text)
+    return Update(update_id, message=message)
+
+
+def test_flood_beyond_max_admitted_is_shed():
+    async def scenario():
+        processor = update_processor.PerChatUpdateProcessor(
+            1, max_admitted=5, admission=admission.AdmissionControl(shed_backlog=10))
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(update_id):
+            await release.wait()
+            handled.append(update_id)
+
+        # Distinct chats and users, so only the backlog (not a rate limit) can drop them
+        flood = [processor.process_update(_command(i, -1000 - i, 1000 + i, '/participants'), handler(i))
+                 for i in range(50)]
+        tasks = [asyncio.create_task(call) for call in flood]
+        await asyncio.sleep(0.01)
+        # Five hold the base semaphore, the rest wait for it; all count towards the backlog
+        assert processor.outstanding <= 11
+        release.set()
+        await asyncio.gather(*tasks)
+        return processor, handled
+
+    processor, handled = asyncio.run(scenario())
+    assert processor.dropped == 50 - len(handled)
+    assert 0 < len(handled) <= 11
+    assert processor.outstanding == 0
+
+
+def test_only_commands_and_buttons_are_limited():
+    control = admission.AdmissionControl(shed_backlog=0, chat_backlog=0)
+    # A date typed in reply to /setdate, with the chat's backlog full
+    assert control.check(_command(1, -1, 1, 'Dec 24th'), 500, 500) is None
+    assert control.check(_command(2, -1, 1, '/participants'), 500, 500) == 'overload'
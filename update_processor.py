@@ -0,0 +1,193 @@
+"""Concurrent update processing that keeps each chat's updates in order.
+
+python-telegram-bot's concurrent mode runs every update as its own task. That lets one
+group's slow /draw stop holding up everyone else, but two updates from the same chat
+could then run at the same time or out of order (a join racing the draw, or the reply to
+/setdate being handled before /setdate itself). PerChatUpdateProcessor adds a lock per
+chat: updates for different chats run in parallel, updates for one chat run one at a
+time in arrival order.
+
+The chat lock is taken before a global slot, so a busy group's queued updates wait
+without using up slots that other groups could run in.
+
+With an AdmissionControl (see admission.py), each update is checked as soon as it is handed
+over, before it waits for anything: rate-limited, backlogged or shed updates are dropped
+without running their handler.
+
+In concurrent mode the Application takes each update off its queue as soon as it arrives
+and starts a task for it, so a maxsize on a plain asyncio.Queue never fills. BacklogQueue
+counts an update until its handler has finished, which makes the bound real.
+"""
+import asyncio
+import collections
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+
+class BacklogQueue(asyncio.Queue):
+    """An update queue bounded by the updates queued *or still being processed*.
+
+    put() takes capacity and task_done(), which the Application calls once an update's
+    handler has finished, gives it back. When `capacity` updates are outstanding put()
+    waits: the webhook holds Telegram's request and polling stops fetching until a handler
+    finishes, so a burst backs up at Telegram instead of in memory.
+    """
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+        self.outstanding = 0
+        self._room = collections.deque()
+
+    async def put(self, item):
+        while self.outstanding >= self.capacity:
+            waiter = asyncio.get_running_loop().create_future()
+            self._room.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # Woken but cancelled before using the room; pass it on
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._room:
+                    self._room.remove(waiter)
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        if self.outstanding >= self.capacity:
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+        self.outstanding += 1
+
+    def task_done(self):
+        super().task_done()
+        self.outstanding -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._room:
+            waiter = self._room.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_running, max_admitted=1000, admission=None):
+        # The base class semaphore bounds updates admitted (waiting or running); ours bounds
+        # the ones actually running handlers
+        super().__init__(max(max_admitted, max_running, 2))
+        self.max_running = max_running
+        self.admission = admission
+        self._slots = asyncio.Semaphore(max_running)
+        self._chats = {}     # chat_id -> [lock, updates holding or waiting for it]
+        self.waiting_for_chat = 0
+        self.waiting_for_slot = 0
+        self.running = 0
+        self.dropped = 0
+        self.outstanding = 0
+        self._outstanding_by_chat = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def chat_key(update):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Admission runs before the base class semaphore, so updates still waiting for it are
+        # counted in the backlog, and can be shed like any other
+        key = self.chat_key(update)
+        if self.admission is not None and key is not None:
+            reason = self.admission.check(update, self.outstanding - self.running,
+                                          self._outstanding_by_chat.get(key, 0))
+            if reason is not None:
+                coroutine.close()
+                self.dropped += 1
+                await self.admission.reject(update, reason)
+                return
+
+        self.outstanding += 1
+        if key is not None:
+            self._outstanding_by_chat[key] = self._outstanding_by_chat.get(key, 0) + 1
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.outstanding -= 1
+            if key is not None:
+                self._outstanding_by_chat[key] -= 1
+                if not self._outstanding_by_chat[key]:
+                    del self._outstanding_by_chat[key]
+
+    async def do_process_update(self, update, coroutine):
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        lock = entry[0]
+        entry[1] += 1
+        start = time.perf_counter()
+        self.waiting_for_chat += 1
+        try:
+            # asyncio.Lock wakes waiters first-come first-served, which keeps arrival order
+            await lock.acquire()
+        except BaseException:
+            self.waiting_for_chat -= 1
+            self._release_chat(key, entry)
+            raise
+        self.waiting_for_chat -= 1
+        metrics.observe('santa_update_wait_seconds', 'chat', time.perf_counter() - start,
+                        help_text='Time updates waited before running', label='stage')
+        try:
+            await self._run(coroutine)
+        finally:
+            lock.release()
+            self._release_chat(key, entry)
+
+    def _release_chat(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._chats[key]
+
+    async def _run(self, coroutine):
+        start = time.perf_counter()
+        self.waiting_for_slot += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting_for_slot -= 1
+        metrics.observe('santa_update_wait_seconds', 'slot', time.perf_counter() - start,
+                        help_text='Time updates waited before running', label='stage')
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def depth(self):
+        """Queue depth by stage, for the metrics gauge and /stats."""
+        return {
+            'outstanding': self.outstanding,
+            'waiting_for_chat': self.waiting_for_chat,
+            'waiting_for_slot': self.waiting_for_slot,
+            'running': self.running,
+            'chats': len(self._chats),
+            'dropped': self.dropped,
+        }